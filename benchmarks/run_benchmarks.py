@@ -0,0 +1,257 @@
+#!/usr/bin/env python
+
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+
+import click
+import numpy as np
+
+ROOT_PATH = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT_PATH)
+
+import traffic_analysis as ta
+from metric_engine import compute_all_pairs, compute_cascade
+from metric_registry import get_metrics
+from ranking import get_correct_servers, get_ranks, get_rank_counts
+from trace_dtypes import DTYPE_POLICIES, parse_feature_dtypes, compact_node_traces, get_num_bytes
+from trace_loader import DatabaseTraceSource
+from trace_tensor import TraceTensor
+from trace_stream import TraceStream
+from process_pool import ComputeExecutor
+from result_writer import ResultWriter
+from profiling import Profiler
+
+from synthetic import SyntheticSetup
+from sqlite_pool import SQLiteConnectionPool
+
+DB_NAME = 'benchmark'
+# modules the command line must not import before a metric or the DB is used
+STARTUP_EXCLUDED_MODULES = ['sklearn', 'scipy', 'MySQLdb', 'twisted.internet.reactor', 'scalar_packet_count', 'distance_pca_pearson',
+    'distance_pearson', 'distance_rmse', 'distance_mutinfo', 'distance_window_xcorr']
+
+def best_time(function, repeat):
+    """
+    Minimum wall time of repeat calls, the least noisy estimate.
+    """
+    timings = []
+    for i in xrange(0, repeat):
+        start_time = time.time()
+        function()
+        timings.append(time.time() - start_time)
+    return min(timings)
+
+def get_git_commit():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', 'HEAD'], cwd=os.path.dirname(os.path.abspath(__file__))).strip()
+    except Exception:
+        return None
+
+def split_traces(synthetic_setup, node_traces):
+    client_traces = [node_traces[client_index] for client_index in xrange(1, synthetic_setup.num_clients + 1)]
+    server_traces = [node_traces[server_index] for server_index in xrange(31, synthetic_setup.num_servers + 31)]
+    return client_traces, server_traces
+
+def bench_scalar_metrics(metrics, client_traces, server_traces, repeat):
+    """
+    Seconds per (client, server) pair of the scalar apply_* functions.
+    """
+    results = {}
+    for metric in metrics:
+        results[metric.name] = best_time(lambda: metric.apply_scalar(client_traces[0], server_traces[0]), repeat)
+    return results
+
+def bench_batch_metrics(metrics, client_traces, server_traces, repeat, dtype=np.float64):
+    """
+    Seconds for all pairs of a repetition of the batch_* functions. The
+    tensors are rebuilt for each call, so memoized data is not reused.
+    """
+    results = {}
+    for metric in metrics:
+        results[metric.name] = best_time(lambda: metric.apply_batch(TraceTensor(client_traces, dtype), TraceTensor(server_traces, dtype)), repeat)
+    return results
+
+def get_trace_bytes(node_traces):
+    """
+    Bytes held by the traces of a repetition under each dtype policy.
+    """
+    results = {}
+    for policy in DTYPE_POLICIES:
+        dtypes = parse_feature_dtypes(policy, ta.NUM_FEATURES)
+        results[policy] = get_num_bytes(compact_node_traces(node_traces, dtypes))
+    return results
+
+def bench_stream_metrics(metrics, client_traces, server_traces, chunk_rows, repeat):
+    """
+    Seconds for all pairs of a repetition of the stream_* functions.
+    """
+    results = {}
+    for metric in metrics:
+        results[metric.name] = best_time(lambda: metric.apply_stream(TraceStream(client_traces, chunk_rows), TraceStream(server_traces, chunk_rows)), repeat)
+    return results
+
+def bench_cascade(metrics, client_traces, server_traces, shortlist_size, repeat):
+    """
+    Seconds for all metrics on all pairs of a repetition, with and without
+    the cascade pruning.
+    """
+    return {
+        'all_pairs': best_time(lambda: compute_all_pairs(client_traces, server_traces, metrics), repeat),
+        'cascade': best_time(lambda: compute_cascade(client_traces, server_traces, metrics, shortlist_size), repeat)
+    }
+
+def bench_startup(repeat):
+    """
+    Seconds until the command line has printed its help, each run in a new
+    interpreter like a job started by a scheduler.
+    """
+    script = os.path.join(ROOT_PATH, 'traffic_analysis.py')
+    with open(os.devnull, 'w') as devnull:
+        return {
+            'help': best_time(lambda: subprocess.check_call([sys.executable, script, '--help'], stdout=devnull), repeat),
+            'analyze_help': best_time(lambda: subprocess.check_call([sys.executable, script, 'analyze', '--help'], stdout=devnull), repeat)
+        }
+
+def get_startup_modules():
+    """
+    Modules of STARTUP_EXCLUDED_MODULES imported by traffic_analysis, in a new
+    interpreter.
+    """
+    code = 'import sys; sys.path.insert(0, {!r}); import traffic_analysis; print \' \'.join(name for name in {!r} if name in sys.modules)'.format(
+        ROOT_PATH, STARTUP_EXCLUDED_MODULES)
+    return subprocess.check_output([sys.executable, '-c', code]).split()
+
+def bench_ranking(setup_parameters, scores, repeat):
+    def rank_all():
+        correct_servers = get_correct_servers(setup_parameters.setup, setup_parameters.num_servers, scores.shape[1])
+        ranks = get_ranks(scores, correct_servers, [metric.direction for metric in setup_parameters.metrics])
+        get_rank_counts(ranks, setup_parameters.top_k)
+
+    return best_time(rank_all, repeat)
+
+def bench_end_to_end(synthetic_setup, metrics, repeat):
+    """
+    Seconds for analyze_setups on one setup in a SQLite stand-in for the
+    MySQL pool, including loading and writing the results.
+    """
+    dbpool = SQLiteConnectionPool(DB_NAME)
+    dbpool.create_tables()
+    dbpool.insert_setup(1, synthetic_setup)
+
+    def analyze():
+        profiler = Profiler()
+        source = DatabaseTraceSource(dbpool, DB_NAME, 10000, profiler)
+        writer = ResultWriter(dbpool, DB_NAME, None, True, 1, profiler)
+        executor = ComputeExecutor(None, 1)
+        context = ta.AnalysisContext(source, dbpool, DB_NAME, writer, executor, False, None, metrics, profiler)
+
+        failures = []
+        deferred = ta.analyze_setups(None, context, '1')
+        deferred.addErrback(failures.append)
+        if failures:
+            failures[0].raiseException()
+
+    return best_time(analyze, repeat)
+
+@click.command()
+@click.option('--setup', default='directed', type=click.Choice(['directed', 'undirected']), help='Network setup of the synthetic data')
+@click.option('--num-clients', default=10, type=int, help='Number of clients')
+@click.option('--num-reps', default=2, type=int, help='Number of repetitions for the end-to-end benchmark')
+@click.option('--rows', default=2000, type=int, help='Rows per trace')
+@click.option('--correlation', default=0.8, type=float, help='Correlation between a client and its server')
+@click.option('--seed', default=1, type=int, help='Seed of the synthetic data')
+@click.option('--repeat', default=3, type=int, help='Repetitions of each measurement, the best one is kept')
+@click.option('--metrics', default=None, type=str, callback=ta.parse_metrics, help='Comma separated subset of the metrics')
+@click.option('--stream-chunk-rows', default=1024, type=click.IntRange(1, None), help='Chunk size of the streaming metrics')
+@click.option('--cascade', default=3, type=click.IntRange(1, None), help='Shortlist size of the cascade benchmark')
+@click.option('--output', default='benchmark_results.json', type=click.Path(), help='JSON file for the results')
+@click.option('--compare', default=None, type=click.Path(exists=True), help='Earlier results file to compare against')
+def main(setup, num_clients, num_reps, rows, correlation, seed, repeat, metrics, stream_chunk_rows, cascade, output, compare):
+    """
+    Times the metrics, the ranking and the full analysis on synthetic
+    traces and writes the results as JSON.
+    """
+    synthetic_setup = SyntheticSetup(setup, num_clients, num_reps, rows, correlation, seed)
+    node_traces = synthetic_setup.generate_repetition(1)
+    client_traces, server_traces = split_traces(synthetic_setup, node_traces)
+    setup_parameters = ta.SetupParameters(num_reps, num_clients, setup, 1, ta.FEATURES, ta.NUM_FEATURES, metrics)
+
+    print 'Scalar metrics'
+    scalar_results = bench_scalar_metrics(metrics, client_traces, server_traces, repeat)
+    print 'Batch metrics'
+    batch_results = bench_batch_metrics(metrics, client_traces, server_traces, repeat)
+    print 'Batch metrics, float32'
+    batch_float32_results = bench_batch_metrics(metrics, client_traces, server_traces, repeat, np.float32)
+    print 'Stream metrics'
+    stream_results = bench_stream_metrics(metrics, client_traces, server_traces, stream_chunk_rows, repeat)
+    print 'Cascade'
+    cascade_results = bench_cascade(metrics, client_traces, server_traces, cascade, repeat)
+    print 'Ranking'
+    scores = compute_all_pairs(client_traces, server_traces, metrics)
+    ranking_result = bench_ranking(setup_parameters, scores, repeat)
+    print 'End to end'
+    end_to_end_result = bench_end_to_end(synthetic_setup, metrics, repeat)
+    print 'Startup'
+    startup_results = bench_startup(repeat)
+    startup_modules = get_startup_modules()
+
+    results = {
+        'parameters': {
+            'setup': setup,
+            'num_clients': num_clients,
+            'num_reps': num_reps,
+            'rows': rows,
+            'correlation': correlation,
+            'seed': seed,
+            'repeat': repeat,
+            'stream_chunk_rows': stream_chunk_rows,
+            'cascade': cascade,
+            'metrics': [metric.name for metric in metrics]
+        },
+        'environment': {
+            'git_commit': get_git_commit(),
+            'python': platform.python_version(),
+            'numpy': np.__version__,
+            'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S')
+        },
+        'seconds': {
+            'scalar_per_pair': scalar_results,
+            'batch_per_repetition': batch_results,
+            'batch_float32_per_repetition': batch_float32_results,
+            'stream_per_repetition': stream_results,
+            'cascade_per_repetition': cascade_results,
+            'ranking_per_repetition': ranking_result,
+            'end_to_end': end_to_end_result,
+            'startup': startup_results
+        },
+        'trace_bytes': get_trace_bytes(node_traces),
+        'startup_modules': startup_modules
+    }
+
+    with open(output, 'w') as output_file:
+        json.dump(results, output_file, indent=2, sort_keys=True)
+
+    print_results(results['seconds'], None if compare is None else json.load(open(compare))['seconds'])
+    for policy, num_bytes in sorted(results['trace_bytes'].iteritems()):
+        print '{:<50} {:12d} bytes per repetition'.format('trace_bytes.' + policy, num_bytes)
+    if startup_modules:
+        print 'Imported at startup, should be lazy: ' + ', '.join(startup_modules)
+
+def print_results(seconds, baseline, prefix=''):
+    """
+    Prints all timings, with the ratio to the baseline if one is given.
+    """
+    for key, value in sorted(seconds.iteritems()):
+        baseline_value = None if baseline is None else baseline.get(key)
+        if isinstance(value, dict):
+            print_results(value, baseline_value, prefix + key + '.')
+        elif baseline_value:
+            print '{:<50} {:12.6f} s  {:6.2f}x baseline'.format(prefix + key, value, value / baseline_value)
+        else:
+            print '{:<50} {:12.6f} s'.format(prefix + key, value)
+
+if __name__ == '__main__':
+    main()
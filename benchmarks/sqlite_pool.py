@@ -0,0 +1,84 @@
+#!/usr/bin/env python
+
+import sqlite3
+
+from twisted.internet import defer
+
+class SQLiteTransaction():
+    """
+    Minimal stand-in for the adbapi Transaction, translates the MySQLdb
+    parameter style to the sqlite3 one.
+    """
+
+    def __init__(self, connection):
+        self.cursor = connection.cursor()
+
+    def execute(self, query, args=()):
+        return self.cursor.execute(query.replace('%s', '?'), args)
+
+    def executemany(self, query, rows):
+        return self.cursor.executemany(query.replace('%s', '?'), rows)
+
+    def fetchall(self):
+        return self.cursor.fetchall()
+
+    def fetchmany(self, size):
+        return self.cursor.fetchmany(size)
+
+    def fetchone(self):
+        return self.cursor.fetchone()
+
+class SQLiteConnectionPool():
+    """
+    In-memory SQLite database with the runQuery/runInteraction interface of
+    adbapi.ConnectionPool. Queries run synchronously, the returned deferreds
+    have already fired. The database is attached under db_name, so the
+    db_name.table queries of the analysis work unchanged.
+    """
+
+    def __init__(self, db_name):
+        self.connection = sqlite3.connect(':memory:')
+        self.connection.execute("ATTACH ':memory:' AS {}".format(db_name))
+        self.db_name = db_name
+        self.num_queries = 0
+
+    def runQuery(self, query, args=()):
+        self.num_queries += 1
+        try:
+            return defer.succeed(self.connection.execute(query.replace('%s', '?'), args).fetchall())
+        except Exception:
+            return defer.fail()
+
+    def runInteraction(self, interaction, *args, **kwargs):
+        self.num_queries += 1
+        try:
+            result = interaction(SQLiteTransaction(self.connection), *args, **kwargs)
+            self.connection.commit()
+            return defer.succeed(result)
+        except Exception:
+            self.connection.rollback()
+            return defer.fail()
+
+    def create_tables(self):
+        self.connection.executescript('''
+            CREATE TABLE {db}.setups_submission (id INTEGER PRIMARY KEY, setup TEXT, num_clients INTEGER, repetitions INTEGER);
+            CREATE TABLE {db}.traces_submission (id INTEGER PRIMARY KEY, setup_id INTEGER, repetition INTEGER, node_id INTEGER,
+                packet_count REAL, inter_arrival_time REAL, packet_length REAL, time_to_live REAL, window_size REAL);
+            CREATE TABLE {db}.ta_submission (setup_id INTEGER, metric TEXT, feature TEXT, success_avg REAL, success_sd REAL,
+                num_successes INTEGER, num_fails INTEGER);
+        '''.format(db=self.db_name))
+
+    def insert_setup(self, setup_id, synthetic_setup):
+        """
+        Inserts a SyntheticSetup with all its traces.
+        """
+        self.connection.execute('INSERT INTO {}.setups_submission VALUES (?, ?, ?, ?)'.format(self.db_name),
+            (setup_id, synthetic_setup.setup, synthetic_setup.num_clients, synthetic_setup.num_reps))
+
+        for repetition in xrange(1, synthetic_setup.num_reps + 1):
+            node_traces = synthetic_setup.generate_repetition(repetition)
+            for node_id, trace in sorted(node_traces.iteritems()):
+                rows = [(setup_id, repetition, node_id) + tuple(row) for row in trace.tolist()]
+                self.connection.executemany('INSERT INTO {}.traces_submission (setup_id, repetition, node_id, packet_count, inter_arrival_time, packet_length, time_to_live, window_size) VALUES (?, ?, ?, ?, ?, ?, ?, ?)'.format(self.db_name), rows)
+
+        self.connection.commit()
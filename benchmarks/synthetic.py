@@ -0,0 +1,73 @@
+#!/usr/bin/env python
+
+import numpy as np
+
+# typical value ranges of the traffic features, in the order of
+# traffic_analysis.FEATURES
+FEATURE_SCALES = np.array([1.0, 0.01, 1500.0, 64.0, 65535.0])
+INTEGER_FEATURES = np.array([True, False, True, True, True])
+
+class SyntheticSetup():
+    """
+    Describes a synthetic setup shaped like a setups_submission row.
+
+    Constructor Arguments:
+    setup: 'directed' (one server per client) or 'undirected' (two servers)
+    num_clients: number of clients, node ids 1..num_clients
+    num_reps: number of repetitions
+    num_rows: rows per server trace, client traces are up to 5% shorter
+    correlation: correlation between a client trace and the trace of its
+        server, 0 gives unrelated traces
+    seed: seed of the random generator, the same seed gives the same traces
+    """
+
+    def __init__(self, setup, num_clients, num_reps, num_rows, correlation, seed):
+        self.setup = setup
+        self.num_clients = num_clients
+        self.num_reps = num_reps
+        self.num_rows = num_rows
+        self.correlation = correlation
+        self.seed = seed
+
+        if setup == 'directed':
+            self.num_servers = num_clients
+        else:
+            self.num_servers = 2
+
+    def get_server_index(self, client_index):
+        """
+        0 based index of the server a client is connected to.
+        """
+        if self.setup == 'directed':
+            return client_index - 1
+        if client_index <= self.num_clients / 2:
+            return 0
+        return 1
+
+    def generate_repetition(self, repetition):
+        """
+        Returns the dict node_id -> trace array (rows, 5) of a repetition.
+        """
+        rng = np.random.RandomState(self.seed * 1000 + repetition)
+
+        server_traces = []
+        for server in xrange(0, self.num_servers):
+            server_traces.append(rng.rand(self.num_rows, len(FEATURE_SCALES)))
+
+        node_traces = {}
+        for server, trace in enumerate(server_traces):
+            node_traces[31 + server] = scale(trace)
+
+        noise_weight = np.sqrt(1 - self.correlation ** 2)
+        for client_index in xrange(1, self.num_clients + 1):
+            num_rows = self.num_rows - rng.randint(0, max(1, self.num_rows / 20))
+            base = server_traces[self.get_server_index(client_index)][:num_rows]
+            noise = rng.rand(num_rows, len(FEATURE_SCALES))
+            node_traces[client_index] = scale(self.correlation * base + noise_weight * noise)
+
+        return node_traces
+
+def scale(trace):
+    scaled = trace * FEATURE_SCALES
+    scaled[:, INTEGER_FEATURES] = np.round(scaled[:, INTEGER_FEATURES])
+    return scaled
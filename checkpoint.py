@@ -0,0 +1,52 @@
+#!/usr/bin/env python
+
+import json
+import os
+
+class Checkpoint():
+    """
+    Local file with the ResultsArray counts and rank sums of every computed
+    repetition, one JSON object per line. A resumed run reuses the counts of
+    repetitions that are already in the file instead of computing them again.
+
+    Constructor Arguments:
+    path: checkpoint file, created if it does not exist. Lines from an
+        interrupted write and lines without rank counts, written before the
+        rank results existed, are ignored.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.repetitions = {}
+
+        if os.path.exists(path):
+            with open(path) as checkpoint_file:
+                for line in checkpoint_file:
+                    try:
+                        entry = json.loads(line)
+                        counts = (entry['corrects'], entry['fails'], entry['top_k_hits'], entry['reciprocal_ranks'])
+                    except (ValueError, KeyError):
+                        continue
+                    self.repetitions[(str(entry['setup_id']), entry['repetition'], entry['metrics'])] = counts
+
+        self.checkpoint_file = open(path, 'a')
+
+    def get_repetition(self, setup_id, repetition, metrics):
+        """
+        Returns the (corrects, fails, top_k_hits, reciprocal_ranks) matrices
+        (metrics x features) of a repetition or None if the repetition is not
+        in the checkpoint. metrics is the key of the metrics and settings the
+        counts belong to.
+        """
+        return self.repetitions.get((str(setup_id), repetition, metrics))
+
+    def put_repetition(self, setup_id, repetition, metrics, corrects, fails, top_k_hits, reciprocal_ranks):
+        self.repetitions[(str(setup_id), repetition, metrics)] = (corrects, fails, top_k_hits, reciprocal_ranks)
+
+        entry = {'setup_id': setup_id, 'repetition': repetition, 'metrics': metrics, 'corrects': corrects, 'fails': fails,
+            'top_k_hits': top_k_hits, 'reciprocal_ranks': reciprocal_ranks}
+        self.checkpoint_file.write(json.dumps(entry) + '\n')
+        self.checkpoint_file.flush()
+
+    def close(self):
+        self.checkpoint_file.close()
@@ -1,30 +1,216 @@
 #!/usr/bin/env python
 
-from sklearn.metrics import mutual_info_score
+from itertools import izip
 
-def apply_mutinfo(client_trace, server_trace):
-    scores = []
-    for feature in xrange(0, len(client_trace[0])):
-        try:
-            feature_client = [row[feature] for row in client_trace]
-            feature_server = [row[feature] for row in server_trace]
-        except Exception as err:
-            print 'Could not get feature from matrix for mutual info: ', err
+import numpy as np
 
-        try:
-            limitation = min(len(feature_client), len(feature_server))
+from trace_tensor import TraceTensor
+from metric_defaults import DEFAULT_BINS, DEFAULT_BINNING
 
-            feature_client = feature_client[0:limitation]
-            feature_server = feature_server[0:limitation]
-        except Excetption as err:
-            print 'Could not get min for Mutual Info: ', err
+# rows per block when the joint histograms are accumulated
+ROW_BLOCK_SIZE = 4096
 
-        try:
-            score = mutual_info_score(feature_client, feature_server)
-            scores.append(score)
+def apply_mutinfo(client_trace, server_trace, bins=DEFAULT_BINS, binning=DEFAULT_BINNING):
+    scores = batch_mutinfo(TraceTensor([client_trace]), TraceTensor([server_trace]), bins, binning)
+    return list(scores[0, 0])
 
-        except Exception as err:
-            print 'Error applying Pearson: ', err
-            scores.append(0)
+def batch_mutinfo(client_tensor, server_tensor, bins=DEFAULT_BINS, binning=DEFAULT_BINNING):
+    """
+    Mutual information (in nats) of every client with every server for each
+    feature, shape (clients, servers, features). Both traces of a pair are
+    truncated to the shorter one.
+
+    Each node's feature columns are discretized into bins once (see
+    get_bin_codes), the joint histograms of all pairs are then accumulated
+    with one matrix product per block of rows and feature.
+    """
+    client_codes = get_bin_codes(client_tensor, bins, binning)
+    server_codes = get_bin_codes(server_tensor, bins, binning)
+
+    scores = np.zeros((client_tensor.num_nodes, server_tensor.num_nodes, client_tensor.num_features), dtype=np.float64)
+
+    for feature in xrange(0, client_tensor.num_features):
+        joint = get_joint_histograms(client_codes[:, :, feature], server_codes[:, :, feature], bins)
+        scores[:, :, feature] = get_mutual_information(joint)
+
+    return scores
+
+def pairs_mutinfo(client_tensor, server_tensor, shortlist, bins=DEFAULT_BINS, binning=DEFAULT_BINNING):
+    """
+    batch_mutinfo of every client with the servers of its shortlist row,
+    shape (clients, candidates, features). The joint histograms are only
+    accumulated for the shortlisted pairs.
+    """
+    client_codes = get_bin_codes(client_tensor, bins, binning)
+    server_codes = get_bin_codes(server_tensor, bins, binning)
+
+    scores = np.zeros(shortlist.shape + (client_tensor.num_features,), dtype=np.float64)
+    for client, candidates in enumerate(shortlist):
+        candidate_codes = server_codes[candidates]
+        for feature in xrange(0, client_tensor.num_features):
+            joint = get_joint_histograms(client_codes[client:client + 1, :, feature], candidate_codes[:, :, feature], bins)
+            scores[client, :, feature] = get_mutual_information(joint)[0]
+
+    return scores
+
+def get_bin_codes(tensor, bins, binning):
+    """
+    Bin index of every value, shape (nodes, rows, features). Padding rows get
+    -1. Every node and feature is binned on its own value range, uniformly or
+    by quantiles. Mutual information does not depend on the bin labels, so
+    the bins of a client and a server do not have to match.
+
+    The codes are memoized on the tensor, each node is discretized once per
+    repetition.
+    """
+    key = ('mutinfo_codes', bins, binning)
+    try:
+        return tensor.memo[key]
+    except KeyError:
+        pass
+
+    codes = np.full(tensor.data.shape, -1, dtype=np.int16 if bins < 32768 else np.int32)
+
+    for node in xrange(0, tensor.num_nodes):
+        trace = tensor.get_trace(node)
+        for feature in xrange(0, tensor.num_features):
+            column = trace[:, feature]
+            if len(column) == 0:
+                continue
+
+            if binning == 'quantile':
+                edges = np.unique(np.percentile(column, np.linspace(0, 100, bins + 1)[1:-1]))
+            else:
+                edges = get_uniform_edges(column.min(), column.max(), bins)
+
+            codes[node, :len(column), feature] = np.searchsorted(edges, column, side='right')
+
+    tensor.memo[key] = codes
+    return codes
+
+def get_uniform_edges(low, high, bins):
+    """
+    Inner edges of bins of equal width between low and high, none for a
+    constant column.
+    """
+    return np.linspace(low, high, bins + 1)[1:-1] if high > low else np.array([])
+
+def stream_mutinfo(client_stream, server_stream, bins=DEFAULT_BINS, binning=DEFAULT_BINNING):
+    """
+    batch_mutinfo over TraceStreams. The value range of every node is read in
+    a first pass, or from the node statistics of the stream, the joint
+    histograms are then accumulated chunk by chunk.
+    Quantile edges need the sorted full trace, so only uniform binning is
+    supported.
+    """
+    if binning != 'uniform':
+        raise ValueError('streaming mode supports only uniform binning, got {}'.format(binning))
+
+    client_edges = get_stream_edges(client_stream, bins)
+    server_edges = get_stream_edges(server_stream, bins)
+
+    num_features = client_stream.num_features
+    joint = np.zeros((num_features, client_stream.num_nodes, server_stream.num_nodes, bins, bins), dtype=np.float64)
+
+    for (start, client_chunk), (_, server_chunk) in izip(client_stream.iterate_chunks(), server_stream.iterate_chunks()):
+        client_codes = get_chunk_codes(client_stream, start, client_chunk, client_edges, bins)
+        server_codes = get_chunk_codes(server_stream, start, server_chunk, server_edges, bins)
+
+        for feature in xrange(0, num_features):
+            joint[feature] += get_joint_histograms(client_codes[:, :, feature], server_codes[:, :, feature], bins)
+
+    scores = np.zeros((client_stream.num_nodes, server_stream.num_nodes, num_features), dtype=np.float64)
+    for feature in xrange(0, num_features):
+        scores[:, :, feature] = get_mutual_information(joint[feature])
 
     return scores
+
+def get_stream_edges(stream, bins):
+    """
+    Uniform bin edges of every node and feature of a TraceStream, a list of
+    lists of arrays indexed [node][feature]. Memoized on the stream.
+    """
+    key = ('mutinfo_edges', bins)
+    try:
+        return stream.memo[key]
+    except KeyError:
+        pass
+
+    low, high = stream.get_value_ranges()
+
+    edges = [[get_uniform_edges(low[node, feature], high[node, feature], bins) for feature in xrange(0, stream.num_features)]
+        for node in xrange(0, stream.num_nodes)]
+
+    stream.memo[key] = edges
+    return edges
+
+def get_chunk_codes(stream, start, chunk, edges, bins):
+    """
+    Bin codes (nodes, rows, features) of one chunk, padding rows get -1.
+    """
+    codes = np.full(chunk.shape, -1, dtype=np.int16 if bins < 32768 else np.int32)
+    num_valid = np.clip(stream.lengths - start, 0, chunk.shape[1])
+
+    for node in xrange(0, chunk.shape[0]):
+        for feature in xrange(0, chunk.shape[2]):
+            column = chunk[node, :num_valid[node], feature]
+            codes[node, :num_valid[node], feature] = np.searchsorted(edges[node][feature], column, side='right')
+
+    return codes
+
+def get_joint_histograms(client_codes, server_codes, bins):
+    """
+    Joint bin counts of all pairs for one feature, shape
+    (clients, servers, bins, bins). Arguments are the codes (nodes, rows) of
+    one feature. The one-hot encoded codes of a block of rows are multiplied,
+    padding rows encode to zero and drop out, which truncates each pair to the
+    shorter trace.
+    """
+    num_clients = client_codes.shape[0]
+    num_servers = server_codes.shape[0]
+    num_rows = min(client_codes.shape[1], server_codes.shape[1])
+
+    joint = np.zeros((num_clients * bins, num_servers * bins), dtype=np.float64)
+
+    for start in xrange(0, num_rows, ROW_BLOCK_SIZE):
+        end = min(start + ROW_BLOCK_SIZE, num_rows)
+
+        # (clients * bins, block rows)
+        client_one_hot = one_hot(client_codes[:, start:end], bins).transpose(0, 2, 1).reshape(num_clients * bins, end - start)
+        # (block rows, servers * bins)
+        server_one_hot = one_hot(server_codes[:, start:end], bins).transpose(1, 0, 2).reshape(end - start, num_servers * bins)
+
+        joint += np.dot(client_one_hot, server_one_hot)
+
+    return joint.reshape(num_clients, bins, num_servers, bins).transpose(0, 2, 1, 3)
+
+def one_hot(codes, bins):
+    """
+    One-hot encoding (nodes, rows, bins) of the codes, code -1 encodes to zeros.
+    """
+    encoded = np.zeros(codes.shape + (bins,), dtype=np.float32)
+    node_index, row_index = np.nonzero(codes >= 0)
+    encoded[node_index, row_index, codes[node_index, row_index]] = 1
+    return encoded
+
+def get_mutual_information(joint):
+    """
+    Mutual information of the joint histograms (..., bins, bins), with the
+    marginals taken from the joint counts.
+    """
+    totals = joint.sum(axis=(-2, -1))
+    client_marginals = joint.sum(axis=-1)
+    server_marginals = joint.sum(axis=-2)
+
+    # p(a, b) / (p(a) p(b)) = n(a, b) * n / (n(a) n(b))
+    expected = client_marginals[..., :, np.newaxis] * server_marginals[..., np.newaxis, :]
+    nonzero = joint > 0
+
+    ratio = np.ones(joint.shape, dtype=np.float64)
+    ratio[nonzero] = joint[nonzero] * np.broadcast_to(totals[..., np.newaxis, np.newaxis], joint.shape)[nonzero] / expected[nonzero]
+
+    information = (joint * np.log(ratio)).sum(axis=(-2, -1))
+
+    scores = np.zeros(totals.shape, dtype=np.float64)
+    np.divide(information, totals, out=scores, where=totals > 0)
+    return np.maximum(scores, 0)
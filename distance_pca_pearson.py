@@ -1,53 +1,173 @@
 #!/usr/bin/env python
 
+import numpy as np
 from sklearn import decomposition
-from numpy.ma import corrcoef
-from numpy import transpose
+
+from trace_tensor import TraceTensor
+from distance_pearson import batch_pearson, get_pearson_coefficients
+from trace_stream import accumulate_pair_statistics
+
+N_COMPONENTS = 3
+# number of projected rows that are correlated
+PROJECTION_ROWS = 1000
 
 def apply_pca_pearson(client_trace, server_trace):
     """
     Applies PCA to input data and compares transformed data via
     Pearson correlation.
     """
+    coeffs = batch_pca_pearson(TraceTensor([client_trace]), TraceTensor([server_trace]))
+    return list(coeffs[0, 0])
+
+def batch_pca_pearson(client_tensor, server_tensor):
+    """
+    Applies PCA to every trace and correlates the principal components of
+    every client with those of every server, shape (clients, servers, features).
+
+    The components of each client and server are correlated pairwise (first
+    with first, second with second, ...). The value of a feature is the
+    correlation of the component the feature loads on most strongly in the
+    client's PCA. Nodes where PCA fails get 0.
+    """
+    client_projections, client_loadings, client_valid = get_pca_projections(client_tensor)
+    server_projections, _, server_valid = get_pca_projections(server_tensor)
+
+    # shape (clients, servers, components)
+    component_coeffs = batch_pearson(client_projections, server_projections)
+
+    return select_dominant_components(component_coeffs, client_loadings, client_valid, server_valid)
+
+def pairs_pca_pearson(client_tensor, server_tensor, shortlist):
+    """
+    batch_pca_pearson of every client with the servers of its shortlist row,
+    shape (clients, candidates, features). The PCA of each node is fitted
+    once, only the projections of the shortlisted pairs are correlated.
+    """
+    client_projections, client_loadings, client_valid = get_pca_projections(client_tensor)
+    server_projections, _, server_valid = get_pca_projections(server_tensor)
+
+    coeffs = np.zeros(shortlist.shape + (client_tensor.num_features,), dtype=np.float64)
+    for client, candidates in enumerate(shortlist):
+        component_coeffs = batch_pearson(client_projections.select_nodes([client]), server_projections.select_nodes(candidates))
+        coeffs[client] = select_dominant_components(component_coeffs, client_loadings[client:client + 1],
+            client_valid[client:client + 1], server_valid[candidates])[0]
+
+    return coeffs
+
+def stream_pca_pearson(client_stream, server_stream):
+    """
+    batch_pca_pearson over TraceStreams. The PCA of each node is computed
+    from its covariance matrix, accumulated chunk by chunk, and all rows are
+    projected and correlated instead of the first PROJECTION_ROWS.
+    """
+    client_means, client_loadings, client_valid = get_stream_pca(client_stream)
+    server_means, server_loadings, server_valid = get_stream_pca(server_stream)
+
+    statistics = accumulate_pair_statistics(iterate_projections(client_stream, client_means, client_loadings),
+        iterate_projections(server_stream, server_means, server_loadings),
+        client_stream.lengths, server_stream.lengths, N_COMPONENTS)
+
+    component_coeffs = get_pearson_coefficients(statistics.limits, statistics.client_sums, statistics.client_square_sums,
+        statistics.server_sums, statistics.server_square_sums, statistics.cross)
+
+    return select_dominant_components(component_coeffs, client_loadings, client_valid, server_valid)
+
+def select_dominant_components(component_coeffs, client_loadings, client_valid, server_valid):
+    """
+    Picks for each feature the component correlation (clients, servers,
+    components) of the component the feature loads on most strongly in the
+    client's PCA, shape (clients, servers, features).
+    """
+    num_clients, num_servers = component_coeffs.shape[0], component_coeffs.shape[1]
+
+    # shape (clients, features), index of the dominant component per feature
+    dominant_components = np.argmax(np.abs(client_loadings), axis=1)
+
+    client_index = np.arange(num_clients)[:, np.newaxis, np.newaxis]
+    server_index = np.arange(num_servers)[np.newaxis, :, np.newaxis]
+    coeffs = component_coeffs[client_index, server_index, dominant_components[:, np.newaxis, :]]
+
+    coeffs[~client_valid] = 0
+    coeffs[:, ~server_valid] = 0
+
+    return coeffs
+
+def get_pca_projections(tensor):
+    """
+    Fits one PCA per node and projects the first PROJECTION_ROWS rows of the
+    node's trace. The result is memoized on the tensor, so each node is only
+    fitted once per repetition.
+
+    Returns a TraceTensor of projections (nodes, rows, components), the
+    loadings (nodes, components, features), and a boolean array marking the
+    nodes where the PCA succeeded.
+    """
+    try:
+        return tensor.memo['pca_projections']
+    except KeyError:
+        pass
 
-    coeffs = []
-    n_components=3
-    
-    for feature in xrange(0, len(client_trace[0])):
-        tmp_coeff = 0
+    projections = []
+    loadings = np.zeros((tensor.num_nodes, N_COMPONENTS, tensor.num_features), dtype=np.float64)
+    valid = np.zeros(tensor.num_nodes, dtype=bool)
+
+    for node in xrange(0, tensor.num_nodes):
+        trace = tensor.get_trace(node)
         try:
-            pca = decomposition.PCA(n_components)
-            pca.fit(client_trace)
-            client_pca = pca.transform(client_trace)
+            pca = decomposition.PCA(N_COMPONENTS)
+            pca.fit(trace)
+            projections.append(pca.transform(trace[0:PROJECTION_ROWS]))
+            loadings[node] = pca.components_
+            valid[node] = True
 
-            pca.fit(server_trace)
-            server_pca = pca.transform(server_trace)
-        
         except Exception as err:
             print 'Problem applying PCA: ', err
-            
-        try:
-            for i in xrange(0,n_components):
-                shrinked_client = client_pca[0:1000]
-                shrinked_server = server_pca[0:1000]
+            projections.append(np.zeros((1, N_COMPONENTS), dtype=np.float64))
 
-                shrinked_client = [row[i] for row in shrinked_client]
-                shrinked_server = [row[i] for row in shrinked_server]
+    result = (TraceTensor(projections), loadings, valid)
+    tensor.memo['pca_projections'] = result
+    return result
 
-                limitation = min(len(shrinked_client), len(shrinked_server))
+def get_stream_pca(stream):
+    """
+    PCA of every node of a TraceStream from the incremental covariance of its
+    rows, memoized on the stream. The covariance is accumulated on centered
+    chunks, the column means come from a first pass.
 
-                shrinked_client = shrinked_client[0:limitation]
-                shrinked_server = shrinked_server[0:limitation]
+    Returns the means (nodes, features), the loadings
+    (nodes, components, features) and a boolean array marking the nodes with
+    enough rows and features for N_COMPONENTS components.
+    """
+    try:
+        return stream.memo['stream_pca']
+    except KeyError:
+        pass
 
-                cor = corrcoef(transpose(shrinked_client), transpose(shrinked_server))
-                correlation_coefficient = abs(cor.data[1][0])
+    means = stream.get_column_means()
 
-                if correlation_coefficient > tmp_coeff:
-                    tmp_coeff = correlation_coefficient
+    scatter = np.zeros((stream.num_nodes, stream.num_features, stream.num_features), dtype=np.float64)
+    for start, chunk in stream.iterate_chunks():
+        centered = (chunk - means[:, np.newaxis, :]) * stream.get_valid_rows(start, chunk.shape[1])[:, :, np.newaxis]
+        scatter += np.einsum('nrf,nrg->nfg', centered, centered)
 
-        except Exception as err:
-            print 'Error applying PCA-Pearson: ', err
-	    
-        coeffs.append(tmp_coeff)
+    loadings = np.zeros((stream.num_nodes, N_COMPONENTS, stream.num_features), dtype=np.float64)
+    valid = (stream.lengths >= N_COMPONENTS) & (stream.num_features >= N_COMPONENTS)
 
-    return coeffs
+    for node in np.nonzero(valid)[0]:
+        # eigenvectors in ascending order of the eigenvalues
+        _, vectors = np.linalg.eigh(scatter[node])
+        loadings[node] = vectors[:, ::-1][:, :N_COMPONENTS].T
+
+    result = (means, loadings, valid)
+    stream.memo['stream_pca'] = result
+    return result
+
+def iterate_projections(stream, means, loadings):
+    """
+    Yields (start, projections) chunks (nodes, rows, components) of the
+    centered traces projected on the loadings, padding rows stay zero.
+    """
+    for start, chunk in stream.iterate_chunks():
+        projections = np.einsum('nrf,ncf->nrc', chunk - means[:, np.newaxis, :], loadings)
+        projections *= stream.get_valid_rows(start, chunk.shape[1])[:, :, np.newaxis]
+        yield start, projections
@@ -1,26 +1,57 @@
 #!/usr/bin/env python
 
-from numpy.ma import corrcoef
+import numpy as np
+
+from trace_tensor import TraceTensor, get_pair_limits, get_cross_products
+from trace_stream import get_pair_statistics
+
+# variances below this fraction of the second moment count as constant columns
+CONSTANT_TOLERANCE = 1e-9
 
 def apply_pearson(client_trace, server_trace):
+    coeffs = batch_pearson(TraceTensor([client_trace]), TraceTensor([server_trace]))
+    return list(coeffs[0, 0])
+
+def batch_pearson(client_tensor, server_tensor):
+    """
+    Absolute Pearson correlation of every client with every server for each
+    feature, shape (clients, servers, features). Both traces of a pair are
+    truncated to the shorter one. Pairs where a column is constant get 0.
+    """
+    limits = get_pair_limits(client_tensor, server_tensor)
+
+    client_sums, client_square_sums = client_tensor.get_truncated_sums(limits)
+    server_sums, server_square_sums = server_tensor.get_truncated_sums(limits.T)
+    server_sums = server_sums.transpose(1, 0, 2)
+    server_square_sums = server_square_sums.transpose(1, 0, 2)
+
+    cross = get_cross_products(client_tensor, server_tensor)
+
+    return get_pearson_coefficients(limits, client_sums, client_square_sums, server_sums, server_square_sums, cross)
+
+def stream_pearson(client_stream, server_stream):
+    """
+    batch_pearson over TraceStreams, from running sums and cross products.
+    """
+    statistics = get_pair_statistics(client_stream, server_stream)
+    return get_pearson_coefficients(statistics.limits, statistics.client_sums, statistics.client_square_sums,
+        statistics.server_sums, statistics.server_square_sums, statistics.cross)
 
-    coeffs = []
-    for feature in xrange(0, len(client_trace[0])):
-        feature_client = [row[feature] for row in client_trace]
-        feature_server = [row[feature] for row in server_trace]
+def get_pearson_coefficients(limits, client_sums, client_square_sums, server_sums, server_square_sums, cross):
+    """
+    Absolute Pearson correlations from the sums of each pair, all arrays of
+    shape (clients, servers, features) except limits (clients, servers).
+    """
+    num_rows = limits[:, :, np.newaxis].astype(np.float64)
 
-        limitation = min(len(feature_client), len(feature_server))
+    covariance = num_rows * cross - client_sums * server_sums
+    client_variance = num_rows * client_square_sums - client_sums ** 2
+    server_variance = num_rows * server_square_sums - server_sums ** 2
 
-        feature_client = feature_client[0:limitation]
-        feature_server = feature_server[0:limitation]
-        
-        try:
-            cor = corrcoef(feature_client, feature_server)
-            correlation_coefficient = abs(cor.data[1][0])
-            coeffs.append(correlation_coefficient)
+    valid = (client_variance > CONSTANT_TOLERANCE * num_rows * client_square_sums) & \
+        (server_variance > CONSTANT_TOLERANCE * num_rows * server_square_sums)
 
-        except Exception as err:
-            print 'Error applying Pearson: ', err
-            coeffs.append(0)
+    coeffs = np.zeros(covariance.shape, dtype=np.float64)
+    coeffs[valid] = np.abs(covariance[valid]) / np.sqrt(client_variance[valid] * server_variance[valid])
 
-    return coeffs
\ No newline at end of file
+    return np.minimum(coeffs, 1.0)
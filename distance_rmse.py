@@ -1,26 +1,68 @@
 #!/usr/bin/env python
 
-from sklearn.metrics import mean_squared_error
-from math import sqrt
+from itertools import izip
+
+import numpy as np
+
+from trace_tensor import TraceTensor, get_pair_limits
 
 def apply_rmse(client_trace, server_trace):
+    errors = batch_rmse(TraceTensor([client_trace]), TraceTensor([server_trace]))
+    return list(errors[0, 0])
+
+def batch_rmse(client_tensor, server_tensor):
+    """
+    Root mean squared error of every client with every server for each
+    feature, shape (clients, servers, features). Both traces of a pair are
+    truncated to the shorter one.
+    """
+    limits = get_pair_limits(client_tensor, server_tensor)
+
+    squared_errors = np.zeros((client_tensor.num_nodes, server_tensor.num_nodes, client_tensor.num_features), dtype=np.float64)
+    add_squared_errors(squared_errors, limits, 0, client_tensor.data, server_tensor.data)
+
+    return get_root_mean_squared_errors(limits, squared_errors)
+
+def stream_rmse(client_stream, server_stream):
+    """
+    batch_rmse over TraceStreams, summing the squared errors chunk by chunk.
+    """
+    limits = np.minimum(client_stream.lengths[:, np.newaxis], server_stream.lengths[np.newaxis, :])
+
+    squared_errors = np.zeros((client_stream.num_nodes, server_stream.num_nodes, client_stream.num_features), dtype=np.float64)
+    for (start, client_chunk), (_, server_chunk) in izip(client_stream.iterate_chunks(), server_stream.iterate_chunks()):
+        add_squared_errors(squared_errors, limits, start, client_chunk, server_chunk)
+
+    return get_root_mean_squared_errors(limits, squared_errors)
+
+def add_squared_errors(squared_errors, limits, start, client_chunk, server_chunk):
+    """
+    Adds the squared differences of the rows start, start + 1, ... of the
+    zero padded chunks (nodes, rows, features) to squared_errors (clients,
+    servers, features), counting only the first limits[client, server] rows
+    of each pair.
+
+    The differences are taken row by row in float64. Expanding the sum into
+    square sums and cross products cancels when the traces of a pair are
+    nearly equal, which is the pair that matters most.
+    """
+    num_rows = min(client_chunk.shape[1], server_chunk.shape[1])
+    chunk_limits = np.clip(limits - start, 0, num_rows)
 
-    errors = []
-    for feature in xrange(0, len(client_trace[0])):
-        feature_client = [row[feature] for row in client_trace]
-        feature_server = [row[feature] for row in server_trace]
+    for client in xrange(0, client_chunk.shape[0]):
+        client_rows = int(chunk_limits[client].max()) if chunk_limits.shape[1] > 0 else 0
+        if client_rows == 0:
+            continue
 
-        limitation = min(len(feature_client), len(feature_server))
+        errors = np.subtract(server_chunk[:, :client_rows], client_chunk[client, np.newaxis, :client_rows], dtype=np.float64)
+        errors **= 2
+        errors *= (np.arange(client_rows)[np.newaxis, :] < chunk_limits[client][:, np.newaxis])[:, :, np.newaxis]
+        squared_errors[client] += errors.sum(axis=1)
 
-        feature_client = feature_client[0:limitation]
-        feature_server = feature_server[0:limitation]
-        
-        try:
-            error = sqrt(mean_squared_error(feature_client, feature_server))
-            errors.append(error)
+def get_root_mean_squared_errors(limits, squared_errors):
+    num_rows = limits[:, :, np.newaxis].astype(np.float64)
 
-        except Exception as err:
-            print 'Error applying Pearson: ', err
-            errors.append(0)
+    errors = np.zeros(squared_errors.shape, dtype=np.float64)
+    np.divide(squared_errors, num_rows, out=errors, where=num_rows > 0)
 
-    return errors
\ No newline at end of file
+    return np.sqrt(errors)
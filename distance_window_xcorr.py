@@ -0,0 +1,215 @@
+#!/usr/bin/env python
+
+import numpy as np
+
+from trace_tensor import TraceTensor
+from metric_defaults import DEFAULT_WINDOW, DEFAULT_STEP, DEFAULT_MAX_LAG
+
+# column of the inter_arrival_time feature, the window of each packet is
+# derived from its cumulative sum
+TIME_FEATURE = 1
+# aggregate of each feature per window, in the order of
+# traffic_analysis.FEATURES: the packet count becomes the number of packets,
+# inter-arrival times and packet lengths are summed (time and bytes per
+# window), time to live and window size are averaged
+WINDOW_AGGREGATES = ['count', 'sum', 'sum', 'mean', 'mean']
+
+# rows of a trace binned at once
+BIN_BLOCK_ROWS = 65536
+
+def apply_window_xcorr(client_trace, server_trace, window=DEFAULT_WINDOW, step=DEFAULT_STEP, max_lag=DEFAULT_MAX_LAG):
+    coeffs = batch_window_xcorr(TraceTensor([client_trace]), TraceTensor([server_trace]), window, step, max_lag)
+    return list(coeffs[0, 0])
+
+def batch_window_xcorr(client_tensor, server_tensor, window=DEFAULT_WINDOW, step=DEFAULT_STEP, max_lag=DEFAULT_MAX_LAG):
+    """
+    Peak normalized cross-correlation of the time windowed series of every
+    client with every server for each feature, shape
+    (clients, servers, features).
+
+    Unlike the row based metrics the traces are not compared row by row.
+    Both traces are binned into windows of fixed duration (see
+    get_window_series) and the series are correlated at every shift of up to
+    max_lag windows, so traces that are offset in time still match. The
+    shifts are scanned with one FFT cross-correlation per pair.
+    """
+    client_series = get_window_series(client_tensor, [client_tensor.get_trace(node) for node in xrange(0, client_tensor.num_nodes)], window, step)
+    server_series = get_window_series(server_tensor, [server_tensor.get_trace(node) for node in xrange(0, server_tensor.num_nodes)], window, step)
+
+    return get_peak_correlations(client_series, server_series, max_lag)
+
+def pairs_window_xcorr(client_tensor, server_tensor, shortlist, window=DEFAULT_WINDOW, step=DEFAULT_STEP, max_lag=DEFAULT_MAX_LAG):
+    """
+    batch_window_xcorr of every client with the servers of its shortlist row,
+    shape (clients, candidates, features). Only the shortlisted pairs are
+    cross-correlated.
+    """
+    client_series = get_window_series(client_tensor, [client_tensor.get_trace(node) for node in xrange(0, client_tensor.num_nodes)], window, step)
+    server_series = get_window_series(server_tensor, [server_tensor.get_trace(node) for node in xrange(0, server_tensor.num_nodes)], window, step)
+
+    coeffs = np.zeros(shortlist.shape + (len(WINDOW_AGGREGATES),), dtype=np.float64)
+    for client, candidates in enumerate(shortlist):
+        coeffs[client] = get_peak_correlations([client_series[client]], [server_series[server] for server in candidates], max_lag)[0]
+
+    return coeffs
+
+def stream_window_xcorr(client_stream, server_stream, window=DEFAULT_WINDOW, step=DEFAULT_STEP, max_lag=DEFAULT_MAX_LAG):
+    """
+    batch_window_xcorr over TraceStreams, the traces are binned in blocks of
+    chunk_rows rows.
+    """
+    client_series = get_window_series(client_stream, client_stream.traces, window, step, client_stream.chunk_rows)
+    server_series = get_window_series(server_stream, server_stream.traces, window, step, server_stream.chunk_rows)
+
+    return get_peak_correlations(client_series, server_series, max_lag)
+
+def get_window_series(data, traces, window, step, block_rows=BIN_BLOCK_ROWS):
+    """
+    Windowed series (windows, features) of every node, memoized on the
+    TraceTensor or TraceStream data the traces belong to.
+
+    The traces are cut into bins of step seconds by the cumulative
+    inter-arrival time, starting at the first packet of each trace. A window
+    spans window / step consecutive bins, so a step smaller than the window
+    gives overlapping sliding windows.
+    """
+    key = ('window_series', window, step)
+    try:
+        return data.memo[key]
+    except KeyError:
+        pass
+
+    if step is None:
+        step = window
+    steps_per_window = max(1, int(round(window / step)))
+
+    series = [slide_windows(bin_trace(trace, step, block_rows), steps_per_window) for trace in traces]
+
+    data.memo[key] = series
+    return series
+
+def bin_trace(trace, step, block_rows):
+    """
+    Number of packets and column sums per bin of step seconds, returns the
+    counts (bins,) and sums (bins, features). The trace is read in blocks, so
+    memory maps are not loaded at once.
+    """
+    num_features = len(WINDOW_AGGREGATES)
+    counts = np.zeros(0, dtype=np.float64)
+    sums = np.zeros((0, num_features), dtype=np.float64)
+    time_offset = 0.0
+    # the first packet opens bin 0
+    origin = float(trace[0][TIME_FEATURE]) if len(trace) > 0 else 0.0
+
+    for start in xrange(0, len(trace), block_rows):
+        block = np.asarray(trace[start:start + block_rows], dtype=np.float64)
+
+        # the running sum continues from the last block, so every block size
+        # gives the same times and the same bins as one pass over the trace
+        times = np.cumsum(np.concatenate([[time_offset], block[:, TIME_FEATURE]]))[1:]
+        time_offset = times[-1]
+        bins = np.maximum(np.floor((times - origin) / step).astype(np.int64), 0)
+
+        num_bins = int(bins[-1]) + 1
+        if num_bins > len(counts):
+            counts = np.concatenate([counts, np.zeros(num_bins - len(counts))])
+            sums = np.concatenate([sums, np.zeros((num_bins - len(sums), num_features))])
+
+        counts[:num_bins] += np.bincount(bins, minlength=num_bins)
+        for feature in xrange(0, num_features):
+            sums[:num_bins, feature] += np.bincount(bins, weights=block[:, feature], minlength=num_bins)
+
+    return counts, sums
+
+def slide_windows(binned, steps_per_window):
+    """
+    Aggregates (windows, features) over windows of steps_per_window bins
+    according to WINDOW_AGGREGATES.
+    """
+    counts, sums = binned
+    if len(counts) == 0:
+        return np.zeros((0, len(WINDOW_AGGREGATES)), dtype=np.float64)
+
+    width = min(steps_per_window, len(counts))
+    counts = moving_sums(counts[:, np.newaxis], width)[:, 0]
+    sums = moving_sums(sums, width)
+
+    series = np.empty(sums.shape, dtype=np.float64)
+    for feature, aggregate in enumerate(WINDOW_AGGREGATES):
+        if aggregate == 'count':
+            series[:, feature] = counts
+        elif aggregate == 'sum':
+            series[:, feature] = sums[:, feature]
+        else:
+            series[:, feature] = 0
+            np.divide(sums[:, feature], counts, out=series[:, feature], where=counts > 0)
+
+    return series
+
+def moving_sums(values, width):
+    cumulative = np.zeros((len(values) + 1, values.shape[1]), dtype=np.float64)
+    np.cumsum(values, axis=0, out=cumulative[1:])
+    return cumulative[width:] - cumulative[:-width]
+
+def standardize(series):
+    """
+    Series with zero mean and unit norm per feature, constant features become
+    zero and correlate with nothing.
+    """
+    if len(series) == 0:
+        return series
+
+    centered = series - series.mean(axis=0)
+    norms = np.sqrt((centered ** 2).sum(axis=0))
+    scaled = np.zeros(centered.shape, dtype=np.float64)
+    np.divide(centered, norms, out=scaled, where=norms > 1e-12 * np.maximum(np.abs(series).max(axis=0), 1))
+    return scaled
+
+def get_peak_correlations(client_series, server_series, max_lag):
+    """
+    Largest absolute normalized cross-correlation over the allowed shifts for
+    every pair and feature, shape (clients, servers, features). Each pair
+    scans the shifts where its windows overlap, up to max_lag windows in
+    either direction, so its score does not depend on the other series of
+    the batch.
+    """
+    num_features = len(WINDOW_AGGREGATES)
+    coeffs = np.zeros((len(client_series), len(server_series), num_features), dtype=np.float64)
+
+    client_lengths = [len(series) for series in client_series]
+    server_lengths = [len(series) for series in server_series]
+    if len(client_series) == 0 or len(server_series) == 0 or max(client_lengths) == 0 or max(server_lengths) == 0:
+        return coeffs
+
+    # long enough that the circular correlation does not wrap around
+    num_fft = 1 << int(np.ceil(np.log2(max(client_lengths) + max(server_lengths) - 1)))
+
+    # shifts k where client window t + k meets server window t, the shifts
+    # of a pair with overlapping windows are -(server length - 1) to
+    # client length - 1. Negative shifts wrap to the end of the FFT output.
+    max_negative = max(server_lengths) - 1
+    if max_lag is not None:
+        max_negative = min(max_negative, max_lag)
+    negative_shifts = np.arange(1, max_negative + 1)
+    # (servers, negative shifts), the shifts beyond the length of each server
+    valid_negative = negative_shifts[np.newaxis, :] < np.array(server_lengths)[:, np.newaxis]
+
+    server_spectra = np.array([np.fft.rfft(standardize(series), num_fft, axis=0) for series in server_series])
+
+    for client, series in enumerate(client_series):
+        if len(series) == 0:
+            continue
+
+        max_positive = len(series) - 1 if max_lag is None else min(len(series) - 1, max_lag)
+
+        client_spectrum = np.fft.rfft(standardize(series), num_fft, axis=0)
+        # shape (servers, num_fft, features)
+        correlations = np.abs(np.fft.irfft(client_spectrum[np.newaxis] * np.conj(server_spectra), num_fft, axis=1))
+
+        peaks = correlations[:, :max_positive + 1].max(axis=1)
+        if max_negative > 0:
+            negative = correlations[:, num_fft - negative_shifts] * valid_negative[:, :, np.newaxis]
+            peaks = np.maximum(peaks, negative.max(axis=1))
+        coeffs[client] = peaks
+
+    return np.minimum(coeffs, 1.0)
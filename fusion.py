@@ -0,0 +1,184 @@
+#!/usr/bin/env python
+
+import csv
+
+import numpy as np
+
+from metric_registry import LOWER_IS_BETTER, HIGHER_IS_BETTER
+from ranking import get_correct_servers, get_ranks, get_rank_counts
+
+FUSION_STRATEGIES = ['rank', 'linear']
+
+class FusionSample():
+    """
+    Stored scores of one repetition, reshaped for the fusion.
+
+    Constructor Arguments:
+    setup_id, repetition: origin of the scores
+    scores: tensor (metrics, clients, servers, features) from the ScoreStore
+    directions: LOWER_IS_BETTER or HIGHER_IS_BETTER for each metric
+    correct_servers: index of the server of each client
+
+    goodness has shape (clients, servers, channels), one channel per
+    (metric, feature) in metric major order, and is higher for better
+    matching servers. zscores standardizes every client and channel over the
+    servers, so channels with different scales can be weighted.
+    """
+
+    def __init__(self, setup_id, repetition, scores, directions, correct_servers):
+        self.setup_id = setup_id
+        self.repetition = repetition
+        self.correct_servers = correct_servers
+
+        signs = np.array([-1.0 if direction == LOWER_IS_BETTER else 1.0 for direction in directions])
+        goodness = np.asarray(scores, dtype=np.float64) * signs[:, np.newaxis, np.newaxis, np.newaxis]
+
+        # pairs pruned in cascade mode score -inf, they tie with the worst
+        # candidate of the client instead
+        pruned = np.isneginf(goodness)
+        if pruned.any():
+            worst = np.where(np.isfinite(goodness), goodness, np.inf).min(axis=2)
+            worst[np.isinf(worst)] = 0
+            goodness[pruned] = np.broadcast_to(worst[:, :, np.newaxis, :], goodness.shape)[pruned]
+        goodness = np.nan_to_num(goodness)
+
+        num_metrics, num_clients, num_servers, num_features = goodness.shape
+        self.goodness = goodness.transpose(1, 2, 0, 3).reshape(num_clients, num_servers, num_metrics * num_features)
+
+        centered = self.goodness - self.goodness.mean(axis=1)[:, np.newaxis, :]
+        deviations = centered.std(axis=1)[:, np.newaxis, :]
+        self.zscores = np.zeros(centered.shape, dtype=np.float64)
+        np.divide(centered, deviations, out=self.zscores, where=deviations > 0)
+
+        # 0 based rank of every server per client and channel, best first
+        order = np.argsort(-self.goodness, axis=1, kind='mergesort')
+        self.channel_ranks = np.argsort(order, axis=1, kind='mergesort')
+
+    def get_labels(self):
+        """
+        Boolean array (clients, servers), True for the server of each client.
+        """
+        labels = np.zeros(self.goodness.shape[:2], dtype=bool)
+        labels[np.arange(len(self.correct_servers)), self.correct_servers] = True
+        return labels
+
+def load_samples(score_store, setup_ids):
+    """
+    FusionSamples of all stored repetitions of the setups and the list of
+    channel names. Setups stored with other metrics than the first one are
+    skipped, their channels would not line up.
+    """
+    samples = []
+    metric_names = None
+
+    for setup_id in setup_ids:
+        entry = score_store.get_setup(setup_id)
+        if entry is None:
+            print 'No scores stored for setup ', setup_id
+            continue
+
+        if metric_names is None:
+            metric_names = entry['metrics']
+        elif entry['metrics'] != metric_names:
+            print 'Skipped setup {}, scores were computed with other metrics'.format(setup_id)
+            continue
+
+        for repetition in score_store.get_repetitions(setup_id):
+            scores = score_store.get_repetition(setup_id, repetition)
+            correct_servers = get_correct_servers(entry['setup'], scores.shape[2], scores.shape[1])
+            samples.append(FusionSample(setup_id, repetition, scores, entry['directions'], correct_servers))
+
+    feature_names = score_store.index['features'] or []
+    channels = ['{}:{}'.format(metric, feature) for metric in (metric_names or []) for feature in feature_names]
+    return samples, channels
+
+def fit_rank_weights(samples):
+    """
+    Weight of every channel for the rank aggregation: the mean reciprocal
+    rank of the correct server in the training samples, normalized to sum 1.
+    """
+    reciprocal_ranks = []
+    for sample in samples:
+        correct_ranks = sample.channel_ranks[np.arange(len(sample.correct_servers)), sample.correct_servers]
+        reciprocal_ranks.append(1.0 / (correct_ranks + 1))
+
+    weights = np.concatenate(reciprocal_ranks).mean(axis=0)
+    return weights / weights.sum()
+
+def fit_linear_weights(samples):
+    """
+    Weights of a logistic regression on the z-scores of all (client, server)
+    pairs of the training samples, the label is whether the server is the
+    client's server.
+    """
+    from sklearn.linear_model import LogisticRegression
+
+    features = np.concatenate([sample.zscores.reshape(-1, sample.zscores.shape[2]) for sample in samples])
+    labels = np.concatenate([sample.get_labels().ravel() for sample in samples])
+
+    if labels.all() or not labels.any():
+        return np.zeros(features.shape[1], dtype=np.float64)
+
+    model = LogisticRegression(solver='lbfgs', class_weight='balanced', max_iter=1000)
+    model.fit(features, labels)
+    return model.coef_[0]
+
+def get_fused_goodness(sample, strategy, weights):
+    """
+    Combined goodness (clients, servers) of a sample, higher is better.
+    """
+    if strategy == 'rank':
+        return -np.dot(sample.channel_ranks, weights)
+    return np.dot(sample.zscores, weights)
+
+def cross_validate(samples, strategy, top_k):
+    """
+    Leave one repetition out: the weights are fitted on all other
+    repetitions of all setups and evaluated on the left out one.
+
+    Returns a dict setup_id -> list of (top1, top-k, reciprocal rank,
+    clients) per repetition, and the weights averaged over the folds.
+    """
+    fit_weights = fit_rank_weights if strategy == 'rank' else fit_linear_weights
+
+    repetitions = sorted(set(sample.repetition for sample in samples))
+    if len(repetitions) < 2:
+        print 'Only one repetition stored, the weights are evaluated on their training data'
+
+    results = {}
+    fold_weights = []
+    for repetition in repetitions:
+        test_samples = [sample for sample in samples if sample.repetition == repetition]
+        train_samples = [sample for sample in samples if sample.repetition != repetition] or test_samples
+
+        weights = fit_weights(train_samples)
+        fold_weights.append(weights)
+
+        for sample in test_samples:
+            fused = get_fused_goodness(sample, strategy, weights)
+            ranks = get_ranks(fused[np.newaxis, :, :, np.newaxis], sample.correct_servers, [HIGHER_IS_BETTER])
+            corrects, fails, top_k_hits, reciprocal_ranks = get_rank_counts(ranks, top_k)
+
+            num_clients = float(len(sample.correct_servers))
+            results.setdefault(sample.setup_id, []).append((corrects[0, 0] / num_clients, top_k_hits[0, 0] / num_clients,
+                reciprocal_ranks[0, 0] / num_clients, len(sample.correct_servers)))
+
+    return results, np.mean(fold_weights, axis=0)
+
+def get_fusion_rows(results, strategy, top_k):
+    """
+    Rows (setup_id, strategy, top_k, top1_avg, topk_avg, mrr_avg, mrr_sd,
+    num_ranked) like the ta_rank_submission rows.
+    """
+    rows = []
+    for setup_id in sorted(results):
+        top1, top_k_accuracy, reciprocal_rank, num_clients = zip(*results[setup_id])
+        rows.append((setup_id, strategy, top_k, float(np.mean(top1)), float(np.mean(top_k_accuracy)),
+            float(np.mean(reciprocal_rank)), float(np.std(reciprocal_rank)), int(sum(num_clients))))
+    return rows
+
+def write_fusion_rows(path, rows):
+    with open(path, 'w') as results_file:
+        writer = csv.writer(results_file)
+        writer.writerow(['setup_id', 'strategy', 'top_k', 'top1_avg', 'topk_avg', 'mrr_avg', 'mrr_sd', 'num_ranked'])
+        writer.writerows(rows)
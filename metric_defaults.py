@@ -0,0 +1,15 @@
+#!/usr/bin/env python
+
+# default parameters of the metrics, kept apart from the metric modules so
+# the registry and the command line options do not import them
+
+# distance_mutinfo: bins per feature and how their edges are placed
+DEFAULT_BINS = 16
+DEFAULT_BINNING = 'uniform'
+
+# distance_window_xcorr: width and step of the time windows in seconds, the
+# same unit as the inter_arrival_time feature
+DEFAULT_WINDOW = 0.1
+DEFAULT_STEP = None
+# largest shift in windows searched in both directions, None for all shifts
+DEFAULT_MAX_LAG = 10
@@ -0,0 +1,190 @@
+#!/usr/bin/env python
+
+import time
+
+import numpy as np
+
+from trace_tensor import TraceTensor
+from trace_stream import TraceStream
+from metric_registry import LOWER_IS_BETTER
+from ranking import get_shortlist
+from score_cache import get_trace_hash, get_score_mode, get_score_keys
+
+def compute_all_pairs(client_traces, server_traces, metrics, timings=None, stream_chunk_rows=None, compute_dtype='float64',
+        client_statistics=None, server_statistics=None, score_cache=None):
+    """
+    Applies the metrics to all (client, server) pairs of a repetition.
+
+    Arguments:
+    client_traces, server_traces: lists of trace arrays (rows, features)
+    metrics: list of Metric objects from the metric registry
+    timings: optional StageTimings, gets the compute time of each metric with
+        the number of compared pairs as count
+    stream_chunk_rows: if set, the metrics read the traces as TraceStreams in
+        chunks of this many rows instead of stacking them into TraceTensors,
+        which bounds the memory for long traces
+    compute_dtype: dtype of the TraceTensors or chunks, 'float32' for the
+        reduced precision mode
+    client_statistics, server_statistics: optional lists of NodeStatistics
+        of the traces, see TraceTensor
+    score_cache: optional ScoreCache, only the pairs without cached scores
+        are computed, see run_cached_metric
+
+    Returns an array of shape (metrics, clients, servers, features).
+    """
+    if stream_chunk_rows:
+        client_data = TraceStream(client_traces, stream_chunk_rows, compute_dtype, client_statistics)
+        server_data = TraceStream(server_traces, stream_chunk_rows, compute_dtype, server_statistics)
+    else:
+        client_data = TraceTensor(client_traces, compute_dtype, client_statistics)
+        server_data = TraceTensor(server_traces, compute_dtype, server_statistics)
+
+    scores = np.empty((len(metrics), client_data.num_nodes, server_data.num_nodes, client_data.num_features), dtype=np.float64)
+
+    num_pairs = client_data.num_nodes * server_data.num_nodes
+    if score_cache is not None:
+        cached_pairs = CachedPairs(score_cache, client_traces, server_traces, get_score_mode(stream_chunk_rows, compute_dtype), timings)
+
+    for index, metric in enumerate(metrics):
+        apply_function = metric.apply_stream if stream_chunk_rows else metric.apply_batch
+        if score_cache is not None:
+            scores[index] = run_cached_metric(metric, apply_function, client_data, server_data, cached_pairs, timings)
+        else:
+            scores[index] = run_metric(metric, apply_function, (client_data, server_data), num_pairs, timings)
+
+    return scores
+
+class CachedPairs():
+    """
+    Content hashes of the traces of a repetition, the keys of their pairs in
+    a ScoreCache.
+
+    Constructor Arguments:
+    score_cache: the ScoreCache
+    client_traces, server_traces: lists of trace arrays, hashed once for all
+        metrics
+    mode: score mode of the computation, see get_score_mode
+    timings: optional StageTimings, the hashing counts as score_cache time
+    """
+
+    def __init__(self, score_cache, client_traces, server_traces, mode, timings=None):
+        start_time = time.time()
+        self.score_cache = score_cache
+        self.mode = mode
+        self.client_hashes = [get_trace_hash(trace) for trace in client_traces]
+        self.server_hashes = [get_trace_hash(trace) for trace in server_traces]
+
+        if timings is not None:
+            timings.add('score_cache', time.time() - start_time, 0)
+
+    def get_keys(self, metric):
+        return get_score_keys(metric, self.mode, self.client_hashes, self.server_hashes)
+
+def run_cached_metric(metric, apply_function, client_data, server_data, cached_pairs, timings=None):
+    """
+    run_metric with the scores of the ScoreCache. Clients with a score for
+    every server take them from the cache. The metric runs once on the
+    other clients, as a selection of the client TraceTensor or TraceStream,
+    and their new scores are stored. A failing metric stores nothing.
+
+    The score_cache stage of the timings counts the pairs found in the cache.
+    """
+    start_time = time.time()
+    keys = cached_pairs.get_keys(metric)
+    cached = cached_pairs.score_cache.get_scores([key for client_keys in keys for key in client_keys])
+
+    scores = np.empty((client_data.num_nodes, server_data.num_nodes, client_data.num_features), dtype=np.float64)
+    missing_clients = []
+    for client, client_keys in enumerate(keys):
+        if all(key in cached for key in client_keys):
+            scores[client] = [cached[key] for key in client_keys]
+        else:
+            missing_clients.append(client)
+
+    if timings is not None:
+        timings.add('score_cache', time.time() - start_time, (client_data.num_nodes - len(missing_clients)) * server_data.num_nodes)
+
+    if len(missing_clients) == 0:
+        return scores
+
+    if len(missing_clients) < client_data.num_nodes:
+        client_data = client_data.select_nodes(missing_clients)
+
+    computed = run_metric(metric, apply_function, (client_data, server_data), len(missing_clients) * server_data.num_nodes, timings)
+    scores[missing_clients] = computed
+
+    if isinstance(computed, np.ndarray):
+        cached_pairs.score_cache.put_scores([(keys[client][server], computed[row, server])
+            for row, client in enumerate(missing_clients) for server in xrange(0, server_data.num_nodes)])
+
+    return scores
+
+def run_metric(metric, apply_function, arguments, num_pairs, timings=None):
+    """
+    Calls one of the apply functions of a metric. A failing metric scores 0
+    for all pairs, the error is printed.
+    """
+    start_time = time.time()
+    try:
+        scores = apply_function(*arguments)
+    except Exception as err:
+        print 'Error applying {}: '.format(metric.name), err
+        scores = 0
+
+    if timings is not None:
+        timings.add('metric:' + metric.name, time.time() - start_time, num_pairs)
+
+    return scores
+
+def compute_cascade(client_traces, server_traces, metrics, shortlist_size, timings=None, compute_dtype='float64',
+        client_statistics=None, server_statistics=None, score_cache=None):
+    """
+    compute_all_pairs in cascade mode. The metrics without a pairs function
+    are cheap and run on all pairs first. Their scores select the
+    shortlist_size best servers of every client (see get_shortlist), and the
+    expensive metrics only compare each client with its shortlist. The pruned
+    pairs get the worst possible score, +inf for distances and -inf for
+    similarities, so they rank behind every candidate.
+
+    Without cheap metrics, or with at least as many candidates as servers,
+    nothing is pruned. With a ScoreCache, the metrics that run on all pairs
+    use it, the shortlisted pairs are always computed.
+
+    Returns the scores (metrics, clients, servers, features) and the
+    shortlist (clients, candidates) of server indexes.
+    """
+    client_tensor = TraceTensor(client_traces, compute_dtype, client_statistics)
+    server_tensor = TraceTensor(server_traces, compute_dtype, server_statistics)
+    num_clients, num_servers = client_tensor.num_nodes, server_tensor.num_nodes
+
+    scores = np.empty((len(metrics), num_clients, num_servers, client_tensor.num_features), dtype=np.float64)
+
+    cheap_indexes = [index for index, metric in enumerate(metrics) if metric.pairs_function is None]
+    expensive_indexes = [index for index, metric in enumerate(metrics) if metric.pairs_function is not None]
+
+    if score_cache is not None:
+        cached_pairs = CachedPairs(score_cache, client_traces, server_traces, get_score_mode(None, compute_dtype), timings)
+
+    def run_all_pairs(metric):
+        if score_cache is not None:
+            return run_cached_metric(metric, metric.apply_batch, client_tensor, server_tensor, cached_pairs, timings)
+        return run_metric(metric, metric.apply_batch, (client_tensor, server_tensor), num_clients * num_servers, timings)
+
+    for index in cheap_indexes:
+        scores[index] = run_all_pairs(metrics[index])
+
+    if len(cheap_indexes) == 0 or shortlist_size >= num_servers:
+        shortlist = np.tile(np.arange(num_servers), (num_clients, 1))
+        for index in expensive_indexes:
+            scores[index] = run_all_pairs(metrics[index])
+        return scores, shortlist
+
+    shortlist = get_shortlist(scores[cheap_indexes], [metrics[index].direction for index in cheap_indexes], shortlist_size)
+    client_index = np.arange(num_clients)[:, np.newaxis]
+
+    for index in expensive_indexes:
+        metric = metrics[index]
+        scores[index] = np.inf if metric.direction == LOWER_IS_BETTER else -np.inf
+        scores[index][client_index, shortlist] = run_metric(metric, metric.apply_pairs, (client_tensor, server_tensor, shortlist), shortlist.size, timings)
+
+    return scores, shortlist
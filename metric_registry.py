@@ -0,0 +1,170 @@
+#!/usr/bin/env python
+
+import importlib
+from collections import OrderedDict
+
+from metric_defaults import DEFAULT_BINS, DEFAULT_BINNING, DEFAULT_WINDOW, DEFAULT_STEP, DEFAULT_MAX_LAG
+
+LOWER_IS_BETTER = 'min'
+HIGHER_IS_BETTER = 'max'
+
+class LazyFunction():
+    """
+    Function of a metric module that is imported on the first call. The
+    registry only names the functions, so starting the command line or
+    selecting some metrics does not import the modules of the others, e.g.
+    sklearn for distance_pca_pearson.
+
+    Constructor Arguments:
+    module_name: name of the metric module
+    function_name: name of the function in the module
+    """
+
+    def __init__(self, module_name, function_name):
+        self.module_name = module_name
+        self.function_name = function_name
+        self.function = None
+
+    def __call__(self, *args, **kwargs):
+        if self.function is None:
+            self.function = getattr(importlib.import_module(self.module_name), self.function_name)
+        return self.function(*args, **kwargs)
+
+    def __getstate__(self):
+        # worker processes import the module themselves
+        return {'module_name': self.module_name, 'function_name': self.function_name, 'function': None}
+
+    def __repr__(self):
+        return 'LazyFunction({}.{})'.format(self.module_name, self.function_name)
+
+def get_module_functions(module_name, *function_names):
+    """
+    LazyFunctions of the named functions of a metric module.
+    """
+    return [LazyFunction(module_name, function_name) for function_name in function_names]
+
+class Metric():
+    """
+    Describes a metric of the framework.
+
+    Constructor Arguments:
+    name: name of the metric, stored in the metric column of ta_submission
+    direction: LOWER_IS_BETTER for distances (the server with the smallest
+        value is guessed), HIGHER_IS_BETTER for similarities
+    scalar_function: compares one client trace with one server trace and
+        returns one value per feature
+    batch_function: compares all clients of a TraceTensor with all servers
+        of a TraceTensor, returns an array (clients, servers, features)
+    stream_function: like batch_function, but reads two TraceStreams chunk
+        by chunk instead of the padded TraceTensors (--stream-chunk-rows)
+    params: dict of keyword arguments passed to all functions, e.g. the
+        number of bins of the mutual information
+    pairs_function: like batch_function, but compares every client only with
+        the servers of its row of a shortlist (clients, candidates) and
+        returns an array (clients, candidates, features). Metrics with a
+        pairs function are the expensive ones, in cascade mode they only run
+        on the servers the other metrics ranked best (--cascade).
+    version: increased when a change of the functions changes the scores,
+        cached scores of older versions are not used (--score-cache)
+    """
+
+    def __init__(self, name, direction, scalar_function, batch_function, stream_function, params=None, pairs_function=None, version=1):
+        self.name = name
+        self.direction = direction
+        self.scalar_function = scalar_function
+        self.batch_function = batch_function
+        self.stream_function = stream_function
+        self.params = params if params is not None else {}
+        self.pairs_function = pairs_function
+        self.version = version
+
+    def apply_scalar(self, client_trace, server_trace):
+        return self.scalar_function(client_trace, server_trace, **self.params)
+
+    def apply_batch(self, client_tensor, server_tensor):
+        return self.batch_function(client_tensor, server_tensor, **self.params)
+
+    def apply_stream(self, client_stream, server_stream):
+        return self.stream_function(client_stream, server_stream, **self.params)
+
+    def apply_pairs(self, client_tensor, server_tensor, shortlist):
+        return self.pairs_function(client_tensor, server_tensor, shortlist, **self.params)
+
+    def get_key(self):
+        """
+        Name and parameters of the metric, identifies checkpointed results.
+        """
+        if not self.params:
+            return self.name
+        return '{}({})'.format(self.name, ','.join('{}={}'.format(key, value) for key, value in sorted(self.params.iteritems())))
+
+    def with_params(self, **params):
+        """
+        Returns a copy of the metric with updated parameters.
+        """
+        updated_params = dict(self.params)
+        updated_params.update(params)
+        return Metric(self.name, self.direction, self.scalar_function, self.batch_function, self.stream_function, updated_params, self.pairs_function,
+            self.version)
+
+    def __repr__(self):
+        return 'Metric({})'.format(self.name)
+
+registered_metrics = OrderedDict()
+default_metric_names = []
+
+def register_metric(metric, default=True):
+    """
+    Adds a metric to the registry. New metrics only have to be registered,
+    the analysis picks them up from here. Metrics that are not default only
+    run when they are selected with --metrics, so adding them does not
+    change the rows of a default run.
+    """
+    registered_metrics[metric.name] = metric
+    if default:
+        default_metric_names.append(metric.name)
+
+def get_metric_names():
+    return list(registered_metrics.keys())
+
+def get_default_metric_names():
+    return list(default_metric_names)
+
+def get_metrics(names=None):
+    """
+    Returns the registered metrics with the given names in registry order, or
+    the default metrics if names is None. Raises KeyError for unknown names.
+    """
+    if names is None:
+        names = default_metric_names
+
+    for name in names:
+        if name not in registered_metrics:
+            raise KeyError(name)
+
+    return [metric for metric in registered_metrics.values() if metric.name in names]
+
+def set_metric_params(metrics, name, **params):
+    """
+    Returns the list of metrics where the metric with the given name has the
+    updated parameters. Metrics that are not selected are left out.
+    """
+    return [metric.with_params(**params) if metric.name == name else metric for metric in metrics]
+
+register_metric(Metric('scalar_counts', LOWER_IS_BETTER,
+    *get_module_functions('scalar_packet_count', 'apply_packet_count', 'batch_packet_count', 'stream_packet_count')))
+register_metric(Metric('distance_pca_pearson', HIGHER_IS_BETTER,
+    *get_module_functions('distance_pca_pearson', 'apply_pca_pearson', 'batch_pca_pearson', 'stream_pca_pearson'),
+    pairs_function=LazyFunction('distance_pca_pearson', 'pairs_pca_pearson')))
+register_metric(Metric('distance_pearson', HIGHER_IS_BETTER,
+    *get_module_functions('distance_pearson', 'apply_pearson', 'batch_pearson', 'stream_pearson'), version=2))
+register_metric(Metric('distance_rmse', LOWER_IS_BETTER,
+    *get_module_functions('distance_rmse', 'apply_rmse', 'batch_rmse', 'stream_rmse'), version=2))
+register_metric(Metric('distance_mutinfo', HIGHER_IS_BETTER,
+    *get_module_functions('distance_mutinfo', 'apply_mutinfo', 'batch_mutinfo', 'stream_mutinfo'),
+    params={'bins': DEFAULT_BINS, 'binning': DEFAULT_BINNING},
+    pairs_function=LazyFunction('distance_mutinfo', 'pairs_mutinfo')))
+register_metric(Metric('distance_window_xcorr', HIGHER_IS_BETTER,
+    *get_module_functions('distance_window_xcorr', 'apply_window_xcorr', 'batch_window_xcorr', 'stream_window_xcorr'),
+    params={'window': DEFAULT_WINDOW, 'step': DEFAULT_STEP, 'max_lag': DEFAULT_MAX_LAG},
+    pairs_function=LazyFunction('distance_window_xcorr', 'pairs_window_xcorr'), version=2), default=False)
@@ -0,0 +1,91 @@
+#!/usr/bin/env python
+
+import numpy as np
+
+# rows between two stored prefix sums, a truncated sum reads less than this
+# many rows of the trace
+STATISTICS_BLOCK_ROWS = 4096
+
+class NodeStatistics():
+    """
+    Summary of one trace, computed once and stored next to it, so metrics
+    get the column sums and value ranges without a pass over the rows.
+
+    Constructor Arguments:
+    num_rows: number of rows of the trace
+    sums, square_sums, minima, maxima: per feature column, shape (features,),
+        minima and maxima are +inf and -inf for an empty trace
+    block_sums, block_square_sums: prefix sums at every multiple of
+        block_rows, shape (num_rows / block_rows + 1, features), the first
+        row is zero
+    block_rows: rows per block of the prefix sums
+    """
+
+    def __init__(self, num_rows, sums, square_sums, minima, maxima, block_sums, block_square_sums, block_rows=STATISTICS_BLOCK_ROWS):
+        self.num_rows = num_rows
+        self.sums = sums
+        self.square_sums = square_sums
+        self.minima = minima
+        self.maxima = maxima
+        self.block_sums = block_sums
+        self.block_square_sums = block_square_sums
+        self.block_rows = block_rows
+
+    def get_truncated_sums(self, trace, limit):
+        """
+        Column sums and squared column sums of the first limit rows, from the
+        prefix sum of the last full block and the rows after it.
+        """
+        if limit >= self.num_rows:
+            return self.sums, self.square_sums
+
+        block = limit // self.block_rows
+        rest = np.asarray(trace[block * self.block_rows:limit], dtype=np.float64)
+        return self.block_sums[block] + rest.sum(axis=0), self.block_square_sums[block] + (rest ** 2).sum(axis=0)
+
+def compute_node_statistics(trace, block_rows=STATISTICS_BLOCK_ROWS):
+    """
+    NodeStatistics of a trace (rows, features), read block by block, so a
+    memory mapped trace is never loaded completely.
+    """
+    num_rows, num_features = trace.shape
+    num_blocks = num_rows // block_rows
+
+    block_sums = np.zeros((num_blocks + 1, num_features), dtype=np.float64)
+    block_square_sums = np.zeros((num_blocks + 1, num_features), dtype=np.float64)
+    sums = np.zeros(num_features, dtype=np.float64)
+    square_sums = np.zeros(num_features, dtype=np.float64)
+    minima = np.full(num_features, np.inf)
+    maxima = np.full(num_features, -np.inf)
+
+    for block, start in enumerate(xrange(0, num_rows, block_rows)):
+        rows = np.asarray(trace[start:start + block_rows], dtype=np.float64)
+        sums += rows.sum(axis=0)
+        square_sums += (rows ** 2).sum(axis=0)
+        minima = np.minimum(minima, rows.min(axis=0))
+        maxima = np.maximum(maxima, rows.max(axis=0))
+
+        if block < num_blocks:
+            block_sums[block + 1] = sums
+            block_square_sums[block + 1] = square_sums
+
+    return NodeStatistics(num_rows, sums, square_sums, minima, maxima, block_sums, block_square_sums, block_rows)
+
+def save_node_statistics(path, statistics):
+    np.savez(path, num_rows=statistics.num_rows, sums=statistics.sums, square_sums=statistics.square_sums,
+        minima=statistics.minima, maxima=statistics.maxima, block_sums=statistics.block_sums,
+        block_square_sums=statistics.block_square_sums, block_rows=statistics.block_rows)
+
+def load_node_statistics(path):
+    stored = np.load(path)
+    return NodeStatistics(int(stored['num_rows']), stored['sums'], stored['square_sums'], stored['minima'], stored['maxima'],
+        stored['block_sums'], stored['block_square_sums'], int(stored['block_rows']))
+
+def get_node_statistics(node_statistics, node_ids):
+    """
+    List of the NodeStatistics of the given nodes, None unless every node has
+    statistics.
+    """
+    if not node_statistics or any(node_id not in node_statistics for node_id in node_ids):
+        return None
+    return [node_statistics[node_id] for node_id in node_ids]
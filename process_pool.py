@@ -0,0 +1,75 @@
+#!/usr/bin/env python
+
+import multiprocessing
+import traceback
+
+from twisted.internet import defer
+
+def call_in_worker(function, args):
+    """
+    Runs in a worker process. The Python 2 pool has no error callback, so
+    exceptions are returned as formatted tracebacks instead of raised.
+    """
+    try:
+        return True, function(*args)
+    except Exception:
+        return False, traceback.format_exc()
+
+class ComputeExecutor():
+    """
+    Runs the metric computation of (setup, repetition) units outside of the
+    reactor thread, so the adbapi pool can load the next repetition while the
+    current one is computed.
+
+    Constructor Arguments:
+    reactor: the running Twisted reactor, results are handed back to it
+    num_workers: number of worker processes. With 1 worker everything is
+        computed inline in the reactor thread, like before.
+
+    At most 2 * num_workers units are loaded or computed at the same time.
+    A slot has to be reserved before the traces of a unit are loaded and is
+    released when its computation finished.
+    """
+
+    def __init__(self, reactor, num_workers):
+        self.reactor = reactor
+        self.num_workers = num_workers
+        self.slots = defer.DeferredSemaphore(2 * num_workers)
+
+        if num_workers > 1:
+            self.pool = multiprocessing.Pool(num_workers)
+        else:
+            self.pool = None
+
+    def reserve(self):
+        return self.slots.acquire()
+
+    def submit(self, function, *args):
+        """
+        Returns a deferred firing with function(*args). Releases the slot
+        reserved for the unit when the computation is done.
+        """
+        if self.pool is None:
+            deferred = defer.maybeDeferred(function, *args)
+        else:
+            deferred = defer.Deferred()
+            self.pool.apply_async(call_in_worker, (function, args), callback=lambda outcome: self.reactor.callFromThread(self.deliver, deferred, outcome))
+
+        deferred.addBoth(self.release)
+        return deferred
+
+    def deliver(self, deferred, outcome):
+        success, value = outcome
+        if success:
+            deferred.callback(value)
+        else:
+            deferred.errback(RuntimeError('Worker failed:\n' + value))
+
+    def release(self, result):
+        self.slots.release()
+        return result
+
+    def close(self):
+        if self.pool is not None:
+            self.pool.close()
+            self.pool.join()
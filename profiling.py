@@ -0,0 +1,163 @@
+#!/usr/bin/env python
+
+import csv
+import json
+import os
+import threading
+import time
+
+from contextlib import contextmanager
+
+class StageTimings():
+    """
+    Accumulated wall time, number of calls/items and number of rows per
+    stage. Plain data, so worker processes can send their timings back.
+    """
+
+    def __init__(self):
+        self.stages = {}
+
+    def add(self, stage, seconds, count=1, rows=0):
+        entry = self.stages.setdefault(stage, [0.0, 0, 0])
+        entry[0] += seconds
+        entry[1] += count
+        entry[2] += rows
+
+    @contextmanager
+    def timed(self, stage, count=1, rows=0):
+        start_time = time.time()
+        yield
+        self.add(stage, time.time() - start_time, count, rows)
+
+    def merge(self, other):
+        for stage, (seconds, count, rows) in other.stages.iteritems():
+            self.add(stage, seconds, count, rows)
+
+    def to_dict(self):
+        report = {}
+        for stage, (seconds, count, rows) in self.stages.iteritems():
+            report[stage] = {
+                'seconds': seconds,
+                'count': count,
+                'rows': rows,
+                'seconds_per_item': seconds / count if count > 0 else 0
+            }
+        return report
+
+class Profiler():
+    """
+    Collects StageTimings per setup and for the whole run.
+
+    Stages used by the analysis:
+    plan_query: the work plan queries of analyze and export-traces
+    db_fetch, decode: fetching the trace rows and decoding them to arrays
+    load_traces: total time to get the traces of a repetition
+    metric:<name>: compute time of a metric, count is the number of pairs
+    score_cache: hashing the traces and looking up cached scores, count is
+        the number of pairs found in the cache (--score-cache)
+    ranking, compute_repetition: ranking of the servers and total compute
+    result_write: writing result batches, per run only
+
+    Besides the timings, the bytes held by the loaded traces of every
+    repetition are kept with the bytes the same traces take as float64, see
+    --feature-dtypes. In cascade mode the number of clients whose server
+    survived the pruning is kept per repetition.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.run = StageTimings()
+        self.setups = {}
+        self.memory = {}
+        self.cascade = {}
+
+    def add(self, setup_id, stage, seconds, count=1, rows=0):
+        with self.lock:
+            self.run.add(stage, seconds, count, rows)
+            if setup_id is not None:
+                self.setups.setdefault(str(setup_id), StageTimings()).add(stage, seconds, count, rows)
+
+    def merge(self, setup_id, timings):
+        with self.lock:
+            self.run.merge(timings)
+            if setup_id is not None:
+                self.setups.setdefault(str(setup_id), StageTimings()).merge(timings)
+
+    @contextmanager
+    def timed(self, setup_id, stage, count=1, rows=0):
+        start_time = time.time()
+        yield
+        self.add(setup_id, stage, time.time() - start_time, count, rows)
+
+    def add_memory(self, setup_id, repetition, num_bytes, float64_bytes):
+        with self.lock:
+            self.memory.setdefault(str(setup_id), {})[str(repetition)] = {
+                'bytes': num_bytes,
+                'float64_bytes': float64_bytes,
+                'ratio': float(num_bytes) / float64_bytes if float64_bytes > 0 else 0
+            }
+
+    def add_cascade(self, setup_id, repetition, num_clients, num_survivors):
+        with self.lock:
+            self.cascade.setdefault(str(setup_id), {})[str(repetition)] = {
+                'clients': num_clients,
+                'survivors': num_survivors,
+                'survival_rate': float(num_survivors) / num_clients if num_clients > 0 else 0
+            }
+
+    def get_cascade_survival(self):
+        """
+        Number of clients and of clients whose server survived the pruning,
+        over all repetitions.
+        """
+        entries = [entry for repetitions in self.cascade.itervalues() for entry in repetitions.itervalues()]
+        return sum(entry['clients'] for entry in entries), sum(entry['survivors'] for entry in entries)
+
+    def get_cascade_rows(self):
+        rows = []
+        for setup_id, repetitions in sorted(self.cascade.iteritems()):
+            for repetition, entry in sorted(repetitions.iteritems()):
+                rows.append([setup_id, repetition, entry['clients'], entry['survivors'], entry['survival_rate']])
+        return rows
+
+    def get_memory_rows(self):
+        rows = []
+        for setup_id, repetitions in sorted(self.memory.iteritems()):
+            for repetition, entry in sorted(repetitions.iteritems()):
+                rows.append([setup_id, repetition, entry['bytes'], entry['float64_bytes'], entry['ratio']])
+        return rows
+
+    def write_report(self, path):
+        """
+        Writes the report as JSON, or as CSV if path ends with .csv. The CSV
+        report puts the per repetition memory into <path root>_memory.csv and
+        the cascade survival into <path root>_cascade.csv.
+        """
+        if path.endswith('.csv'):
+            with open(path, 'w') as report_file:
+                writer = csv.writer(report_file)
+                writer.writerow(['scope', 'stage', 'seconds', 'count', 'rows', 'seconds_per_item'])
+                scopes = [('run', self.run)] + sorted(self.setups.iteritems())
+                for scope, timings in scopes:
+                    for stage, entry in sorted(timings.to_dict().iteritems()):
+                        writer.writerow([scope, stage, entry['seconds'], entry['count'], entry['rows'], entry['seconds_per_item']])
+
+            with open(os.path.splitext(path)[0] + '_memory.csv', 'w') as memory_file:
+                writer = csv.writer(memory_file)
+                writer.writerow(['setup_id', 'repetition', 'bytes', 'float64_bytes', 'ratio'])
+                writer.writerows(self.get_memory_rows())
+
+            if self.cascade:
+                with open(os.path.splitext(path)[0] + '_cascade.csv', 'w') as cascade_file:
+                    writer = csv.writer(cascade_file)
+                    writer.writerow(['setup_id', 'repetition', 'clients', 'survivors', 'survival_rate'])
+                    writer.writerows(self.get_cascade_rows())
+        else:
+            report = {
+                'run': self.run.to_dict(),
+                'setups': dict((setup_id, timings.to_dict()) for setup_id, timings in self.setups.iteritems()),
+                'memory': self.memory,
+                'cascade': self.cascade
+            }
+            with open(path, 'w') as report_file:
+                json.dump(report, report_file, indent=2, sort_keys=True)
@@ -0,0 +1,93 @@
+#!/usr/bin/env python
+
+import numpy as np
+
+from metric_registry import LOWER_IS_BETTER
+
+# a client counts as identified within the top k if its server is among the
+# k best ranked servers
+DEFAULT_TOP_K = 3
+
+def get_correct_servers(network_setup, num_servers, num_clients):
+    """
+    0 based index of the server of each client 1..num_clients, shape (clients,).
+    """
+    client_indexes = np.arange(1, num_clients + 1)
+
+    if network_setup == 'directed':
+        return client_indexes - 1
+
+    return np.where(client_indexes < num_servers, 0, 1)
+
+def get_ranks(scores, correct_servers, directions):
+    """
+    Rank of the correct server among all servers for every metric, client and
+    feature, shape (metrics, clients, features). Rank 1 is the server the
+    metric guesses.
+
+    Arguments:
+    scores: array (metrics, clients, servers, features) from compute_all_pairs
+    correct_servers: index of the server of each client, see get_correct_servers
+    directions: LOWER_IS_BETTER or HIGHER_IS_BETTER for each metric
+
+    The rank is one plus the number of servers that score better than the
+    correct one. Servers with an equal score count as better if their index
+    is lower, so rank 1 matches the first minimum (maximum) the guess used to
+    take.
+    """
+    signs = np.array([1.0 if direction == LOWER_IS_BETTER else -1.0 for direction in directions])
+    # lower is better for every metric
+    keys = scores * signs[:, np.newaxis, np.newaxis, np.newaxis]
+
+    num_clients = scores.shape[1]
+    correct_keys = keys[:, np.arange(num_clients), correct_servers, :][:, :, np.newaxis, :]
+
+    server_indexes = np.arange(scores.shape[2])[np.newaxis, np.newaxis, :, np.newaxis]
+    earlier = server_indexes < correct_servers[np.newaxis, :, np.newaxis, np.newaxis]
+    better = (keys < correct_keys) | ((keys == correct_keys) & earlier)
+
+    return 1 + better.sum(axis=2)
+
+def get_rank_counts(ranks, top_k):
+    """
+    Per (metric, feature) counts of a repetition from the ranks
+    (metrics, clients, features): number of correct guesses (rank 1), number
+    of fails, number of clients ranked within the top k and the sum of the
+    reciprocal ranks. All arrays have shape (metrics, features).
+    """
+    num_clients = ranks.shape[1]
+
+    corrects = (ranks == 1).sum(axis=1)
+    fails = num_clients - corrects
+    top_k_hits = (ranks <= top_k).sum(axis=1)
+    reciprocal_ranks = (1.0 / ranks).sum(axis=1)
+
+    return corrects, fails, top_k_hits, reciprocal_ranks
+
+def get_shortlist(scores, directions, shortlist_size):
+    """
+    Candidate servers of every client for the cascade mode, shape
+    (clients, shortlist_size), best first.
+
+    Arguments:
+    scores: array (metrics, clients, servers, features) of the cheap metrics
+    directions: LOWER_IS_BETTER or HIGHER_IS_BETTER for each metric
+    shortlist_size: number of servers kept per client
+
+    The servers are ranked per metric and feature, the servers with the
+    lowest median rank over all of them are kept. The median is not thrown
+    off by a few metrics or features that do not identify the server, unlike
+    the sum of the ranks. Equal medians keep the lower server index, NaN
+    scores rank last.
+    """
+    signs = np.array([1.0 if direction == LOWER_IS_BETTER else -1.0 for direction in directions])
+    keys = scores * signs[:, np.newaxis, np.newaxis, np.newaxis]
+    keys[np.isnan(keys)] = np.inf
+
+    # 0 based rank of every server per metric, client and feature
+    order = np.argsort(keys, axis=2, kind='mergesort')
+    ranks = np.argsort(order, axis=2, kind='mergesort')
+    num_clients, num_servers = ranks.shape[1], ranks.shape[2]
+    median_ranks = np.median(ranks.transpose(1, 2, 0, 3).reshape(num_clients, num_servers, -1), axis=2)
+
+    return np.argsort(median_ranks, axis=1, kind='mergesort')[:, :shortlist_size]
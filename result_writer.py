@@ -0,0 +1,151 @@
+#!/usr/bin/env python
+
+import csv
+import os
+import time
+
+from twisted.internet import defer
+
+DB_COLUMNS = '(setup_id, metric, feature, success_avg, success_sd, num_successes, num_fails)'
+RANK_DB_COLUMNS = '(setup_id, metric, feature, top_k, top1_avg, topk_avg, mrr_avg, mrr_sd, num_ranked)'
+
+# the rank table is created on the first write, ta_submission has to exist
+RANK_TABLE_SCHEMA = '''CREATE TABLE IF NOT EXISTS {}.ta_rank_submission (setup_id INT, metric VARCHAR(64), feature VARCHAR(64),
+    top_k INT, top1_avg DOUBLE, topk_avg DOUBLE, mrr_avg DOUBLE, mrr_sd DOUBLE, num_ranked INT);'''
+
+def get_result_keys(rows):
+    """
+    Set of the (setup_id, metric, feature) keys of result or rank rows.
+    """
+    return set((row[0], row[1], row[2]) for row in rows)
+
+def insert_rows(txn, db_name, rows, rank_rows, replace):
+    """
+    Runs inside one pool transaction. In replace mode the old rows with the
+    (setup_id, metric, feature) keys of the new rows are deleted first, so a
+    re-run overwrites the computed metrics and keeps the other ones.
+    """
+    txn.execute(RANK_TABLE_SCHEMA.format(db_name))
+
+    if replace:
+        replaced_keys = sorted(get_result_keys(rows) | get_result_keys(rank_rows))
+        txn.executemany('DELETE FROM {}.ta_submission WHERE setup_id = %s AND metric = %s AND feature = %s;'.format(db_name), replaced_keys)
+        txn.executemany('DELETE FROM {}.ta_rank_submission WHERE setup_id = %s AND metric = %s AND feature = %s;'.format(db_name), replaced_keys)
+
+    txn.executemany('INSERT INTO {}.ta_submission {} VALUES (%s, %s, %s, %s, %s, %s, %s);'.format(db_name, DB_COLUMNS), rows)
+    txn.executemany('INSERT INTO {}.ta_rank_submission {} VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s);'.format(db_name, RANK_DB_COLUMNS), rank_rows)
+
+def get_rank_results_path(results_path):
+    """
+    CSV file of the rank rows next to the results file, results.csv gives
+    results_ranks.csv.
+    """
+    root, extension = os.path.splitext(results_path)
+    return root + '_ranks' + (extension or '.csv')
+
+def write_csv_rows(path, replaced_keys, rows, replace):
+    """
+    In replace mode the rows of the file with one of the (setup_id, metric,
+    feature) keys are dropped before the new rows are written.
+    """
+    kept_rows = []
+    if replace and os.path.exists(path):
+        with open(path) as results_file:
+            replaced_keys = set((str(setup_id), metric, feature) for setup_id, metric, feature in replaced_keys)
+            kept_rows = [row for row in csv.reader(results_file) if (row[0], row[1], row[2]) not in replaced_keys]
+
+    with open(path, 'w' if replace else 'a') as results_file:
+        writer = csv.writer(results_file)
+        writer.writerows(kept_rows)
+        writer.writerows(rows)
+
+class ResultWriter():
+    """
+    Collects the ta_submission and ta_rank_submission rows of several setups
+    and writes them with parameterized executemany calls in a single
+    transaction.
+
+    Constructor Arguments:
+    dbpool: adbapi connection pool, None to write to results_path instead
+    db_name: name of the database with the ta_submission table
+    results_path: CSV file used when there is no DB, the rank rows go to
+        the file from get_rank_results_path
+    replace: if True, existing rows of a setup, metric and feature are
+        replaced instead of appended to
+    batch_size: number of setups collected before the rows are written
+    profiler: optional Profiler, gets the time spent writing
+    """
+
+    def __init__(self, dbpool, db_name, results_path, replace, batch_size, profiler=None):
+        self.dbpool = dbpool
+        self.db_name = db_name
+        self.results_path = results_path
+        self.replace = replace
+        self.batch_size = batch_size
+        self.profiler = profiler
+
+        self.setup_ids = []
+        self.rows = []
+        self.rank_rows = []
+
+    def add_setup(self, setup_id, rows, rank_rows):
+        """
+        Adds the rows (setup_id, metric, feature, success_avg, success_sd,
+        num_successes, num_fails) and the rank rows (setup_id, metric, feature,
+        top_k, top1_avg, topk_avg, mrr_avg, mrr_sd, num_ranked) of a setup.
+        Returns a deferred that fires when a full batch was written.
+        """
+        self.setup_ids.append(setup_id)
+        self.rows.extend(rows)
+        self.rank_rows.extend(rank_rows)
+
+        if len(self.setup_ids) >= self.batch_size:
+            return self.flush()
+        return defer.succeed(None)
+
+    @defer.inlineCallbacks
+    def get_completed_setups(self, metric_names, feature_names):
+        """
+        Returns the set of setup ids (as strings) that already have a result
+        for every combination of the given metrics and features.
+        """
+        required_keys = set((metric, feature) for metric in metric_names for feature in feature_names)
+
+        if self.dbpool is None:
+            result_keys = []
+            if os.path.exists(self.results_path):
+                with open(self.results_path) as results_file:
+                    result_keys = [(row[0], row[1], row[2]) for row in csv.reader(results_file)]
+        else:
+            result_keys = yield self.dbpool.runQuery('SELECT DISTINCT setup_id, metric, feature FROM {}.ta_submission;'.format(self.db_name))
+
+        keys_per_setup = {}
+        for setup_id, metric, feature in result_keys:
+            keys_per_setup.setdefault(str(setup_id), set()).add((metric, feature))
+
+        completed = set(setup_id for setup_id, keys in keys_per_setup.iteritems() if required_keys <= keys)
+        defer.returnValue(completed)
+
+    @defer.inlineCallbacks
+    def flush(self):
+        setup_ids, rows, rank_rows = self.setup_ids, self.rows, self.rank_rows
+        self.setup_ids, self.rows, self.rank_rows = [], [], []
+
+        if len(setup_ids) == 0:
+            return
+
+        print 'Write Results of {} setups'.format(len(setup_ids))
+
+        start_time = time.time()
+        try:
+            if self.dbpool is None:
+                replaced_keys = get_result_keys(rows) | get_result_keys(rank_rows)
+                write_csv_rows(self.results_path, replaced_keys, rows, self.replace)
+                write_csv_rows(get_rank_results_path(self.results_path), replaced_keys, rank_rows, self.replace)
+            else:
+                yield self.dbpool.runInteraction(insert_rows, self.db_name, rows, rank_rows, self.replace)
+        except Exception as err:
+            print 'Problem writing Results to DB: ', err
+
+        if self.profiler is not None:
+            self.profiler.add(None, 'result_write', time.time() - start_time, 1, len(rows))
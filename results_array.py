@@ -0,0 +1,87 @@
+#!/usr/bin/env python
+
+import numpy as np
+
+class ResultsArray():
+    """
+    Identification results of a setup as arrays of shape
+    (repetitions, metrics, features).
+
+    - each client trace is compared with all server traces of a repetition
+    - per metric and feature the servers are ranked for every client, the
+      guess is correct if the client's server is ranked first
+    - corrects and fails count the correct and wrong guesses over the
+      clients of a repetition, top_k_hits the clients whose server was
+      ranked within the top k, reciprocal_ranks sums 1 / rank of the correct
+      server over the clients
+    - after all repetitions are finished, we have complete results for a
+      setup
+
+    Constructor Arguments:
+    corrects, fails, top_k_hits, reciprocal_ranks: arrays of the same shape
+        (repetitions, metrics, features)
+
+    Results of different repetitions are stacked with concatenate_results.
+    Partial results of the same repetitions, e.g. of different client groups
+    computed by separate workers, merge by addition.
+    """
+
+    def __init__(self, corrects, fails, top_k_hits, reciprocal_ranks):
+        self.corrects = np.asarray(corrects, dtype=np.int64)
+        self.fails = np.asarray(fails, dtype=np.int64)
+        self.top_k_hits = np.asarray(top_k_hits, dtype=np.int64)
+        self.reciprocal_ranks = np.asarray(reciprocal_ranks, dtype=np.float64)
+
+    def __add__(self, other):
+        return ResultsArray(self.corrects + other.corrects, self.fails + other.fails,
+            self.top_k_hits + other.top_k_hits, self.reciprocal_ranks + other.reciprocal_ranks)
+
+    def get_num_repetitions(self):
+        return self.corrects.shape[0]
+
+    def get_counts(self, repetition):
+        """
+        The four count matrices (metrics x features) of a repetition as nested
+        lists, e.g. for the checkpoint.
+        """
+        return (self.corrects[repetition].tolist(), self.fails[repetition].tolist(),
+            self.top_k_hits[repetition].tolist(), self.reciprocal_ranks[repetition].tolist())
+
+    def get_num_guesses(self):
+        return self.corrects + self.fails
+
+    def get_relative(self, counts):
+        """
+        counts divided by the number of guesses of each repetition, 0 where a
+        repetition had no guesses.
+        """
+        num_guesses = self.get_num_guesses()
+        relative = np.zeros(counts.shape, dtype=np.float64)
+        np.true_divide(counts, num_guesses, out=relative, where=num_guesses > 0)
+        return relative
+
+    def get_relative_success(self):
+        return self.get_relative(self.corrects)
+
+def new_results(num_metrics, num_features, num_repetitions=1):
+    shape = (num_repetitions, num_metrics, num_features)
+    return ResultsArray(np.zeros(shape, dtype=np.int64), np.zeros(shape, dtype=np.int64),
+        np.zeros(shape, dtype=np.int64), np.zeros(shape, dtype=np.float64))
+
+def build_repetition_results(corrects, fails, top_k_hits, reciprocal_ranks):
+    """
+    ResultsArray of one repetition from count matrices (metrics x features).
+    """
+    return ResultsArray([corrects], [fails], [top_k_hits], [reciprocal_ranks])
+
+def concatenate_results(results, num_metrics, num_features):
+    """
+    Stacks the ResultsArrays of several repetitions along the repetition axis.
+    """
+    if len(results) == 0:
+        return new_results(num_metrics, num_features, 0)
+
+    return ResultsArray(np.concatenate([result.corrects for result in results]),
+        np.concatenate([result.fails for result in results]),
+        np.concatenate([result.top_k_hits for result in results]),
+        np.concatenate([result.reciprocal_ranks for result in results]))
@@ -1,20 +1,32 @@
 #!/usr/bin/env python
 
+import numpy as np
+
+from trace_tensor import TraceTensor
+
 def apply_packet_count(client_trace, server_trace):
     """
     Simple scalar comparison where the sum of each column is compared
     for pairs of client and server.
     """
-    diffs = []
+    diffs = batch_packet_count(TraceTensor([client_trace]), TraceTensor([server_trace]))
+    return list(diffs[0, 0])
 
-    for feature in xrange(0,len(client_trace[0])):
-        summed_client = sum([row[feature] for row in client_trace])
-        summed_server = sum([row[feature] for row in server_trace])
+def batch_packet_count(client_tensor, server_tensor):
+    """
+    Column sums of all clients compared with the column sums of all servers,
+    shape (clients, servers, features).
+    """
+    client_sums = client_tensor.get_column_sums()
+    server_sums = server_tensor.get_column_sums()
 
-        try:
-            diff = abs(summed_client - summed_server)
-        except Exception as err:
-            print err
-        diffs.append(diff)
+    return np.abs(client_sums[:, np.newaxis, :] - server_sums[np.newaxis, :, :])
+
+def stream_packet_count(client_stream, server_stream):
+    """
+    batch_packet_count over TraceStreams, from running column sums.
+    """
+    client_sums = client_stream.get_column_sums()
+    server_sums = server_stream.get_column_sums()
 
-    return diffs
+    return np.abs(client_sums[:, np.newaxis, :] - server_sums[np.newaxis, :, :])
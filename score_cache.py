@@ -0,0 +1,135 @@
+#!/usr/bin/env python
+
+import hashlib
+import sqlite3
+import time
+
+import numpy as np
+
+DEFAULT_SCORE_CACHE_MB = 1024
+# rows of a trace hashed at once, memory mapped traces are read block by block
+HASH_BLOCK_ROWS = 65536
+# keys per lookup query, below the SQLite limit of bound parameters
+LOOKUP_BATCH_SIZE = 500
+# seconds a connection waits for the lock of another process
+LOCK_TIMEOUT = 60
+
+CACHE_SCHEMA = '''
+CREATE TABLE IF NOT EXISTS scores (key TEXT PRIMARY KEY, scores BLOB, size INTEGER, last_used REAL);
+CREATE INDEX IF NOT EXISTS scores_last_used ON scores (last_used);
+'''
+
+def get_trace_hash(trace):
+    """
+    SHA-1 of the float64 values of a trace (rows, features), the same for a
+    plain array, a memory map or a CompactTrace with the same values.
+    """
+    digest = hashlib.sha1(str(trace.shape))
+    for start in xrange(0, len(trace), HASH_BLOCK_ROWS):
+        digest.update(np.ascontiguousarray(trace[start:start + HASH_BLOCK_ROWS], dtype=np.float64).tostring())
+    return digest.hexdigest()
+
+def get_score_mode(stream_chunk_rows, compute_dtype):
+    """
+    Part of the cache key for settings that change the scores of all
+    metrics: streamed PCA projects all rows, float32 rounds.
+    """
+    return '{};{}'.format('stream' if stream_chunk_rows else 'batch', compute_dtype)
+
+def get_score_keys(metric, mode, client_hashes, server_hashes):
+    """
+    Cache keys of all (client, server) pairs of a metric, a list of lists
+    indexed [client][server]. The key covers the content of both traces, the
+    metric name, version and parameters and the score mode.
+    """
+    metric_key = '{}@{};{}'.format(metric.get_key(), metric.version, mode)
+    return [[hashlib.sha1('{}:{}:{}'.format(client_hash, server_hash, metric_key)).hexdigest() for server_hash in server_hashes]
+        for client_hash in client_hashes]
+
+class ScoreCache():
+    """
+    Persistent cache of the per feature scores of single (client, server)
+    pairs in a SQLite file, so a re-run only computes the metrics and traces
+    that changed. Each entry is the score vector (features,) of one pair and
+    metric. When the entries exceed max_bytes, the least recently used ones
+    are evicted.
+
+    The connection is opened on first use and not pickled, so the cache can
+    be handed to the worker processes with the SetupParameters.
+
+    Constructor Arguments:
+    path: SQLite file of the cache, created if it does not exist
+    max_bytes: size limit of the stored scores and keys
+    """
+
+    def __init__(self, path, max_bytes=DEFAULT_SCORE_CACHE_MB * 1024 * 1024):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.connection = None
+
+    def __getstate__(self):
+        return {'path': self.path, 'max_bytes': self.max_bytes, 'connection': None}
+
+    def get_connection(self):
+        if self.connection is None:
+            self.connection = sqlite3.connect(self.path, timeout=LOCK_TIMEOUT, isolation_level=None)
+            # a crash may lose the last scores but never corrupts the file,
+            # without a sync on every lookup
+            self.connection.execute('PRAGMA journal_mode = WAL')
+            self.connection.execute('PRAGMA synchronous = NORMAL')
+            self.connection.executescript(CACHE_SCHEMA)
+        return self.connection
+
+    def get_scores(self, keys):
+        """
+        Dict key -> score vector of the cached keys, which are marked as
+        recently used.
+        """
+        connection = self.get_connection()
+
+        found = {}
+        for start in xrange(0, len(keys), LOOKUP_BATCH_SIZE):
+            batch = keys[start:start + LOOKUP_BATCH_SIZE]
+            rows = connection.execute('SELECT key, scores FROM scores WHERE key IN ({})'.format(', '.join(['?'] * len(batch))), batch).fetchall()
+            for key, scores in rows:
+                found[key] = np.frombuffer(scores, dtype=np.float64)
+
+        if found:
+            with connection:
+                connection.execute('BEGIN')
+                connection.executemany('UPDATE scores SET last_used = ? WHERE key = ?', [(time.time(), key) for key in found])
+        return found
+
+    def put_scores(self, entries):
+        """
+        Stores a list of (key, score vector) and evicts the least recently
+        used entries beyond the size limit.
+        """
+        now = time.time()
+        rows = []
+        for key, scores in entries:
+            blob = np.ascontiguousarray(scores, dtype=np.float64).tostring()
+            rows.append((key, sqlite3.Binary(blob), len(blob) + len(key), now))
+
+        connection = self.get_connection()
+        with connection:
+            connection.execute('BEGIN IMMEDIATE')
+            connection.executemany('INSERT OR REPLACE INTO scores VALUES (?, ?, ?, ?)', rows)
+            self.evict(connection)
+
+    def evict(self, connection):
+        excess = (connection.execute('SELECT SUM(size) FROM scores').fetchone()[0] or 0) - self.max_bytes
+        if excess <= 0:
+            return
+
+        evicted_keys = []
+        for key, size in connection.execute('SELECT key, size FROM scores ORDER BY last_used'):
+            evicted_keys.append((key,))
+            excess -= size
+            if excess <= 0:
+                break
+
+        connection.executemany('DELETE FROM scores WHERE key = ?', evicted_keys)
+
+    def get_num_bytes(self):
+        return self.get_connection().execute('SELECT SUM(size) FROM scores').fetchone()[0] or 0
@@ -0,0 +1,85 @@
+#!/usr/bin/env python
+
+import json
+import os
+
+import numpy as np
+
+INDEX_FILE = 'index.json'
+
+def get_scores_path(setup_id, repetition):
+    return os.path.join('setup_{}'.format(setup_id), 'rep_{}.npy'.format(repetition))
+
+class ScoreStore():
+    """
+    Local copy of the score tensors computed by analyze (--save-scores), so
+    the scores can be combined later without computing the metrics again.
+    Each (setup_id, repetition) tensor of shape
+    (metrics, clients, servers, features) is one .npy file. The index keeps
+    per setup the network setup, the number of clients, the metric names and
+    directions, and the stored repetitions.
+
+    Constructor Arguments:
+    path: directory of the store, created on the first write
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.index = {'features': None, 'setups': {}}
+
+        index_path = os.path.join(path, INDEX_FILE)
+        if os.path.exists(index_path):
+            with open(index_path) as index_file:
+                self.index = json.load(index_file)
+
+    def write_index(self):
+        if not os.path.exists(self.path):
+            os.makedirs(self.path)
+
+        index_path = os.path.join(self.path, INDEX_FILE)
+        with open(index_path + '.tmp', 'w') as index_file:
+            json.dump(self.index, index_file)
+        os.rename(index_path + '.tmp', index_path)
+
+    def put_setup(self, setup_id, network_setup, num_clients, metric_names, directions):
+        """
+        Registers a setup. Scores of a setup stored earlier with other metrics
+        are dropped from the index.
+        """
+        entry = self.index['setups'].get(str(setup_id))
+        if entry is None or entry['metrics'] != metric_names:
+            entry = {'repetitions': {}}
+            self.index['setups'][str(setup_id)] = entry
+
+        entry['setup'] = network_setup
+        entry['num_clients'] = num_clients
+        entry['metrics'] = metric_names
+        entry['directions'] = directions
+
+    def get_setup(self, setup_id):
+        return self.index['setups'].get(str(setup_id))
+
+    def get_setup_ids(self):
+        return sorted(int(setup_id) for setup_id in self.index['setups'])
+
+    def put_repetition(self, setup_id, repetition, scores):
+        relative_path = get_scores_path(setup_id, repetition)
+        full_path = os.path.join(self.path, relative_path)
+        if not os.path.exists(os.path.dirname(full_path)):
+            os.makedirs(os.path.dirname(full_path))
+
+        np.save(full_path, np.ascontiguousarray(scores, dtype=np.float64))
+        self.index['setups'][str(setup_id)]['repetitions'][str(repetition)] = relative_path
+
+    def get_repetitions(self, setup_id):
+        entry = self.get_setup(setup_id)
+        if entry is None:
+            return []
+        return sorted(int(repetition) for repetition in entry['repetitions'])
+
+    def get_repetition(self, setup_id, repetition):
+        """
+        Returns the score tensor of a repetition as a read-only memory map.
+        """
+        relative_path = self.get_setup(setup_id)['repetitions'][str(repetition)]
+        return np.load(os.path.join(self.path, relative_path), mmap_mode='r')
@@ -0,0 +1,8 @@
+import os
+import sys
+
+# trial runs in _trial_temp, the modules of the framework are imported from
+# the repository root, the SQLite pool standing in for MySQL from benchmarks
+ROOT_PATH = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT_PATH)
+sys.path.insert(0, os.path.join(ROOT_PATH, 'benchmarks'))
@@ -0,0 +1,94 @@
+#!/usr/bin/env python
+
+import csv
+
+import numpy as np
+
+from twisted.internet import reactor
+
+import traffic_analysis as ta
+from trace_store import TraceStore, LocalTraceSource
+from result_writer import ResultWriter, get_rank_results_path
+from process_pool import ComputeExecutor
+from profiling import Profiler
+from metric_registry import get_metrics
+
+# value ranges of the features like in traces_submission, the inter-arrival
+# times are rounded so packets fall on window boundaries
+FEATURE_SCALES = np.array([1.0, 0.01, 1500.0, 64.0, 65535.0])
+DECIMALS = 3
+
+def make_trace(rng, num_rows):
+    return np.round(rng.rand(num_rows, len(FEATURE_SCALES)) * FEATURE_SCALES, DECIMALS)
+
+def make_client_trace(rng, server_trace, num_rows, correlation=0.8):
+    base = server_trace[:num_rows] / FEATURE_SCALES
+    noise = rng.rand(num_rows, len(FEATURE_SCALES))
+    return np.round((correlation * base + np.sqrt(1 - correlation ** 2) * noise) * FEATURE_SCALES, DECIMALS)
+
+def make_pair_traces(num_clients, num_servers, num_rows, seed):
+    """
+    Client and server trace lists of different lengths, client i follows
+    server i.
+    """
+    rng = np.random.RandomState(seed)
+    server_traces = [make_trace(rng, num_rows + rng.randint(0, num_rows / 5)) for server in xrange(0, num_servers)]
+    client_traces = [make_client_trace(rng, server_traces[client % num_servers], num_rows - rng.randint(0, num_rows / 5))
+        for client in xrange(0, num_clients)]
+    return client_traces, server_traces
+
+def make_node_traces(network_setup, num_clients, num_rows, seed):
+    """
+    dict node_id -> trace of a repetition like traces_submission, clients 1..n
+    and servers from 31, each client follows its server of
+    ranking.get_correct_servers.
+    """
+    from ranking import get_correct_servers
+
+    num_servers = num_clients if network_setup == 'directed' else 2
+    rng = np.random.RandomState(seed)
+
+    server_traces = [make_trace(rng, num_rows) for server in xrange(0, num_servers)]
+    node_traces = dict((31 + server, trace) for server, trace in enumerate(server_traces))
+    for client, server in enumerate(get_correct_servers(network_setup, num_servers, num_clients)):
+        node_traces[client + 1] = make_client_trace(rng, server_traces[server], num_rows - rng.randint(0, num_rows / 10))
+    return node_traces
+
+def build_store(path, setups, num_rows=200):
+    """
+    TraceStore with synthetic traces of the setups, a list of
+    (setup_id, network_setup, num_clients, num_reps). A setup with 0
+    repetitions is stored without traces.
+    """
+    store = TraceStore(path)
+    store.index['features'] = ta.FEATURES
+    for setup_id, network_setup, num_clients, num_reps in setups:
+        store.put_setup(setup_id, network_setup, num_clients, max(num_reps, 1))
+        for repetition in xrange(1, num_reps + 1):
+            store.put_repetition(setup_id, repetition, make_node_traces(network_setup, num_clients, num_rows, setup_id * 100 + repetition))
+    store.write_index()
+    return store
+
+def make_context(store, results_path, metrics=None, checkpoint=None, resume=False, replace=False):
+    """
+    AnalysisContext of an inline analysis of a TraceStore, writing the
+    results to a CSV file.
+    """
+    profiler = Profiler()
+    writer = ResultWriter(None, None, results_path, replace, 10, profiler)
+    executor = ComputeExecutor(reactor, 1)
+    return ta.AnalysisContext(LocalTraceSource(store), None, None, writer, executor, resume, checkpoint,
+        metrics if metrics is not None else get_metrics(), profiler)
+
+def read_results(results_path):
+    """
+    Sorted rows of a results file and of its rank file.
+    """
+    rows = []
+    for path in [results_path, get_rank_results_path(results_path)]:
+        try:
+            with open(path) as results_file:
+                rows.append(sorted(csv.reader(results_file)))
+        except IOError:
+            rows.append([])
+    return rows
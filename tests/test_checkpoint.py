@@ -0,0 +1,117 @@
+#!/usr/bin/env python
+
+import os
+
+from twisted.internet import defer
+from twisted.trial import unittest
+
+import traffic_analysis as ta
+from checkpoint import Checkpoint
+from result_writer import get_rank_results_path
+
+from tests.helpers import build_store, make_context, read_results
+
+COUNTS = ([[1, 2]], [[3, 2]], [[4, 4]], [[1.5, 2.25]])
+
+class CheckpointTest(unittest.TestCase):
+
+    def test_reopen(self):
+        path = self.mktemp()
+        checkpoint = Checkpoint(path)
+        checkpoint.put_repetition(7, 2, 'metrics', *COUNTS)
+        checkpoint.close()
+
+        # an interrupted write leaves a partial line
+        with open(path, 'a') as checkpoint_file:
+            checkpoint_file.write('{"setup_id": 7, "repet')
+
+        reopened = Checkpoint(path)
+        self.assertEqual(reopened.get_repetition('7', 2, 'metrics'), COUNTS)
+        self.assertEqual(reopened.get_repetition(7, 2, 'other metrics'), None)
+        self.assertEqual(reopened.get_repetition(7, 1, 'metrics'), None)
+        reopened.close()
+
+class ResumeTest(unittest.TestCase):
+    """
+    analyze_setups on a local trace store with a checkpoint and --resume.
+    """
+
+    def setUp(self):
+        self.store = build_store(self.mktemp(), [(1, 'directed', 4, 2), (2, 'undirected', 4, 2)])
+        self.checkpoint_path = self.mktemp()
+        self.compute_repetition = ta.compute_repetition
+
+    def tearDown(self):
+        ta.compute_repetition = self.compute_repetition
+
+    @defer.inlineCallbacks
+    def analyze(self, results_path, resume=False):
+        checkpoint = Checkpoint(self.checkpoint_path)
+        context = make_context(self.store, results_path, checkpoint=checkpoint, resume=resume)
+        yield ta.analyze_setups(None, context, 'all')
+        checkpoint.close()
+        defer.returnValue(read_results(results_path))
+
+    def fail_computation(self, *args):
+        raise AssertionError('repetition computed again')
+
+    @defer.inlineCallbacks
+    def test_repetitions_restored_from_checkpoint(self):
+        results = yield self.analyze(self.mktemp())
+        self.assertEqual(len(results[0]), 2 * 5 * 5)
+        self.assertEqual(len(results[1]), 2 * 5 * 5)
+
+        ta.compute_repetition = self.fail_computation
+        restored = yield self.analyze(self.mktemp())
+        self.assertEqual(restored, results)
+
+    @defer.inlineCallbacks
+    def test_resume_skips_written_setups(self):
+        results_path = self.mktemp()
+        results = yield self.analyze(results_path)
+
+        ta.compute_repetition = self.fail_computation
+        os.remove(self.checkpoint_path)
+        resumed = yield self.analyze(results_path, resume=True)
+        self.assertEqual(resumed, results)
+
+    @defer.inlineCallbacks
+    def test_failed_repetition_is_analyzed_again(self):
+        complete = yield self.analyze(self.mktemp())
+        os.remove(self.checkpoint_path)
+
+        def fail_setup_1(node_traces, setup_parameters, node_statistics=None):
+            if setup_parameters.setup_index == 1:
+                raise ValueError('failed')
+            return self.compute_repetition(node_traces, setup_parameters, node_statistics)
+
+        results_path = self.mktemp()
+        ta.compute_repetition = fail_setup_1
+        results = yield self.analyze(results_path)
+        self.assertEqual(set(row[0] for row in results[0]), set(['2']))
+
+        ta.compute_repetition = self.compute_repetition
+        resumed = yield self.analyze(results_path, resume=True)
+        self.assertEqual(resumed, complete)
+
+    @defer.inlineCallbacks
+    def test_resume_appends_missing_setups(self):
+        results_path = self.mktemp()
+        complete = yield self.analyze(results_path)
+        setup_1 = [[row for row in rows if row[0] == '1'] for rows in complete]
+
+        # results of setup 1 only, written by an interrupted run
+        with open(results_path, 'w') as results_file:
+            results_file.writelines(','.join(row) + '\n' for row in setup_1[0])
+        with open(get_rank_results_path(results_path), 'w') as results_file:
+            results_file.writelines(','.join(row) + '\n' for row in setup_1[1])
+
+        def fail_setup_1(node_traces, setup_parameters, node_statistics=None):
+            if setup_parameters.setup_index == 1:
+                raise AssertionError('complete setup analyzed again')
+            return self.compute_repetition(node_traces, setup_parameters, node_statistics)
+
+        os.remove(self.checkpoint_path)
+        ta.compute_repetition = fail_setup_1
+        resumed = yield self.analyze(results_path, resume=True)
+        self.assertEqual(resumed, complete)
@@ -0,0 +1,93 @@
+#!/usr/bin/env python
+
+import numpy as np
+
+from twisted.trial import unittest
+
+from metric_registry import get_metrics, get_metric_names
+from trace_tensor import TraceTensor
+from trace_stream import TraceStream
+from trace_dtypes import COMPACT_DTYPES, CompactTrace, parse_feature_dtypes, compact_trace, compact_node_traces, get_num_bytes, \
+    get_float64_bytes, get_dtype_key
+from distance_pearson import batch_pearson, stream_pearson
+
+from tests.helpers import make_pair_traces
+
+class CompactTraceTest(unittest.TestCase):
+
+    def setUp(self):
+        client_traces, server_traces = make_pair_traces(1, 1, 100, 7)
+        self.trace = server_traces[0][:100]
+        # packet counts, lengths, TTLs and window sizes are integers
+        self.trace[:, [0, 2, 3, 4]] = np.round(self.trace[:, [0, 2, 3, 4]])
+
+    def test_parse_feature_dtypes(self):
+        self.assertEqual(parse_feature_dtypes('float64', 5), None)
+        self.assertEqual(parse_feature_dtypes('compact', 5), [np.dtype(name) for name in COMPACT_DTYPES])
+        self.assertEqual(parse_feature_dtypes('uint8, float32', 2), [np.dtype('uint8'), np.dtype('float32')])
+        self.assertRaises(ValueError, parse_feature_dtypes, 'uint8', 5)
+        self.assertRaises(ValueError, parse_feature_dtypes, 'uint8,nonsense', 2)
+
+    def test_integer_columns_are_exact(self):
+        compact = compact_trace(self.trace, parse_feature_dtypes('compact', 5))
+
+        self.assertTrue(isinstance(compact, CompactTrace))
+        self.assertEqual(compact.columns[0].dtype, np.uint32)
+        self.assertEqual(compact.columns[3].dtype, np.uint8)
+        np.testing.assert_array_equal(np.asarray(compact)[:, [0, 2, 3, 4]], self.trace[:, [0, 2, 3, 4]])
+        np.testing.assert_allclose(compact[:, 1], self.trace[:, 1], rtol=1e-7)
+        np.testing.assert_array_equal(compact[10:20], np.asarray(compact)[10:20])
+        self.assertTrue(compact.nbytes < self.trace.nbytes / 3)
+
+    def test_columns_that_do_not_fit_stay_float64(self):
+        trace = self.trace.copy()
+        trace[0, 3] = 300
+        compact = compact_trace(trace, parse_feature_dtypes('compact', 5))
+
+        self.assertEqual(compact.columns[3].dtype, np.float64)
+        np.testing.assert_array_equal(compact[:, 3], trace[:, 3])
+
+    def test_memory_accounting(self):
+        node_traces = {1: self.trace, 31: self.trace[:50]}
+        compact = compact_node_traces(node_traces, parse_feature_dtypes('compact', 5))
+
+        self.assertEqual(get_float64_bytes(compact), get_num_bytes(node_traces))
+        self.assertEqual(get_num_bytes(compact), 150 * (4 + 4 + 2 + 1 + 2))
+        self.assertTrue(compact_node_traces(node_traces, None) is node_traces)
+
+    def test_dtype_key(self):
+        self.assertEqual(get_dtype_key(None, 'float64'), '')
+        self.assertEqual(get_dtype_key(parse_feature_dtypes('compact', 5), 'float32'), ';dtypes=uint32,float32,uint16,uint8,uint16;compute=float32')
+
+class Float32Test(unittest.TestCase):
+    """
+    The float32 compute mode only rounds the traces, the sums are float64.
+    """
+
+    def setUp(self):
+        # large window sizes of unrelated servers, exact in float32
+        rng = np.random.RandomState(8)
+        self.client_traces = [np.round(60000 + rng.rand(3000, 5) * 5000) for client in xrange(0, 2)]
+        self.server_traces = [self.client_traces[0] + np.round(rng.rand(3000, 5) * 500), np.round(60000 + rng.rand(3000, 5) * 5000)]
+
+    def test_pearson_of_large_values(self):
+        expected = batch_pearson(TraceTensor(self.client_traces), TraceTensor(self.server_traces))
+        self.assertTrue(expected[0, 0].min() > 0.9)
+        self.assertTrue(expected[0, 1].max() < 0.1)
+
+        coeffs = batch_pearson(TraceTensor(self.client_traces, np.float32), TraceTensor(self.server_traces, np.float32))
+        np.testing.assert_allclose(coeffs, expected, atol=1e-9)
+
+        streamed = stream_pearson(TraceStream(self.client_traces, 512, np.float32), TraceStream(self.server_traces, 512, np.float32))
+        np.testing.assert_allclose(streamed, expected, atol=1e-9)
+
+    def test_all_metrics_close_to_float64(self):
+        client_traces, server_traces = make_pair_traces(3, 3, 300, 9)
+        # the windows of distance_window_xcorr come from the rounded
+        # inter-arrival times, packets near a window boundary may move
+        for metric in get_metrics(get_metric_names()):
+            if metric.name == 'distance_window_xcorr':
+                continue
+            expected = metric.apply_batch(TraceTensor(client_traces), TraceTensor(server_traces))
+            scores = metric.apply_batch(TraceTensor(client_traces, np.float32), TraceTensor(server_traces, np.float32))
+            np.testing.assert_allclose(scores, expected, rtol=1e-3, atol=1e-3, err_msg=metric.name)
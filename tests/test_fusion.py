@@ -0,0 +1,93 @@
+#!/usr/bin/env python
+
+import numpy as np
+
+from twisted.internet import defer
+from twisted.trial import unittest
+
+import traffic_analysis as ta
+from metric_registry import LOWER_IS_BETTER, HIGHER_IS_BETTER
+from score_store import ScoreStore
+from ranking import get_correct_servers
+from fusion import FusionSample, load_samples, cross_validate, get_fusion_rows
+
+from tests.helpers import build_store, make_context
+
+def make_scores(rng, num_clients, informative):
+    """
+    Score tensor (metrics, clients, servers, features) of a directed setup.
+    The first metric is a distance, the second a similarity. Only the
+    informative (metric, feature) channels prefer the client's server.
+    """
+    scores = rng.rand(2, num_clients, num_clients, 2)
+    for metric, feature in informative:
+        best = scores[metric, :, :, feature].min() - 1 if metric == 0 else scores[metric, :, :, feature].max() + 1
+        scores[metric, np.arange(num_clients), np.arange(num_clients), feature] = best
+    return scores
+
+class FusionSampleTest(unittest.TestCase):
+
+    def test_goodness_and_ranks(self):
+        scores = make_scores(np.random.RandomState(1), 4, [(0, 0), (1, 1)])
+        sample = FusionSample(1, 1, scores, [LOWER_IS_BETTER, HIGHER_IS_BETTER], np.arange(4))
+
+        self.assertEqual(sample.goodness.shape, (4, 4, 4))
+        np.testing.assert_array_equal(sample.goodness[:, :, 0], -scores[0, :, :, 0])
+        np.testing.assert_array_equal(sample.goodness[:, :, 3], scores[1, :, :, 1])
+        np.testing.assert_array_equal(sample.channel_ranks[np.arange(4), np.arange(4)][:, [0, 3]], 0)
+        np.testing.assert_allclose(sample.zscores.mean(axis=1), 0, atol=1e-12)
+        np.testing.assert_array_equal(sample.get_labels(), np.eye(4, dtype=bool))
+
+    def test_pruned_pairs_tie_with_worst(self):
+        scores = make_scores(np.random.RandomState(2), 3, [])
+        scores[1, 0, 2, :] = -np.inf
+        sample = FusionSample(1, 1, scores, [LOWER_IS_BETTER, HIGHER_IS_BETTER], np.arange(3))
+
+        np.testing.assert_array_equal(sample.goodness[0, 2, 2:], scores[1, 0, :2, :].min(axis=0))
+        self.assertTrue(np.isfinite(sample.zscores).all())
+
+class CrossValidateTest(unittest.TestCase):
+
+    def setUp(self):
+        rng = np.random.RandomState(3)
+        self.samples = [FusionSample(setup_id, repetition, make_scores(rng, 6, [(0, 0), (1, 1)]), [LOWER_IS_BETTER, HIGHER_IS_BETTER],
+            np.arange(6)) for setup_id in [1, 2] for repetition in [1, 2, 3]]
+
+    def test_rank_fusion(self):
+        results, weights = cross_validate(self.samples, 'rank', 2)
+
+        self.assertEqual(sorted(results), [1, 2])
+        self.assertTrue(weights[0] > weights[1] and weights[3] > weights[2])
+        self.assertAlmostEqual(weights.sum(), 1.0)
+        # the ranks of the noise channels still add up, the server of a
+        # client may come second
+        rows = get_fusion_rows(results, 'rank', 2)
+        self.assertEqual([row[:3] + row[4:5] + row[7:] for row in rows], [(1, 'rank', 2, 1.0, 18), (2, 'rank', 2, 1.0, 18)])
+        self.assertTrue(all(row[3] > 0.8 for row in rows))
+
+    def test_linear_fusion(self):
+        results, weights = cross_validate(self.samples, 'linear', 2)
+
+        self.assertTrue(weights[0] > abs(weights[1]) and weights[3] > abs(weights[2]))
+        for setup_id, rows in results.iteritems():
+            self.assertEqual([row[0] for row in rows], [1.0] * 3)
+
+class StoredScoresTest(unittest.TestCase):
+    """
+    Scores saved by analyze are loaded as one FusionSample per repetition.
+    """
+
+    @defer.inlineCallbacks
+    def test_load_saved_scores(self):
+        store = build_store(self.mktemp(), [(1, 'directed', 4, 2), (2, 'undirected', 4, 1)])
+        score_store = ScoreStore(self.mktemp())
+        context = make_context(store, self.mktemp())
+        context.score_store = score_store
+        yield ta.analyze_setups(None, context, 'all')
+
+        samples, channels = load_samples(ScoreStore(score_store.path), [1, 2, 3])
+        self.assertEqual([(sample.setup_id, sample.repetition) for sample in samples], [(1, 1), (1, 2), (2, 1)])
+        self.assertEqual(len(channels), len(context.metrics) * 5)
+        self.assertEqual(samples[0].goodness.shape, (4, 4, len(channels)))
+        self.assertEqual(samples[2].goodness.shape, (4, 2, len(channels)))
+        np.testing.assert_array_equal(samples[2].correct_servers, get_correct_servers('undirected', 2, 4))
@@ -0,0 +1,131 @@
+#!/usr/bin/env python
+
+import numpy as np
+
+from twisted.trial import unittest
+
+from metric_registry import get_metrics, get_metric_names
+from trace_tensor import TraceTensor
+from trace_stream import TraceStream
+from distance_rmse import batch_rmse, stream_rmse
+from distance_window_xcorr import get_peak_correlations, batch_window_xcorr, standardize
+
+from tests.helpers import make_pair_traces
+
+def direct_rmse(client_trace, server_trace):
+    num_rows = min(len(client_trace), len(server_trace))
+    return np.sqrt(((client_trace[:num_rows] - server_trace[:num_rows]) ** 2).mean(axis=0))
+
+def direct_peak_correlation(client_series, server_series, max_lag):
+    """
+    get_peak_correlations of one pair by trying every shift.
+    """
+    client_series, server_series = standardize(client_series), standardize(server_series)
+    peaks = np.zeros(client_series.shape[1])
+    for shift in xrange(-(len(server_series) - 1), len(client_series)):
+        if max_lag is not None and abs(shift) > max_lag:
+            continue
+        server_rows = np.arange(max(0, -shift), min(len(server_series), len(client_series) - shift))
+        peaks = np.maximum(peaks, np.abs((client_series[server_rows + shift] * server_series[server_rows]).sum(axis=0)))
+    return np.minimum(peaks, 1.0)
+
+class RegistryTest(unittest.TestCase):
+
+    def test_window_xcorr_is_opt_in(self):
+        self.assertEqual([metric.name for metric in get_metrics()],
+            ['scalar_counts', 'distance_pca_pearson', 'distance_pearson', 'distance_rmse', 'distance_mutinfo'])
+        self.assertEqual([metric.name for metric in get_metrics(['distance_window_xcorr'])], ['distance_window_xcorr'])
+
+class BatchMetricTest(unittest.TestCase):
+    """
+    The batch and stream functions of every metric against its scalar
+    function, which compares one pair at a time.
+    """
+
+    def setUp(self):
+        self.client_traces, self.server_traces = make_pair_traces(4, 3, 300, 1)
+
+    def get_pair_scores(self, metric):
+        return np.array([[metric.apply_scalar(client_trace, server_trace) for server_trace in self.server_traces]
+            for client_trace in self.client_traces])
+
+    def test_batch_equals_pairs(self):
+        for metric in get_metrics(get_metric_names()):
+            scores = metric.apply_batch(TraceTensor(self.client_traces), TraceTensor(self.server_traces))
+            self.assertEqual(scores.shape, (4, 3, 5))
+            np.testing.assert_allclose(scores, self.get_pair_scores(metric), rtol=1e-9, atol=1e-12, err_msg=metric.name)
+
+    def test_stream_equals_batch(self):
+        for metric in get_metrics(get_metric_names()):
+            scores = metric.apply_batch(TraceTensor(self.client_traces), TraceTensor(self.server_traces))
+            for chunk_rows in [32, 1000]:
+                streamed = metric.apply_stream(TraceStream(self.client_traces, chunk_rows), TraceStream(self.server_traces, chunk_rows))
+                np.testing.assert_allclose(streamed, scores, rtol=1e-9, atol=1e-9, err_msg='{}, chunk rows {}'.format(metric.name, chunk_rows))
+
+    def test_pairs_equal_batch(self):
+        client_tensor, server_tensor = TraceTensor(self.client_traces), TraceTensor(self.server_traces)
+        shortlist = np.array([[2, 0], [1, 2], [0, 1], [2, 1]])
+        for metric in get_metrics(get_metric_names()):
+            if metric.pairs_function is None:
+                continue
+            scores = metric.apply_batch(client_tensor, server_tensor)
+            pairs = metric.apply_pairs(client_tensor, server_tensor, shortlist)
+            np.testing.assert_allclose(pairs, scores[np.arange(4)[:, np.newaxis], shortlist], rtol=1e-9, atol=1e-12, err_msg=metric.name)
+
+class RmseTest(unittest.TestCase):
+
+    def test_nearly_equal_traces(self):
+        rng = np.random.RandomState(2)
+        server_trace = np.round(rng.rand(2000, 5) * [1.0, 0.01, 1500.0, 64.0, 65535.0])
+        client_trace = server_trace[:1900].copy()
+        client_trace[rng.rand(1900) < 0.01, 4] += 1
+
+        errors = batch_rmse(TraceTensor([client_trace]), TraceTensor([server_trace]))
+        np.testing.assert_allclose(errors[0, 0], direct_rmse(client_trace, server_trace), rtol=1e-12)
+        streamed = stream_rmse(TraceStream([client_trace], 256), TraceStream([server_trace], 256))
+        np.testing.assert_allclose(streamed[0, 0], direct_rmse(client_trace, server_trace), rtol=1e-12)
+
+    def test_float32(self):
+        rng = np.random.RandomState(3)
+        server_trace = np.round(rng.rand(1000, 5) * 65535.0)
+        client_trace = server_trace + (rng.rand(1000, 5) < 0.01)
+
+        errors = batch_rmse(TraceTensor([client_trace], np.float32), TraceTensor([server_trace], np.float32))
+        np.testing.assert_allclose(errors[0, 0], direct_rmse(client_trace, server_trace), rtol=1e-12)
+
+class WindowCorrelationTest(unittest.TestCase):
+
+    def setUp(self):
+        rng = np.random.RandomState(4)
+        self.client_series = [rng.rand(length, 5) for length in (100, 3, 40, 1)]
+        self.server_series = [rng.rand(length, 5) for length in (2, 60, 100, 7)]
+
+    def test_all_overlapping_shifts(self):
+        for max_lag in [None, 10, 0]:
+            coeffs = get_peak_correlations(self.client_series, self.server_series, max_lag)
+            for client, client_series in enumerate(self.client_series):
+                for server, server_series in enumerate(self.server_series):
+                    np.testing.assert_allclose(coeffs[client, server], direct_peak_correlation(client_series, server_series, max_lag), atol=1e-12)
+
+    def test_pair_score_independent_of_batch(self):
+        coeffs = get_peak_correlations(self.client_series, self.server_series, None)
+        single = get_peak_correlations(self.client_series[:1], self.server_series[:1], None)
+        np.testing.assert_allclose(single[0, 0], coeffs[0, 0], atol=1e-12)
+
+    def test_time_shifted_traces_match(self):
+        rng = np.random.RandomState(5)
+        def make_trace(num_rows):
+            return np.column_stack([np.ones(num_rows), rng.exponential(0.01, num_rows), rng.randint(60, 1500, num_rows),
+                np.full(num_rows, 64.0), rng.randint(1, 65535, num_rows)])
+        server_trace, other_trace = make_trace(3000), make_trace(3000)
+        # the client starts 300 packets, about 30 windows, after its server
+        client_trace = server_trace[300:]
+
+        client_tensor = TraceTensor([client_trace])
+        coeffs = batch_window_xcorr(client_tensor, TraceTensor([server_trace, other_trace]), window=0.1, max_lag=None)
+        short_lag = batch_window_xcorr(client_tensor, TraceTensor([server_trace]), window=0.1, max_lag=10)
+
+        # packet counts and byte sums per window
+        for feature in [0, 2]:
+            self.assertTrue(coeffs[0, 0, feature] > 2 * coeffs[0, 1, feature])
+            self.assertTrue(coeffs[0, 0, feature] > 2 * short_lag[0, 0, feature])
@@ -0,0 +1,88 @@
+#!/usr/bin/env python
+
+import numpy as np
+
+from twisted.internet import task
+from twisted.trial import unittest
+
+from trace_prefetch import TracePrefetcher
+
+# a trace of 100 float64 rows of one feature, 800 bytes
+TRACE_ROWS = 100
+TRACE_BYTES = TRACE_ROWS * 8
+
+class TracePrefetcherTest(unittest.TestCase):
+    """
+    Loads that take one second on a task.Clock, so the order in which the
+    prefetcher admits them is deterministic.
+    """
+
+    def setUp(self):
+        self.clock = task.Clock()
+        self.running = 0
+        self.max_running = 0
+        self.loaded = []
+
+    def load_function(self, repetition, num_rows=TRACE_ROWS):
+        self.running += 1
+        self.max_running = max(self.max_running, self.running)
+
+        def finish():
+            self.running -= 1
+            return {repetition: np.zeros(num_rows)}
+        return task.deferLater(self.clock, 1, finish)
+
+    def start_loads(self, prefetcher, num_loads, num_rows=TRACE_ROWS):
+        for repetition in xrange(0, num_loads):
+            prefetcher.load(self.load_function, repetition, num_rows).addCallback(self.loaded.append)
+
+    def advance(self, seconds):
+        for second in xrange(0, seconds):
+            self.clock.advance(1)
+
+    def test_depth_bounds_running_loads(self):
+        prefetcher = TracePrefetcher(3, 100 * TRACE_BYTES)
+        self.start_loads(prefetcher, 10)
+
+        self.advance(1)
+        self.assertEqual(len(self.loaded), 3)
+        self.advance(10)
+        self.assertEqual(len(self.loaded), 10)
+        self.assertEqual(self.max_running, 3)
+        self.assertEqual(prefetcher.held_bytes, 10 * TRACE_BYTES)
+
+    def test_budget_holds_back_loads(self):
+        prefetcher = TracePrefetcher(2, TRACE_BYTES + 200)
+        self.start_loads(prefetcher, 6)
+
+        # the third load starts while the first one is the only one held,
+        # then the loads wait for a release
+        self.advance(10)
+        self.assertEqual(len(self.loaded), 3)
+        self.assertEqual(prefetcher.held_bytes, 3 * TRACE_BYTES)
+
+        prefetcher.release(self.loaded[0][1])
+        self.advance(10)
+        self.assertEqual(len(self.loaded), 3)
+
+        for released in xrange(1, 6):
+            prefetcher.release(self.loaded[released][1])
+            self.advance(10)
+            self.assertTrue(prefetcher.held_bytes <= prefetcher.max_bytes + prefetcher.depth * TRACE_BYTES)
+
+        self.assertEqual([sorted(node_traces) for node_traces, num_bytes in self.loaded], [[repetition] for repetition in xrange(0, 6)])
+        self.assertEqual(prefetcher.held_bytes, 0)
+
+    def test_repetition_larger_than_budget(self):
+        prefetcher = TracePrefetcher(2, TRACE_BYTES)
+        self.start_loads(prefetcher, 2, 10 * TRACE_ROWS)
+
+        self.advance(5)
+        self.assertEqual(len(self.loaded), 2)
+        self.assertEqual(self.loaded[0][1], 10 * TRACE_BYTES)
+
+        prefetcher.release(self.loaded[0][1])
+        prefetcher.release(self.loaded[1][1])
+        self.start_loads(prefetcher, 1, 10 * TRACE_ROWS)
+        self.advance(5)
+        self.assertEqual(len(self.loaded), 3)
@@ -0,0 +1,51 @@
+#!/usr/bin/env python
+
+import numpy as np
+
+from twisted.trial import unittest
+
+from metric_registry import LOWER_IS_BETTER, HIGHER_IS_BETTER
+from ranking import get_correct_servers, get_ranks, get_rank_counts, get_shortlist
+
+class RankingTest(unittest.TestCase):
+
+    def test_correct_servers(self):
+        self.assertEqual(get_correct_servers('directed', 4, 4).tolist(), [0, 1, 2, 3])
+        self.assertEqual(get_correct_servers('undirected', 2, 4).tolist(), [0, 1, 1, 1])
+
+    def test_ranks(self):
+        # (metrics, clients, servers, features), one distance and one similarity
+        scores = np.array([
+            [[[0.1], [0.5], [0.3]], [[0.2], [0.9], [0.4]], [[0.7], [0.6], [0.5]]],
+            [[[0.9], [0.1], [0.3]], [[0.2], [0.9], [0.4]], [[0.1], [0.2], [0.3]]],
+        ])
+        ranks = get_ranks(scores, np.array([0, 1, 2]), [LOWER_IS_BETTER, HIGHER_IS_BETTER])
+
+        self.assertEqual(ranks[:, :, 0].tolist(), [[1, 3, 1], [1, 1, 1]])
+
+    def test_ties_rank_lower_index_first(self):
+        scores = np.array([[[[0.5], [0.5], [0.5]], [[0.5], [0.5], [0.5]]]])
+        ranks = get_ranks(scores, np.array([0, 2]), [LOWER_IS_BETTER])
+
+        self.assertEqual(ranks[0, :, 0].tolist(), [1, 3])
+
+    def test_rank_counts(self):
+        # (metrics, clients, features)
+        ranks = np.array([[[1, 2], [3, 1], [1, 4], [2, 1]]])
+        corrects, fails, top_k_hits, reciprocal_ranks = get_rank_counts(ranks, 2)
+
+        self.assertEqual(corrects.tolist(), [[2, 2]])
+        self.assertEqual(fails.tolist(), [[2, 2]])
+        self.assertEqual(top_k_hits.tolist(), [[3, 3]])
+        np.testing.assert_allclose(reciprocal_ranks, [[1 + 1.0 / 3 + 1 + 0.5, 0.5 + 1 + 0.25 + 1]])
+
+    def test_shortlist(self):
+        # two metrics agree that server 2 is best for client 0, server 0 is
+        # best for client 1 by median rank
+        scores = np.array([
+            [[[0.3], [0.2], [0.1]], [[0.1], [0.3], [0.2]]],
+            [[[0.4], [0.5], [0.6]], [[0.9], [0.1], [0.5]]],
+        ])
+        shortlist = get_shortlist(scores, [LOWER_IS_BETTER, HIGHER_IS_BETTER], 2)
+
+        self.assertEqual(shortlist.tolist(), [[2, 1], [0, 2]])
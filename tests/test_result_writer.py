@@ -0,0 +1,57 @@
+#!/usr/bin/env python
+
+from twisted.internet import defer
+from twisted.trial import unittest
+
+from result_writer import ResultWriter
+from sqlite_pool import SQLiteConnectionPool
+
+from tests.helpers import read_results
+
+def make_rows(setup_id, metric, value):
+    rows = [(setup_id, metric, feature, value, 0.0, 1, 0) for feature in ['packet_count', 'window_size']]
+    rank_rows = [(setup_id, metric, feature, 3, value, value, value, 0.0, 4) for feature in ['packet_count', 'window_size']]
+    return rows, rank_rows
+
+class ReplaceTest(unittest.TestCase):
+    """
+    A replace run of a subset of the metrics overwrites only the rows of
+    those metrics.
+    """
+
+    @defer.inlineCallbacks
+    def write(self, writer, setups):
+        for setup_id, metric, value in setups:
+            yield writer.add_setup(setup_id, *make_rows(setup_id, metric, value))
+        yield writer.flush()
+
+    def get_expected(self, setups):
+        rows, rank_rows = [], []
+        for setup_id, metric, value in setups:
+            setup_rows, setup_rank_rows = make_rows(setup_id, metric, value)
+            rows.extend(setup_rows)
+            rank_rows.extend(setup_rank_rows)
+        return rows, rank_rows
+
+    @defer.inlineCallbacks
+    def test_csv(self):
+        path = self.mktemp()
+        yield self.write(ResultWriter(None, None, path, False, 10), [(1, 'rmse', 0.5), (1, 'pearson', 0.25), (2, 'rmse', 0.75)])
+        yield self.write(ResultWriter(None, None, path, True, 10), [(1, 'rmse', 1.0)])
+
+        rows, rank_rows = self.get_expected([(1, 'rmse', 1.0), (1, 'pearson', 0.25), (2, 'rmse', 0.75)])
+        self.assertEqual(read_results(path), [sorted([str(value) for value in row] for row in rows),
+            sorted([str(value) for value in row] for row in rank_rows)])
+
+    @defer.inlineCallbacks
+    def test_db(self):
+        dbpool = SQLiteConnectionPool('tadb')
+        dbpool.create_tables()
+        yield self.write(ResultWriter(dbpool, 'tadb', None, False, 10), [(1, 'rmse', 0.5), (1, 'pearson', 0.25), (2, 'rmse', 0.75)])
+        yield self.write(ResultWriter(dbpool, 'tadb', None, True, 10), [(1, 'rmse', 1.0)])
+
+        rows, rank_rows = self.get_expected([(1, 'rmse', 1.0), (1, 'pearson', 0.25), (2, 'rmse', 0.75)])
+        db_rows = yield dbpool.runQuery('SELECT * FROM tadb.ta_submission;')
+        db_rank_rows = yield dbpool.runQuery('SELECT * FROM tadb.ta_rank_submission;')
+        self.assertEqual(sorted(tuple(row) for row in db_rows), sorted(rows))
+        self.assertEqual(sorted(tuple(row) for row in db_rank_rows), sorted(rank_rows))
@@ -0,0 +1,51 @@
+#!/usr/bin/env python
+
+import numpy as np
+
+from twisted.trial import unittest
+
+from metric_engine import compute_all_pairs
+from metric_registry import get_metrics, get_metric_names, set_metric_params
+from profiling import StageTimings
+from score_cache import ScoreCache
+
+from tests.helpers import make_pair_traces
+
+class ScoreCacheTest(unittest.TestCase):
+
+    def setUp(self):
+        self.client_traces, self.server_traces = make_pair_traces(4, 3, 200, 6)
+        self.metrics = get_metrics(get_metric_names())
+        self.expected = compute_all_pairs(self.client_traces, self.server_traces, self.metrics)
+        self.cache = ScoreCache(self.mktemp())
+
+    def test_cached_scores_equal_computed(self):
+        cold = compute_all_pairs(self.client_traces, self.server_traces, self.metrics, score_cache=self.cache)
+        np.testing.assert_array_equal(cold, self.expected)
+
+        timings = StageTimings()
+        warm = compute_all_pairs(self.client_traces, self.server_traces, self.metrics, timings, score_cache=self.cache)
+        np.testing.assert_array_equal(warm, self.expected)
+        self.assertFalse(any(stage.startswith('metric:') for stage in timings.stages))
+        self.assertEqual(timings.stages['score_cache'][1], len(self.metrics) * 4 * 3)
+
+    def test_changed_client_is_recomputed(self):
+        compute_all_pairs(self.client_traces, self.server_traces, self.metrics, score_cache=self.cache)
+
+        client_traces = list(self.client_traces)
+        client_traces[1] = client_traces[1][:150]
+        expected = compute_all_pairs(client_traces, self.server_traces, self.metrics)
+        # the client is computed in a smaller batch, equal up to rounding
+        np.testing.assert_allclose(compute_all_pairs(client_traces, self.server_traces, self.metrics, score_cache=self.cache), expected, rtol=1e-12)
+
+    def test_changed_parameters_are_not_served(self):
+        compute_all_pairs(self.client_traces, self.server_traces, self.metrics, score_cache=self.cache)
+
+        metrics = set_metric_params(self.metrics, 'distance_mutinfo', bins=8)
+        expected = compute_all_pairs(self.client_traces, self.server_traces, metrics)
+        np.testing.assert_array_equal(compute_all_pairs(self.client_traces, self.server_traces, metrics, score_cache=self.cache), expected)
+
+    def test_eviction(self):
+        cache = ScoreCache(self.mktemp(), max_bytes=4096)
+        compute_all_pairs(self.client_traces, self.server_traces, self.metrics, score_cache=cache)
+        self.assertTrue(0 < cache.get_num_bytes() <= 4096)
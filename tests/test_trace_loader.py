@@ -0,0 +1,75 @@
+#!/usr/bin/env python
+
+import numpy as np
+
+from twisted.internet import defer
+from twisted.trial import unittest
+
+import traffic_analysis as ta
+from trace_loader import DatabaseTraceSource
+from trace_dtypes import CompactTrace, parse_feature_dtypes
+from profiling import Profiler
+from sqlite_pool import SQLiteConnectionPool
+from synthetic import SyntheticSetup
+
+class DatabaseTraceSourceTest(unittest.TestCase):
+    """
+    DatabaseTraceSource on the SQLite pool, the traces of the setups are
+    known from the SyntheticSetups.
+    """
+
+    def setUp(self):
+        self.dbpool = SQLiteConnectionPool('tadb')
+        self.dbpool.create_tables()
+        self.setups = {1: SyntheticSetup('directed', 3, 2, 40, 0.8, 1), 2: SyntheticSetup('undirected', 4, 1, 30, 0.8, 2)}
+        for setup_id, synthetic_setup in sorted(self.setups.iteritems()):
+            self.dbpool.insert_setup(setup_id, synthetic_setup)
+
+        # repetition 2 of setup 1 lost the trace of a server
+        self.dbpool.connection.execute('DELETE FROM tadb.traces_submission WHERE setup_id = 1 AND repetition = 2 AND node_id = 32')
+        # a batch smaller than a trace, the traces of a node come in several batches
+        self.source = DatabaseTraceSource(self.dbpool, 'tadb', 7, Profiler())
+
+    def get_setup_parameters(self, setup_id, feature_dtypes=None):
+        synthetic_setup = self.setups[setup_id]
+        return ta.build_setup_parameters(setup_id, (synthetic_setup.setup, synthetic_setup.num_clients, synthetic_setup.num_reps), [],
+            feature_dtypes=feature_dtypes)
+
+    @defer.inlineCallbacks
+    def test_work_plan(self):
+        work_plan = yield self.source.get_work_plan()
+
+        self.assertEqual(work_plan.get_setup_ids(), [1, 2])
+        self.assertEqual(work_plan.get_setup(1).setup_data, ('directed', 3, 2))
+        self.assertEqual(sorted(work_plan.get_setup(1).repetitions), [1, 2])
+        self.assertEqual(work_plan.get_setup(1).get_repetition(1).get_missing_server(3), None)
+        self.assertEqual(work_plan.get_setup(1).get_repetition(2).get_missing_server(3), 32)
+
+        node_traces = self.setups[2].generate_repetition(1)
+        self.assertEqual(work_plan.get_setup(2).get_repetition(1).node_rows,
+            dict((node_id, len(trace)) for node_id, trace in node_traces.iteritems()))
+
+    @defer.inlineCallbacks
+    def test_load_repetition(self):
+        for setup_id, repetition in [(1, 1), (2, 1)]:
+            expected = self.setups[setup_id].generate_repetition(repetition)
+            node_traces = yield self.source.load_repetition(self.get_setup_parameters(setup_id), repetition)
+
+            self.assertEqual(sorted(node_traces), sorted(expected))
+            for node_id, trace in expected.iteritems():
+                np.testing.assert_array_equal(node_traces[node_id], trace)
+
+    @defer.inlineCallbacks
+    def test_load_missing_trace(self):
+        node_traces = yield self.source.load_repetition(self.get_setup_parameters(1), 2)
+        self.assertEqual(sorted(node_traces), [1, 2, 3, 31, 33])
+
+    @defer.inlineCallbacks
+    def test_load_compact(self):
+        feature_dtypes = parse_feature_dtypes('float64,float32,float64,float64,float64', 5)
+        expected = self.setups[1].generate_repetition(1)
+        node_traces = yield self.source.load_repetition(self.get_setup_parameters(1, feature_dtypes), 1)
+
+        for node_id, trace in expected.iteritems():
+            self.assertTrue(isinstance(node_traces[node_id], CompactTrace))
+            np.testing.assert_allclose(np.asarray(node_traces[node_id]), trace, rtol=1e-7)
@@ -0,0 +1,130 @@
+#!/usr/bin/env python
+
+import json
+import os
+
+import numpy as np
+
+from twisted.internet import defer
+from twisted.trial import unittest
+
+import traffic_analysis as ta
+from trace_loader import DatabaseTraceSource
+from trace_store import TraceStore, LocalTraceSource, export_traces, INDEX_FILE
+from node_statistics import compute_node_statistics, get_node_statistics
+from metric_registry import get_metrics
+from sqlite_pool import SQLiteConnectionPool
+from synthetic import SyntheticSetup
+
+from tests.helpers import build_store, make_trace
+
+class ExportTest(unittest.TestCase):
+    """
+    export_traces from the SQLite pool into a TraceStore, read back through
+    the LocalTraceSource.
+    """
+
+    def setUp(self):
+        self.dbpool = SQLiteConnectionPool('tadb')
+        self.dbpool.create_tables()
+        self.setups = {1: SyntheticSetup('directed', 3, 2, 40, 0.8, 1), 2: SyntheticSetup('undirected', 4, 2, 30, 0.8, 2)}
+        for setup_id, synthetic_setup in sorted(self.setups.iteritems()):
+            self.dbpool.insert_setup(setup_id, synthetic_setup)
+
+        # repetition 2 of setup 2 has no traces
+        self.dbpool.connection.execute('DELETE FROM tadb.traces_submission WHERE setup_id = 2 AND repetition = 2')
+        self.db_source = DatabaseTraceSource(self.dbpool, 'tadb', 100)
+        self.path = self.mktemp()
+
+    @defer.inlineCallbacks
+    def export(self, setup_ids):
+        work_plan = yield self.db_source.get_work_plan()
+        setup_parameters_list = [ta.build_setup_parameters(setup_id, work_plan.get_setup(setup_id).setup_data, []) for setup_id in setup_ids]
+        yield export_traces(self.db_source, TraceStore(self.path), setup_parameters_list, work_plan)
+        defer.returnValue(work_plan)
+
+    @defer.inlineCallbacks
+    def test_stored_traces_equal_db(self):
+        db_plan = yield self.export([1, 2])
+        source = LocalTraceSource(TraceStore(self.path))
+        store_plan = yield source.get_work_plan()
+
+        self.assertEqual(store_plan.get_setup_ids(), [1, 2])
+        for setup_id in [1, 2]:
+            self.assertEqual(store_plan.get_setup(setup_id).setup_data, db_plan.get_setup(setup_id).setup_data)
+            self.assertEqual(sorted(store_plan.get_setup(setup_id).repetitions), sorted(db_plan.get_setup(setup_id).repetitions))
+
+            setup_parameters = ta.build_setup_parameters(setup_id, store_plan.get_setup(setup_id).setup_data, [])
+            for repetition in store_plan.get_setup(setup_id).repetitions:
+                expected = self.setups[setup_id].generate_repetition(repetition)
+                node_traces = yield source.load_repetition(setup_parameters, repetition)
+                self.assertEqual(sorted(node_traces), sorted(expected))
+                for node_id, trace in expected.iteritems():
+                    np.testing.assert_array_equal(node_traces[node_id], trace)
+
+        self.assertEqual(sorted(store_plan.get_setup(2).repetitions), [1])
+
+    @defer.inlineCallbacks
+    def test_export_adds_setups(self):
+        yield self.export([2])
+        yield self.export([1])
+
+        store = TraceStore(self.path)
+        self.assertEqual(store.get_setup_ids(), [1, 2])
+        self.assertEqual(store.index['features'], ta.FEATURES)
+        self.assertEqual(store.get_setup(1), ['directed', 3, 2])
+
+class StatisticsTest(unittest.TestCase):
+    """
+    NodeStatistics of the stored traces and their use by the metrics.
+    """
+
+    def test_truncated_sums(self):
+        trace = make_trace(np.random.RandomState(3), 103)
+        statistics = compute_node_statistics(trace, block_rows=10)
+
+        np.testing.assert_allclose(statistics.sums, trace.sum(axis=0), rtol=1e-12)
+        np.testing.assert_array_equal(statistics.minima, trace.min(axis=0))
+        np.testing.assert_array_equal(statistics.maxima, trace.max(axis=0))
+        for limit in [0, 9, 10, 55, 100, 103, 200]:
+            sums, square_sums = statistics.get_truncated_sums(trace, limit)
+            np.testing.assert_allclose(sums, trace[:limit].sum(axis=0), rtol=1e-12, atol=1e-12, err_msg='limit {}'.format(limit))
+            np.testing.assert_allclose(square_sums, (trace[:limit] ** 2).sum(axis=0), rtol=1e-12, atol=1e-12, err_msg='limit {}'.format(limit))
+
+    def test_update_statistics(self):
+        path = self.mktemp()
+        store = build_store(path, [(1, 'directed', 3, 2)], num_rows=50)
+        self.assertEqual(store.update_statistics(), 0)
+
+        # a store written before the statistics, and a trace replaced since
+        for key, stored_nodes in store.index['traces'].iteritems():
+            for node_id, entry in stored_nodes.iteritems():
+                stored_nodes[node_id] = entry[:2]
+        store.write_index()
+        self.assertEqual(TraceStore(path).get_statistics(1, 1), {})
+        self.assertEqual(TraceStore(path).update_statistics(), 12)
+
+        store = TraceStore(path)
+        trace = np.array(store.get_repetition(1, 1)[1])
+        np.save(os.path.join(path, store.index['traces']['1/1']['1'][0]), trace[:20])
+        store.index['traces']['1/1']['1'][1] = 20
+        self.assertEqual(store.update_statistics(), 1)
+
+        with open(os.path.join(path, INDEX_FILE)) as index_file:
+            self.assertEqual(json.load(index_file)['traces'], store.index['traces'])
+        statistics = TraceStore(path).get_statistics(1, 1)
+        self.assertEqual(sorted(statistics), [1, 2, 3, 31, 32, 33])
+        self.assertEqual(statistics[1].num_rows, 20)
+        np.testing.assert_allclose(statistics[1].sums, trace[:20].sum(axis=0), rtol=1e-12)
+
+    def test_scores_with_statistics_equal_without(self):
+        store = build_store(self.mktemp(), [(1, 'undirected', 4, 1)], num_rows=120)
+        node_traces = store.get_repetition(1, 1)
+        node_statistics = store.get_statistics(1, 1)
+        self.assertEqual(get_node_statistics(node_statistics, [1, 31, 40]), None)
+
+        for stream_chunk_rows in [None, 32]:
+            setup_parameters = ta.build_setup_parameters(1, store.get_setup(1), get_metrics(), stream_chunk_rows)
+            results, timings, scores, survivors = ta.compute_repetition(node_traces, setup_parameters)
+            stored = ta.compute_repetition(node_traces, setup_parameters, node_statistics)
+            np.testing.assert_allclose(stored[2], scores, rtol=1e-9, atol=1e-12)
@@ -0,0 +1,111 @@
+#!/usr/bin/env python
+
+from twisted.internet import defer, task
+from twisted.trial import unittest
+
+import traffic_analysis as ta
+from work_queue import WorkQueue, PENDING, LEASED, DONE, FAILED
+
+from tests.helpers import build_store, make_context, read_results
+
+SHARDS = [(2, 1, True), (1, 1, True), (1, 2, False)]
+COUNTS = ([[1]], [[2]], [[3]], [[1.5]])
+
+class WorkQueueTest(unittest.TestCase):
+
+    def setUp(self):
+        self.queue = WorkQueue(self.mktemp())
+        self.queue.put_work([(1, 'directed', 3, 2), (2, 'undirected', 3, 1)], SHARDS)
+
+    def tearDown(self):
+        self.queue.close()
+
+    def test_lease_in_order(self):
+        self.assertEqual(self.queue.lease('a'), (2, 1, True))
+        self.assertEqual(self.queue.lease('b'), (1, 1, True))
+        self.assertEqual(self.queue.lease('a'), (1, 2, False))
+        self.assertEqual(self.queue.lease('b'), None)
+        self.assertEqual(self.queue.get_state_counts(), {LEASED: 3})
+
+    def test_expired_lease_is_reissued(self):
+        self.queue.put_work([], [], lease_seconds=-1)
+        self.assertEqual(self.queue.lease('crashed'), (2, 1, True))
+        self.assertEqual(self.queue.lease('b'), (2, 1, True))
+
+    def test_renewed_lease_is_kept(self):
+        self.assertEqual(self.queue.lease('a'), (2, 1, True))
+        self.queue.renew('a')
+        self.assertEqual(self.queue.lease('b'), (1, 1, True))
+
+    def test_finished_setups(self):
+        for shard in [self.queue.lease('a'), self.queue.lease('a')]:
+            self.queue.complete(shard[0], shard[1], 'key', ['scalar_counts'], 3, COUNTS)
+        self.assertEqual(self.queue.get_finished_setups(), [2])
+        self.assertFalse(self.queue.is_finished())
+
+        self.queue.fail(*self.queue.lease('a')[:2])
+        self.assertEqual(self.queue.get_finished_setups(), [1, 2])
+        self.assertTrue(self.queue.is_finished())
+        self.assertEqual(self.queue.get_failed_repetitions(1), [2])
+        self.assertEqual(self.queue.get_results(1), [(1, 'key', ['scalar_counts'], 3, [[[1]], [[2]], [[3]], [[1.5]]])])
+
+    def test_failed_shards_are_queued_again(self):
+        self.queue.lease('a')
+        self.queue.fail(2, 1)
+        self.queue.put_work([], SHARDS)
+        self.assertEqual(self.queue.get_state_counts(), {PENDING: 3})
+
+    def test_done_shards_keep_their_state(self):
+        self.queue.complete(2, 1, 'key', ['scalar_counts'], 3, COUNTS)
+        self.queue.fail(2, 1)
+        self.queue.put_work([], SHARDS)
+        self.assertEqual(self.queue.get_state_counts(), {DONE: 1, PENDING: 2})
+
+class ShardedAnalysisTest(unittest.TestCase):
+    """
+    coordinate, worker and reduce on a local trace store against analyze.
+    """
+
+    def setUp(self):
+        # setup 3 has no traces, analyze writes zero counts for it
+        self.store = build_store(self.mktemp(), [(1, 'directed', 4, 2), (2, 'undirected', 4, 2), (3, 'directed', 4, 0)])
+        self.queue = WorkQueue(self.mktemp())
+
+    def tearDown(self):
+        self.queue.close()
+
+    @defer.inlineCallbacks
+    def test_reduce_equals_analyze(self):
+        analyze_path = self.mktemp()
+        yield ta.analyze_setups(None, make_context(self.store, analyze_path), 'all')
+        expected = read_results(analyze_path)
+        self.assertEqual(len(expected[0]), 3 * 5 * 5)
+
+        context = make_context(self.store, self.mktemp())
+        yield ta.fill_work_queue(context.source, self.queue, 'all', context.profiler)
+        self.assertEqual(self.queue.get_state_counts(), {PENDING: 4})
+        yield ta.run_worker(task.Clock(), context, self.queue, 'worker')
+        self.assertEqual(self.queue.get_state_counts(), {DONE: 4})
+
+        reduce_path = self.mktemp()
+        yield ta.reduce_work_queue(None, make_context(self.store, reduce_path), self.queue)
+        self.assertEqual(read_results(reduce_path), expected)
+
+        # a second reduce only writes setups finished since
+        yield ta.reduce_work_queue(None, make_context(self.store, reduce_path), self.queue)
+        self.assertEqual(read_results(reduce_path), expected)
+
+        yield ta.reduce_work_queue(None, make_context(self.store, reduce_path, replace=True), self.queue)
+        self.assertEqual(read_results(reduce_path), expected)
+
+    @defer.inlineCallbacks
+    def test_setup_with_failed_shard_is_not_written(self):
+        context = make_context(self.store, self.mktemp())
+        yield ta.fill_work_queue(context.source, self.queue, 'all', context.profiler)
+        self.queue.fail(*self.queue.lease('worker')[:2])
+        yield ta.run_worker(task.Clock(), context, self.queue, 'worker')
+        self.assertEqual(self.queue.get_state_counts(), {DONE: 3, FAILED: 1})
+
+        reduce_path = self.mktemp()
+        yield ta.reduce_work_queue(None, make_context(self.store, reduce_path), self.queue)
+        self.assertEqual(sorted(set(row[0] for row in read_results(reduce_path)[0])), ['2', '3'])
@@ -0,0 +1,129 @@
+#!/usr/bin/env python
+
+import numpy as np
+
+# storage dtype of each feature column in the order of FEATURES:
+# packet_count, inter_arrival_time, packet_length, time_to_live, window_size
+COMPACT_DTYPES = ['uint32', 'float32', 'uint16', 'uint8', 'uint16']
+# None keeps the traces as float64 arrays
+DTYPE_POLICIES = {'float64': None, 'compact': COMPACT_DTYPES}
+COMPUTE_DTYPES = ['float64', 'float32']
+
+class CompactTrace():
+    """
+    Trace stored as one array per feature column, each in its own dtype, so
+    small integer features like the TTL take one byte per row instead of
+    eight. Indexing returns float64 like a plain trace array: trace[start:end]
+    gives the rows (n, features), trace[:, feature] a column and
+    np.asarray(trace) the full (rows, features) array.
+
+    Constructor Arguments:
+    columns: list of 1d arrays of the same length, one per feature
+    """
+
+    def __init__(self, columns):
+        self.columns = columns
+        self.shape = (len(columns[0]) if columns else 0, len(columns))
+        self.ndim = 2
+        self.nbytes = sum(column.nbytes for column in columns)
+
+    def __len__(self):
+        return self.shape[0]
+
+    def __getitem__(self, key):
+        if isinstance(key, tuple):
+            rows, features = key
+            if isinstance(features, (int, long, np.integer)):
+                return self.columns[features][rows].astype(np.float64)
+            return self.get_rows(rows)[..., features]
+
+        return self.get_rows(key)
+
+    def __array__(self, dtype=None):
+        rows = self.get_rows(slice(None))
+        if dtype is None:
+            return rows
+        return rows.astype(dtype)
+
+    def get_rows(self, rows):
+        selected = [column[rows] for column in self.columns]
+        if np.ndim(selected[0]) == 0:
+            return np.array(selected, dtype=np.float64)
+
+        result = np.empty((len(selected[0]), len(selected)), dtype=np.float64)
+        for feature, column in enumerate(selected):
+            result[:, feature] = column
+        return result
+
+def parse_feature_dtypes(value, num_features):
+    """
+    List of numpy dtypes, one per feature, from a policy name in
+    DTYPE_POLICIES or a comma separated list of dtype names. None for float64
+    traces. Raises ValueError for unknown dtypes or a wrong number of them.
+    """
+    if value in DTYPE_POLICIES:
+        names = DTYPE_POLICIES[value]
+    else:
+        names = [name.strip() for name in value.split(',')]
+
+    if names is None:
+        return None
+    if len(names) != num_features:
+        raise ValueError('expected {} dtypes, got {}'.format(num_features, len(names)))
+
+    try:
+        return [np.dtype(name) for name in names]
+    except TypeError as err:
+        raise ValueError(str(err))
+
+def compact_trace(trace, dtypes):
+    """
+    CompactTrace of a float64 trace (rows, features) with the column dtypes
+    of a policy. An integer dtype is only used if it holds every value of the
+    column exactly, otherwise the column stays float64, so a policy that does
+    not fit the data costs memory but never changes values. Float columns
+    are rounded to the given dtype.
+    """
+    columns = []
+    for feature, dtype in enumerate(dtypes):
+        column = trace[:, feature]
+        compact = column.astype(dtype)
+        if np.issubdtype(dtype, np.integer) and not np.array_equal(compact, column):
+            compact = np.array(column, dtype=np.float64)
+        columns.append(compact)
+
+    return CompactTrace(columns)
+
+def compact_node_traces(node_traces, dtypes):
+    """
+    Applies compact_trace to a dict node_id -> trace, returns the dict
+    unchanged if dtypes is None.
+    """
+    if dtypes is None:
+        return node_traces
+
+    return dict((node_id, compact_trace(trace, dtypes)) for node_id, trace in node_traces.iteritems())
+
+def get_num_bytes(node_traces):
+    """
+    Bytes the traces of a repetition take in their stored dtypes.
+    """
+    return sum(trace.nbytes for trace in node_traces.itervalues())
+
+def get_float64_bytes(node_traces):
+    """
+    Bytes the traces of a repetition take as float64 arrays.
+    """
+    return sum(trace.shape[0] * trace.shape[1] * 8 for trace in node_traces.itervalues())
+
+def get_dtype_key(feature_dtypes, compute_dtype):
+    """
+    Suffix of the checkpoint key for reduced precision, empty for float64
+    traces and computation.
+    """
+    key = ''
+    if feature_dtypes is not None:
+        key += ';dtypes=' + ','.join(dtype.name for dtype in feature_dtypes)
+    if compute_dtype != 'float64':
+        key += ';compute=' + compute_dtype
+    return key
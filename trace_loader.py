@@ -0,0 +1,129 @@
+#!/usr/bin/env python
+
+import time
+
+import numpy as np
+
+from twisted.internet import defer
+
+from profiling import StageTimings
+from work_plan import build_work_plan
+from trace_dtypes import compact_node_traces
+
+def get_node_ids(setup_parameters):
+    """
+    Client node ids start at 1, server node ids start at 31.
+    """
+    client_ids = range(1, setup_parameters.num_clients + 1)
+    server_ids = range(31, setup_parameters.num_servers + 31)
+    return client_ids, server_ids
+
+def load_repetition_traces(dbpool, db_name, setup_parameters, repetition, batch_size, profiler=None):
+    """
+    Loads the traces of all clients and servers of a repetition with a single
+    query. Returns a deferred firing with a dict node_id -> float64 array of
+    shape (rows, num_features), or CompactTrace if the setup parameters have
+    feature dtypes. Fetch and decode times are added to the profiler if one
+    is given.
+    """
+    client_ids, server_ids = get_node_ids(setup_parameters)
+    node_id_string = ', '.join(str(node_id) for node_id in client_ids + server_ids)
+
+    query = 'SELECT node_id, {features} FROM {database}.traces_submission WHERE repetition={rep} AND setup_id={sid} AND node_id IN ({node_ids});'.format(
+        features = setup_parameters.features,
+        database = db_name,
+        rep = repetition,
+        sid = setup_parameters.setup_index,
+        node_ids = node_id_string
+    )
+
+    deferred = dbpool.runInteraction(fetch_node_traces, query, batch_size, setup_parameters.feature_dtypes)
+    deferred.addCallback(merge_fetch_timings, profiler, setup_parameters.setup_index)
+    return deferred
+
+def merge_fetch_timings(fetched, profiler, setup_id):
+    node_traces, timings = fetched
+    if profiler is not None:
+        profiler.merge(setup_id, timings)
+    return node_traces
+
+def fetch_node_traces(txn, query, batch_size, feature_dtypes=None):
+    """
+    Runs inside a pool transaction. The result set is consumed in batches of
+    batch_size rows, so only one batch exists as Python tuples at a time. Each
+    batch is decoded to float64 and split by node_id, preserving the order in
+    which the rows of a node arrive. With feature_dtypes, the complete traces
+    are stored as CompactTraces before they leave the pool thread.
+
+    Returns the dict node_id -> trace array and the StageTimings of the
+    fetch and decode steps.
+    """
+    timings = StageTimings()
+
+    with timings.timed('db_fetch'):
+        txn.execute(query)
+
+    node_chunks = {}
+    while True:
+        start_time = time.time()
+        rows = txn.fetchmany(batch_size)
+        timings.add('db_fetch', time.time() - start_time, 0, len(rows))
+        if not rows:
+            break
+
+        start_time = time.time()
+        block = np.array(rows, dtype=np.float64)
+        del rows
+
+        # stable sort keeps the row order within each node
+        order = np.argsort(block[:, 0], kind='mergesort')
+        block = block[order]
+        boundaries = np.flatnonzero(np.diff(block[:, 0])) + 1
+
+        for chunk in np.split(block, boundaries):
+            node_id = int(chunk[0, 0])
+            node_chunks.setdefault(node_id, []).append(chunk[:, 1:])
+
+        timings.add('decode', time.time() - start_time, 0, len(block))
+
+    with timings.timed('decode'):
+        node_traces = {}
+        for node_id, chunks in node_chunks.iteritems():
+            node_traces[node_id] = np.ascontiguousarray(np.concatenate(chunks))
+        node_traces = compact_node_traces(node_traces, feature_dtypes)
+
+    return node_traces, timings
+
+class DatabaseTraceSource():
+    """
+    Serves setups and traces from the MySQL database through the adbapi pool.
+    All methods return deferreds.
+    """
+
+    def __init__(self, dbpool, db_name, batch_size, profiler=None):
+        self.dbpool = dbpool
+        self.db_name = db_name
+        self.batch_size = batch_size
+        self.profiler = profiler
+
+    @defer.inlineCallbacks
+    def get_work_plan(self):
+        """
+        WorkPlan of all setups from the setups table and the per node row
+        counts of the traces, the two queries run concurrently.
+        """
+        setup_rows, trace_counts = yield defer.gatherResults([
+            self.dbpool.runQuery('SELECT id, setup, num_clients, repetitions FROM {}.setups_submission ORDER BY id;'.format(self.db_name)),
+            self.dbpool.runQuery('SELECT setup_id, repetition, node_id, COUNT(*) FROM {}.traces_submission GROUP BY setup_id, repetition, node_id;'.format(self.db_name))
+        ], consumeErrors=True)
+        defer.returnValue(build_work_plan(setup_rows, trace_counts))
+
+    def load_repetition(self, setup_parameters, repetition):
+        return load_repetition_traces(self.dbpool, self.db_name, setup_parameters, repetition, self.batch_size, self.profiler)
+
+    def load_statistics(self, setup_parameters, repetition):
+        """
+        The database keeps no node statistics, the metrics compute the sums
+        from the traces.
+        """
+        return defer.succeed({})
@@ -0,0 +1,69 @@
+#!/usr/bin/env python
+
+from twisted.internet import defer
+
+from trace_dtypes import get_num_bytes
+
+DEFAULT_PREFETCH_DEPTH = 2
+DEFAULT_PREFETCH_MB = 1024
+
+class TracePrefetcher():
+    """
+    Bounds the traces that are loaded ahead of the metric computation, so
+    the queries of upcoming repetitions overlap with the computation of the
+    current ones without loading everything at once.
+
+    Constructor Arguments:
+    depth: number of repetitions whose traces are loaded at the same time,
+        the DB pool needs at least this many connections to run them in
+        parallel
+    max_bytes: memory budget of the loaded traces that wait for or are in
+        the computation. A load only starts once it has a load slot and the
+        held traces are below the budget. The loads that are running when
+        the budget is reached may exceed it by up to depth repetitions, and
+        one repetition is always admitted so a repetition larger than the
+        budget still gets computed.
+    """
+
+    def __init__(self, depth=DEFAULT_PREFETCH_DEPTH, max_bytes=DEFAULT_PREFETCH_MB * 1024 * 1024):
+        self.depth = depth
+        self.max_bytes = max_bytes
+        self.semaphore = defer.DeferredSemaphore(depth)
+
+        self.held_bytes = 0
+        self.waiting = []
+
+    def wait_for_budget(self):
+        if self.held_bytes < self.max_bytes:
+            return defer.succeed(None)
+
+        waiter = defer.Deferred()
+        self.waiting.append(waiter)
+        return waiter
+
+    @defer.inlineCallbacks
+    def load(self, load_function, *args):
+        """
+        Calls load_function(*args), which returns a deferred dict
+        node_id -> trace, once the budget and a load slot allow it. The bytes
+        of the traces are held until release is called with the returned
+        number of bytes.
+        """
+        # the budget is checked after a slot is free, when the loads before
+        # this one have added their bytes
+        yield self.semaphore.acquire()
+        try:
+            yield self.wait_for_budget()
+            node_traces = yield load_function(*args)
+
+            num_bytes = get_num_bytes(node_traces)
+            self.held_bytes += num_bytes
+        finally:
+            self.semaphore.release()
+
+        defer.returnValue((node_traces, num_bytes))
+
+    def release(self, num_bytes):
+        self.held_bytes -= num_bytes
+        while self.waiting and self.held_bytes < self.max_bytes:
+            self.waiting.pop(0).callback(None)
@@ -0,0 +1,199 @@
+#!/usr/bin/env python
+
+import json
+import os
+
+import numpy as np
+
+from twisted.internet import defer
+
+from work_plan import build_work_plan
+from node_statistics import compute_node_statistics, save_node_statistics, load_node_statistics
+
+INDEX_FILE = 'index.json'
+
+def get_trace_path(setup_id, repetition, node_id):
+    return os.path.join('setup_{}'.format(setup_id), 'rep_{}'.format(repetition), 'node_{}.npy'.format(node_id))
+
+def get_statistics_path(setup_id, repetition, node_id):
+    return os.path.join('setup_{}'.format(setup_id), 'rep_{}'.format(repetition), 'node_{}_stats.npz'.format(node_id))
+
+class TraceStore():
+    """
+    Local columnar copy of the traces_submission table. Each
+    (setup_id, repetition, node_id) trace is one contiguous .npy file of shape
+    (rows, num_features). The index file keeps the setups_submission rows,
+    the feature string and the row count of every stored trace. Next to each
+    trace, a .npz file holds its NodeStatistics, the index entry of a node
+    is [trace path, rows, statistics path]. Stores written before the
+    statistics existed have no third entry until update_statistics runs.
+
+    Constructor Arguments:
+    path: directory of the store, created on the first write
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.index = {'features': None, 'setups': {}, 'traces': {}}
+
+        index_path = os.path.join(path, INDEX_FILE)
+        if os.path.exists(index_path):
+            with open(index_path) as index_file:
+                self.index = json.load(index_file)
+
+    def write_index(self):
+        if not os.path.exists(self.path):
+            os.makedirs(self.path)
+
+        index_path = os.path.join(self.path, INDEX_FILE)
+        with open(index_path + '.tmp', 'w') as index_file:
+            json.dump(self.index, index_file)
+        os.rename(index_path + '.tmp', index_path)
+
+    def put_setup(self, setup_id, network_setup, num_clients, num_reps):
+        self.index['setups'][str(setup_id)] = [network_setup, num_clients, num_reps]
+
+    def get_setup(self, setup_id):
+        """
+        Returns (setup, num_clients, repetitions) like the setups_submission
+        table, or None if the setup is not stored.
+        """
+        return self.index['setups'].get(str(setup_id))
+
+    def get_setup_ids(self):
+        return sorted(int(setup_id) for setup_id in self.index['setups'])
+
+    def put_repetition(self, setup_id, repetition, node_traces):
+        """
+        Writes the dict node_id -> trace array of a repetition.
+        """
+        stored_nodes = {}
+        for node_id, trace in node_traces.iteritems():
+            relative_path = get_trace_path(setup_id, repetition, node_id)
+            full_path = os.path.join(self.path, relative_path)
+            if not os.path.exists(os.path.dirname(full_path)):
+                os.makedirs(os.path.dirname(full_path))
+
+            trace = np.ascontiguousarray(trace, dtype=np.float64)
+            np.save(full_path, trace)
+            stored_nodes[str(node_id)] = [relative_path, len(trace), self.put_statistics(setup_id, repetition, node_id, trace)]
+
+        self.index['traces']['{}/{}'.format(setup_id, repetition)] = stored_nodes
+
+    def put_statistics(self, setup_id, repetition, node_id, trace):
+        """
+        Computes and writes the NodeStatistics of a trace, returns their path
+        relative to the store.
+        """
+        relative_path = get_statistics_path(setup_id, repetition, node_id)
+        save_node_statistics(os.path.join(self.path, relative_path), compute_node_statistics(trace))
+        return relative_path
+
+    def update_statistics(self):
+        """
+        Computes the NodeStatistics of every stored trace that has none, or
+        whose statistics do not match its row count. Traces with valid
+        statistics are not read. Returns the number of updated traces, the
+        index is written if there are any.
+        """
+        num_updated = 0
+        for key, stored_nodes in sorted(self.index['traces'].iteritems()):
+            setup_id, repetition = key.split('/')
+            for node_id, entry in stored_nodes.iteritems():
+                if len(entry) > 2 and self.has_statistics(entry):
+                    continue
+
+                trace = np.load(os.path.join(self.path, entry[0]), mmap_mode='r')
+                stored_nodes[node_id] = [entry[0], len(trace), self.put_statistics(setup_id, repetition, node_id, trace)]
+                num_updated += 1
+
+        if num_updated > 0:
+            self.write_index()
+        return num_updated
+
+    def has_statistics(self, entry):
+        statistics_path = os.path.join(self.path, entry[2])
+        return os.path.exists(statistics_path) and load_node_statistics(statistics_path).num_rows == entry[1]
+
+    def get_work_plan(self):
+        """
+        WorkPlan of the stored setups from the row counts in the index.
+        """
+        setup_rows = [[int(setup_id)] + setup_data for setup_id, setup_data in self.index['setups'].iteritems()]
+
+        trace_counts = []
+        for key, stored_nodes in self.index['traces'].iteritems():
+            setup_id, repetition = key.split('/')
+            for node_id, entry in stored_nodes.iteritems():
+                trace_counts.append((setup_id, repetition, node_id, entry[1]))
+
+        return build_work_plan(setup_rows, trace_counts)
+
+    def get_repetition(self, setup_id, repetition):
+        """
+        Returns the dict node_id -> trace of a repetition. The traces are
+        read-only memory maps of the stored files, nothing is copied.
+        """
+        stored_nodes = self.index['traces'].get('{}/{}'.format(setup_id, repetition), {})
+
+        node_traces = {}
+        for node_id, entry in stored_nodes.iteritems():
+            node_traces[int(node_id)] = np.load(os.path.join(self.path, entry[0]), mmap_mode='r')
+
+        return node_traces
+
+    def get_statistics(self, setup_id, repetition):
+        """
+        Returns the dict node_id -> NodeStatistics of the stored traces of a
+        repetition that have statistics.
+        """
+        stored_nodes = self.index['traces'].get('{}/{}'.format(setup_id, repetition), {})
+
+        node_statistics = {}
+        for node_id, entry in stored_nodes.iteritems():
+            if len(entry) > 2:
+                node_statistics[int(node_id)] = load_node_statistics(os.path.join(self.path, entry[2]))
+
+        return node_statistics
+
+class LocalTraceSource():
+    """
+    Serves setups and traces from a TraceStore with the same interface as the
+    DatabaseTraceSource. All methods return deferreds that already fired.
+    """
+
+    def __init__(self, store):
+        self.store = store
+
+    def get_work_plan(self):
+        return defer.succeed(self.store.get_work_plan())
+
+    def load_repetition(self, setup_parameters, repetition):
+        return defer.succeed(self.store.get_repetition(setup_parameters.setup_index, repetition))
+
+    def load_statistics(self, setup_parameters, repetition):
+        return defer.succeed(self.store.get_statistics(setup_parameters.setup_index, repetition))
+
+@defer.inlineCallbacks
+def export_traces(db_source, store, setup_parameters_list, work_plan):
+    """
+    Copies the traces of the given setups from the database into the store,
+    only the repetitions that have traces in the WorkPlan. The index is
+    written after every setup, so an interrupted export keeps the setups
+    that were completed.
+    """
+    for setup_parameters in setup_parameters_list:
+        print 'Export Setup ', setup_parameters.setup_index
+        store.index['features'] = setup_parameters.features
+        store.put_setup(setup_parameters.setup_index, setup_parameters.setup, setup_parameters.num_clients, setup_parameters.num_repetitions)
+
+        for repetition in sorted(work_plan.get_setup(setup_parameters.setup_index).repetitions):
+            try:
+                node_traces = yield db_source.load_repetition(setup_parameters, repetition)
+            except Exception as err:
+                print 'Problem exporting repetition {}: '.format(repetition), err
+                continue
+
+            store.put_repetition(setup_parameters.setup_index, repetition, node_traces)
+
+        store.write_index()
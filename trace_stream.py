@@ -0,0 +1,201 @@
+#!/usr/bin/env python
+
+from itertools import izip
+
+import numpy as np
+
+from trace_tensor import cumulative_sums
+
+# rows per chunk in streaming mode
+DEFAULT_CHUNK_ROWS = 65536
+
+class TraceStream():
+    """
+    Reads the traces of several nodes in chunks of rows, so the metrics can
+    run over traces that do not fit into memory as one padded TraceTensor.
+
+    Constructor Arguments:
+    traces: list of 2d arrays (rows, features), one per node. With the local
+        trace store these are read-only memory maps and only the rows of the
+        current chunk are read from disk.
+    chunk_rows: number of rows per chunk
+    dtype: dtype of the chunks, see TraceTensor
+    statistics: optional list of NodeStatistics of the traces, the column
+        sums and value ranges are read from them instead of a pass over the
+        chunks
+
+    Memory use is bounded by nodes * chunk_rows * features per chunk, plus the
+    per pair statistics of the metrics.
+    """
+
+    def __init__(self, traces, chunk_rows=DEFAULT_CHUNK_ROWS, dtype=np.float64, statistics=None):
+        self.traces = traces
+        self.chunk_rows = chunk_rows
+        self.dtype = dtype
+        self.statistics = statistics
+        self.num_nodes = len(traces)
+        self.lengths = np.array([len(trace) for trace in traces], dtype=np.int64)
+        self.num_rows = int(self.lengths.max()) if self.num_nodes > 0 else 0
+        self.num_features = traces[0].shape[1] if self.num_nodes > 0 else 0
+
+        # derived per node data of individual metrics, e.g. PCA loadings
+        self.memo = {}
+
+    def select_nodes(self, indexes):
+        """
+        New TraceStream of the given nodes, without the memoized data.
+        """
+        statistics = None
+        if self.statistics is not None:
+            statistics = [self.statistics[index] for index in indexes]
+        return TraceStream([self.traces[index] for index in indexes], self.chunk_rows, self.dtype, statistics)
+
+    def iterate_chunks(self):
+        """
+        Yields (start, chunk) for consecutive blocks of rows. chunk is a zero
+        padded array (nodes, rows, features) like TraceTensor.data,
+        rows past the end of a trace are zero.
+        """
+        for start in xrange(0, self.num_rows, self.chunk_rows):
+            end = min(start + self.chunk_rows, self.num_rows)
+            chunk = np.zeros((self.num_nodes, end - start, self.num_features), dtype=self.dtype)
+
+            for node, trace in enumerate(self.traces):
+                valid_end = min(end, self.lengths[node])
+                if valid_end > start:
+                    chunk[node, :valid_end - start] = trace[start:valid_end]
+
+            yield start, chunk
+
+    def get_column_sums(self):
+        """
+        Sum of each feature column over the full trace, shape (nodes, features).
+        """
+        try:
+            return self.memo['column_sums']
+        except KeyError:
+            pass
+
+        if self.statistics is not None:
+            sums = np.array([statistics.sums for statistics in self.statistics])
+        else:
+            sums = np.zeros((self.num_nodes, self.num_features), dtype=np.float64)
+            for start, chunk in self.iterate_chunks():
+                sums += chunk.sum(axis=1, dtype=np.float64)
+
+        self.memo['column_sums'] = sums
+        return sums
+
+    def get_column_means(self):
+        means = np.zeros((self.num_nodes, self.num_features), dtype=np.float64)
+        lengths = self.lengths[:, np.newaxis].astype(np.float64)
+        np.divide(self.get_column_sums(), lengths, out=means, where=lengths > 0)
+        return means
+
+    def get_value_ranges(self):
+        """
+        Minimum and maximum of each feature column, two arrays of shape
+        (nodes, features), +inf and -inf for empty traces.
+        """
+        try:
+            return self.memo['value_ranges']
+        except KeyError:
+            pass
+
+        if self.statistics is not None:
+            low = np.array([statistics.minima for statistics in self.statistics])
+            high = np.array([statistics.maxima for statistics in self.statistics])
+        else:
+            low = np.full((self.num_nodes, self.num_features), np.inf)
+            high = np.full((self.num_nodes, self.num_features), -np.inf)
+
+            for start, chunk in self.iterate_chunks():
+                valid_rows = self.get_valid_rows(start, chunk.shape[1])[:, :, np.newaxis]
+                low = np.minimum(low, np.where(valid_rows, chunk, np.inf).min(axis=1))
+                high = np.maximum(high, np.where(valid_rows, chunk, -np.inf).max(axis=1))
+
+        self.memo['value_ranges'] = (low, high)
+        return low, high
+
+    def get_valid_rows(self, start, num_rows):
+        """
+        Boolean mask (nodes, num_rows) of the rows of a chunk that belong to
+        the traces and are not padding.
+        """
+        return (start + np.arange(num_rows))[np.newaxis, :] < self.lengths[:, np.newaxis]
+
+class PairStatistics():
+    """
+    Running sufficient statistics of all (client, server) pairs for each
+    feature, updated chunk by chunk. A pair only counts its first
+    min(len(client), len(server)) rows, the same truncation as the batch
+    metrics.
+
+    Constructor Arguments:
+    client_lengths, server_lengths: number of rows of each node
+    num_features: number of columns of the chunks
+
+    limits (clients, servers) is the number of rows of each pair. The sums,
+    square sums and cross products have shape (clients, servers, features).
+    """
+
+    def __init__(self, client_lengths, server_lengths, num_features):
+        self.limits = np.minimum(client_lengths[:, np.newaxis], server_lengths[np.newaxis, :])
+
+        shape = (len(client_lengths), len(server_lengths), num_features)
+        self.client_sums = np.zeros(shape, dtype=np.float64)
+        self.client_square_sums = np.zeros(shape, dtype=np.float64)
+        self.server_sums = np.zeros(shape, dtype=np.float64)
+        self.server_square_sums = np.zeros(shape, dtype=np.float64)
+        self.cross = np.zeros(shape, dtype=np.float64)
+
+    def add_chunk(self, start, client_chunk, server_chunk):
+        num_rows = min(client_chunk.shape[1], server_chunk.shape[1])
+        client_chunk = client_chunk[:, :num_rows]
+        server_chunk = server_chunk[:, :num_rows]
+
+        # rows of this chunk within the limit of each pair
+        chunk_limits = np.clip(self.limits - start, 0, num_rows)
+
+        client_index = np.arange(client_chunk.shape[0])[:, np.newaxis]
+        self.client_sums += cumulative_sums(client_chunk)[client_index, chunk_limits]
+        self.client_square_sums += cumulative_sums(np.square(client_chunk, dtype=np.float64))[client_index, chunk_limits]
+
+        server_index = np.arange(server_chunk.shape[0])[:, np.newaxis]
+        self.server_sums += cumulative_sums(server_chunk)[server_index, chunk_limits.T].transpose(1, 0, 2)
+        self.server_square_sums += cumulative_sums(np.square(server_chunk, dtype=np.float64))[server_index, chunk_limits.T].transpose(1, 0, 2)
+
+        # padding rows are zero, so the products are truncated to the shorter
+        # trace. The products are summed in float64 like the other sums.
+        for feature in xrange(0, client_chunk.shape[2]):
+            client_columns = client_chunk[:, :, feature].astype(np.float64, copy=False)
+            server_columns = server_chunk[:, :, feature].astype(np.float64, copy=False)
+            self.cross[:, :, feature] += np.dot(client_columns, server_columns.T)
+
+def accumulate_pair_statistics(client_chunks, server_chunks, client_lengths, server_lengths, num_features):
+    """
+    PairStatistics of two iterators of (start, chunk) with the same chunk
+    size, e.g. from TraceStream.iterate_chunks. Rows past the end of the
+    shorter iterator never count for a pair.
+    """
+    statistics = PairStatistics(client_lengths, server_lengths, num_features)
+    for (start, client_chunk), (_, server_chunk) in izip(client_chunks, server_chunks):
+        statistics.add_chunk(start, client_chunk, server_chunk)
+    return statistics
+
+def get_pair_statistics(client_stream, server_stream):
+    """
+    PairStatistics of the raw traces, memoized on the client stream so the
+    metrics sharing them read the traces once.
+    """
+    key = ('pair_statistics', server_stream)
+    try:
+        return client_stream.memo[key]
+    except KeyError:
+        pass
+
+    statistics = accumulate_pair_statistics(client_stream.iterate_chunks(), server_stream.iterate_chunks(),
+        client_stream.lengths, server_stream.lengths, client_stream.num_features)
+
+    client_stream.memo[key] = statistics
+    return statistics
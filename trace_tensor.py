@@ -0,0 +1,147 @@
+#!/usr/bin/env python
+
+import numpy as np
+
+class TraceTensor():
+    """
+    Stacks the traces of several nodes into one zero padded tensor of shape
+    (nodes, rows, features), so metrics can compare all nodes at once.
+
+    Constructor Arguments:
+    traces: list of 2d arrays (rows, features) or CompactTraces, one per
+        node. The traces may have different lengths, the number of valid rows
+        of each node is kept in self.lengths.
+    dtype: dtype of the tensor, float32 halves the memory and bandwidth of
+        the metrics at reduced precision. Column sums are accumulated in
+        float64 either way.
+    statistics: optional list of NodeStatistics of the traces, the column
+        sums and truncated sums are read from them instead of summing the
+        tensor
+
+    The padding rows are zero, so a product of two padded traces summed over
+    all rows equals the sum over the first min(len(a), len(b)) rows. This is
+    the same truncation the pairwise metrics apply.
+    """
+
+    def __init__(self, traces, dtype=np.float64, statistics=None):
+        self.num_nodes = len(traces)
+        self.lengths = np.array([len(trace) for trace in traces], dtype=np.int64)
+        self.num_rows = int(self.lengths.max()) if self.num_nodes > 0 else 0
+        self.num_features = traces[0].shape[1] if self.num_nodes > 0 else 0
+
+        self.data = np.zeros((self.num_nodes, self.num_rows, self.num_features), dtype=dtype)
+        for index, trace in enumerate(traces):
+            self.data[index, :self.lengths[index]] = trace
+
+        self.statistics = statistics
+        self._prefix_sums = None
+        self._prefix_square_sums = None
+
+        # derived per node data of individual metrics, e.g. PCA projections
+        self.memo = {}
+
+    def get_trace(self, index):
+        return self.data[index, :self.lengths[index]]
+
+    def select_nodes(self, indexes):
+        """
+        New TraceTensor of the given nodes, without the memoized data.
+        """
+        statistics = None
+        if self.statistics is not None:
+            statistics = [self.statistics[index] for index in indexes]
+        return TraceTensor([self.get_trace(index) for index in indexes], self.data.dtype, statistics)
+
+    def get_column_sums(self):
+        """
+        Sum of each feature column over the full trace, shape (nodes, features).
+        """
+        if self.statistics is not None:
+            return np.array([statistics.sums for statistics in self.statistics])
+        return self.data.sum(axis=1, dtype=np.float64)
+
+    def get_prefix_sums(self):
+        """
+        Cumulative column sums with a leading zero row, shape
+        (nodes, rows + 1, features). Entry [n, l] is the sum of the first l
+        rows of node n.
+        """
+        if self._prefix_sums is None:
+            self._prefix_sums = cumulative_sums(self.data)
+        return self._prefix_sums
+
+    def get_prefix_square_sums(self):
+        if self._prefix_square_sums is None:
+            self._prefix_square_sums = cumulative_sums(np.square(self.data, dtype=np.float64))
+        return self._prefix_square_sums
+
+    def get_truncated_sums(self, limits):
+        """
+        Column sums and squared column sums of each node over the first
+        limits[n, m] rows, where limits has shape (nodes, m). Returns two arrays
+        of shape (nodes, m, features).
+        """
+        if self.statistics is not None and self._prefix_sums is None:
+            truncated = get_statistics_sums(self, limits)
+            if truncated is not None:
+                return truncated
+
+        node_index = np.arange(self.num_nodes)[:, np.newaxis]
+        sums = self.get_prefix_sums()[node_index, limits]
+        square_sums = self.get_prefix_square_sums()[node_index, limits]
+        return sums, square_sums
+
+def get_statistics_sums(tensor, limits):
+    """
+    TraceTensor.get_truncated_sums from the NodeStatistics of the tensor. A
+    limit below the length of a trace reads the rows after the last stored
+    block prefix, returns None if that reads more rows than the cumulative
+    sums over the full tensor.
+    """
+    node_limits = [np.unique(limits[node]) for node in xrange(0, tensor.num_nodes)]
+
+    partial_rows = 0
+    for node, unique_limits in enumerate(node_limits):
+        partial = unique_limits[unique_limits < tensor.lengths[node]]
+        partial_rows += int((partial % tensor.statistics[node].block_rows).sum())
+    if partial_rows >= tensor.num_nodes * tensor.num_rows:
+        return None
+
+    sums = np.empty(limits.shape + (tensor.num_features,), dtype=np.float64)
+    square_sums = np.empty(limits.shape + (tensor.num_features,), dtype=np.float64)
+    for node, unique_limits in enumerate(node_limits):
+        trace = tensor.get_trace(node)
+        for limit in unique_limits:
+            selected = limits[node] == limit
+            sums[node, selected], square_sums[node, selected] = tensor.statistics[node].get_truncated_sums(trace, limit)
+
+    return sums, square_sums
+
+def cumulative_sums(data):
+    sums = np.zeros((data.shape[0], data.shape[1] + 1, data.shape[2]), dtype=np.float64)
+    np.cumsum(data, axis=1, dtype=np.float64, out=sums[:, 1:])
+    return sums
+
+def get_pair_limits(client_tensor, server_tensor):
+    """
+    Number of rows compared for each (client, server) pair, shape
+    (clients, servers).
+    """
+    return np.minimum(client_tensor.lengths[:, np.newaxis], server_tensor.lengths[np.newaxis, :])
+
+def get_cross_products(client_tensor, server_tensor):
+    """
+    Sum of client * server over the first min(len(client), len(server)) rows
+    for every pair and feature, shape (clients, servers, features).
+    """
+    num_rows = min(client_tensor.num_rows, server_tensor.num_rows)
+    cross = np.empty((client_tensor.num_nodes, server_tensor.num_nodes, client_tensor.num_features), dtype=np.float64)
+
+    # np.dot sums in the dtype of its inputs, float32 products of large
+    # values lose the digits the correlations need
+    for feature in xrange(0, client_tensor.num_features):
+        client_columns = client_tensor.data[:, :num_rows, feature].astype(np.float64, copy=False)
+        server_columns = server_tensor.data[:, :num_rows, feature].astype(np.float64, copy=False)
+        cross[:, :, feature] = np.dot(client_columns, server_columns.T)
+
+    return cross
@@ -1,23 +1,45 @@
 #!/usr/bin/env python
 from twisted.enterprise import adbapi
-from twisted.internet import defer
+from twisted.internet import defer, task
 
-import logging
+from collections import OrderedDict
+import sys
 
 import numpy as np
-from numpy import array
 
-# metrics
-from scalar_packet_count import apply_packet_count
-from distance_pca_pearson import apply_pca_pearson
-from distance_pearson import apply_pearson
-from distance_rmse import apply_rmse
-from distance_mutinfo import apply_mutinfo
+from metric_engine import compute_all_pairs, compute_cascade
+from metric_registry import get_metrics, get_metric_names, get_default_metric_names, set_metric_params
+from ranking import get_correct_servers, get_ranks, get_rank_counts, DEFAULT_TOP_K
+from metric_defaults import DEFAULT_BINS, DEFAULT_BINNING, DEFAULT_WINDOW, DEFAULT_MAX_LAG
+
+from node_statistics import get_node_statistics
+from trace_dtypes import DTYPE_POLICIES, COMPUTE_DTYPES, parse_feature_dtypes, get_num_bytes, get_float64_bytes, get_dtype_key
+from work_plan import WorkPlan
+from work_queue import WorkQueue, DEFAULT_LEASE_SECONDS, DEFAULT_POLL_SECONDS, get_worker_id
+from trace_prefetch import TracePrefetcher, DEFAULT_PREFETCH_DEPTH, DEFAULT_PREFETCH_MB
+from trace_loader import DatabaseTraceSource
+from trace_store import TraceStore, LocalTraceSource, export_traces
+from process_pool import ComputeExecutor
+from result_writer import ResultWriter
+from checkpoint import Checkpoint
+from profiling import Profiler, StageTimings
+from results_array import new_results, build_repetition_results, concatenate_results
+from score_store import ScoreStore
+from score_cache import ScoreCache, DEFAULT_SCORE_CACHE_MB
+from fusion import FUSION_STRATEGIES, load_samples, cross_validate, get_fusion_rows, write_fusion_rows
 
 import click
 
 import time
 
+FEATURES = 'packet_count, inter_arrival_time, packet_length, time_to_live, window_size'
+NUM_FEATURES = 5
+# connections of the adbapi pool, twisted's defaults
+DEFAULT_POOL_MIN = 3
+DEFAULT_POOL_MAX = 5
+# feature names in the results table
+FEATURE_STRINGS = ['packet_counts', 'inter_arrival_time', 'packet_length', 'time_to_live', 'window_size']
+
 class SetupParameters():
     """
     Organizes the relevant setup parameter we need later on to query the
@@ -42,455 +64,941 @@ class SetupParameters():
         e.g., a subset of the 5 available traffic features from the parsing
     num_features: must be set compliant to the features string, should be replaced
         by a function returning the number of distinct features in the string.
-    num_metrics: stores how many metrics we have in the framework right now.
-        Must be changed as soon as a new metric is added, should be constant
-        when we reach a status where a reasonable set of metrics is implemented.
+    metrics: list of Metric objects from the metric registry that are applied
+        to the traces, selected with --metrics. num_metrics is derived from it.
+    stream_chunk_rows: if set, the metrics read the traces in chunks of this
+        many rows (--stream-chunk-rows), see compute_all_pairs
+    top_k: a client counts as identified within the top k if its server is
+        among the k best ranked servers (--top-k)
+    feature_dtypes: storage dtype of each feature column of the loaded
+        traces (--feature-dtypes), None for float64 traces
+    compute_dtype: dtype of the stacked traces the metrics run on
+        (--compute-dtype)
+    cascade_size: if set, the expensive metrics only compare each client with
+        this many servers, the best ones of the cheap metrics (--cascade)
+    score_cache: ScoreCache with the scores of pairs computed before
+        (--score-cache), or None
 
     num_servers: depends on the setup that was used in the experiments. In the
         directed setup we have n:n connections from client to server, in the
         undirected/grouped setup we have n:2 connections to only 2 servers.
     """
 
-    def __init__(self, num_reps, num_clients, setup, setup_index, features, num_features, num_metrics):
+    def __init__(self, num_reps, num_clients, setup, setup_index, features, num_features, metrics, stream_chunk_rows=None, top_k=DEFAULT_TOP_K,
+            feature_dtypes=None, compute_dtype='float64', cascade_size=None, score_cache=None):
         self.setup = setup
         self.num_repetitions = num_reps
         self.num_clients = num_clients
         self.setup_index = setup_index
         self.features = features
         self.num_features = num_features
-        self.num_metrics = num_metrics
+        self.metrics = metrics
+        self.num_metrics = len(metrics)
+        self.stream_chunk_rows = stream_chunk_rows
+        self.top_k = top_k
+        self.feature_dtypes = feature_dtypes
+        self.compute_dtype = compute_dtype
+        self.cascade_size = cascade_size
+        self.score_cache = score_cache
 
         if setup == 'directed':
             self.num_servers = num_clients
         else:
             self.num_servers = 2
 
-class ResultsContainer():
-    """
-    Keeps track of client results and repetition results.
-    See examples below for specification.
-
-    Client Results:
-    - each client trace is compared with all server traces
-    - all comparisons of this kind are stored in the client results
-    - Example for 5 clients, 5 servers:
-        - client_result = [c1 vs. s1, c1 vs. s2, ..., c1 vs. s5]
-        - cx vs. cy means that the trace of client x is compared
-          to the trace of server y
-        - all comparison results are stored in the client result list
-        - for each client a new client_result list is generated
-
-    Repetition Results:
-    - We have several random repetitions for each individual setup
-    - Per repetition the results are stored in a list of Result objects
-    - After each client was evaluated completely (compared to all servers)
-      we make an identification guess for each metric and verify the correctness
-    - According to this guess the num_corrects or num_fails counter in the
-      Result object is incremented
-    - After all clients are analyzed, the Result object is complete, and
-      can be appended to the list of repetition results
-    - After all repetitions are finished, we have complete results for
-      a setup
-    """
-    def __init__(self, metrics_type):
-        self.results_container = []
-        self.type = metrics_type
-
-    def append_item(self, item):
-        """
-        Argument item:
-        - item can be either a float (metric result for client_results)
-        - or a Result object for repetition_results
-        """
-        self.results_container.append(item)
-
-    def get_length(self):
-        cnt = 0
-        for elem in self.results_container:
-            cnt += 1
-        return cnt
+class AnalysisContext():
+    """
+    Bundles the run wide objects that every analysis step needs.
 
-    def get_num_corrects(self):
-        correct_counter = 0
+    Constructor Arguments:
+    source: DatabaseTraceSource or LocalTraceSource the setups and traces are
+        read from
+    dbpool: adbapi connection pool of the results database, None if the
+        analysis runs without DB
+    db_name: name of the database with the results table
+    writer: ResultWriter collecting the ta_submission rows
+    executor: ComputeExecutor running the metric computation, inline or in a
+        pool of worker processes
+    resume: if True, setups with complete results are skipped
+    checkpoint: Checkpoint with the counts of computed repetitions, or None
+    metrics: list of Metric objects selected with --metrics
+    profiler: Profiler collecting the stage timings
+    stream_chunk_rows: chunk size of the streaming mode, None for the batch
+        metrics
+    top_k: k of the top-k accuracy in the rank results
+    score_store: ScoreStore the score tensors of every repetition are saved
+        to (--save-scores), or None
+    prefetcher: TracePrefetcher bounding the traces loaded ahead of the
+        computation, a default one if None
+    feature_dtypes, compute_dtype: dtype policy of the traces, see
+        SetupParameters
+    cascade_size: shortlist size of the cascade mode, None to compare all
+        pairs with all metrics
+    score_cache: ScoreCache of the pair scores, or None
+    """
 
-        for result in self.results_container:
-            correct_counter += result.num_corrects
+    def __init__(self, source, dbpool, db_name, writer, executor, resume, checkpoint, metrics, profiler, stream_chunk_rows=None, top_k=DEFAULT_TOP_K, score_store=None,
+            prefetcher=None, feature_dtypes=None, compute_dtype='float64', cascade_size=None, score_cache=None):
+        self.source = source
+        self.dbpool = dbpool
+        self.db_name = db_name
+        self.writer = writer
+        self.executor = executor
+        self.resume = resume
+        self.checkpoint = checkpoint
+        self.metrics = metrics
+        self.profiler = profiler
+        self.stream_chunk_rows = stream_chunk_rows
+        self.top_k = top_k
+        self.score_store = score_store
+        self.prefetcher = prefetcher if prefetcher is not None else TracePrefetcher()
+        self.feature_dtypes = feature_dtypes
+        self.compute_dtype = compute_dtype
+        self.cascade_size = cascade_size
+        self.score_cache = score_cache
+
+def compute_repetition(node_traces, setup_parameters, node_statistics=None):
+    """
+    Applies all metrics to the traces of one repetition and ranks the servers
+    for every client. Runs in a worker process if --workers is set. The
+    optional dict node_id -> NodeStatistics from the local trace store saves
+    the metrics the passes for column sums and value ranges.
+
+    Returns the ResultsArray of the repetition (one repetition x metrics x
+    features), the StageTimings of the computation, the score tensor
+    (metrics, clients, servers, features) and in cascade mode a boolean array
+    (clients,) marking the clients whose server survived the pruning. Scores
+    and survivors are None if no client was compared, survivors also
+    outside of cascade mode.
+    """
+    timings = StageTimings()
+    start_time = time.time()
+    scores = None
+    survivors = None
 
-        return correct_counter
+    # clients are analyzed up to the first missing client trace
+    client_traces = []
+    for client_index in xrange(1,setup_parameters.num_clients + 1):
+        client_trace = node_traces.get(client_index, [])
 
-    def get_num_fails(self):
-        fail_counter = 0
+        if len(client_trace) == 0:
+            print 'Skipped Client ', client_index
+            break
 
-        for result in self.results_container:
-            fail_counter += result.num_fails
+        client_traces.append(client_trace)
 
-        return fail_counter
+    server_traces = []
+    for server_index in  xrange(31,setup_parameters.num_servers + 31):
+        server_trace = node_traces.get(server_index, [])
 
-    def get_relative_success(self):
-        relative_success_list = []
+        if len(server_trace) == 0:
+            print 'Skipped Server ', server_index
+            print 'Skipped clients because server was corrupt'
+            client_traces = []
+            break
 
-        for result in self.results_container:
-            num_corrects = result.num_corrects
-            num_fails = result.num_fails
-            total = num_corrects + num_fails
+        server_traces.append(server_trace)
 
-            relative_success = float(num_corrects) / float(total)
-            relative_success_list.append(relative_success)
+    if len(client_traces) > 0:
+        """
+        Array of floats from the comparison of all clients with all servers,
+        shape (metrics, clients, servers, features).
+        """
+        correct_servers = get_correct_servers(setup_parameters.setup, setup_parameters.num_servers, len(client_traces))
+        client_statistics = get_node_statistics(node_statistics, range(1, len(client_traces) + 1))
+        server_statistics = get_node_statistics(node_statistics, range(31, len(server_traces) + 31))
+
+        if setup_parameters.cascade_size:
+            scores, shortlist = compute_cascade(client_traces, server_traces, setup_parameters.metrics, setup_parameters.cascade_size, timings,
+                setup_parameters.compute_dtype, client_statistics, server_statistics, setup_parameters.score_cache)
+            survivors = (shortlist == correct_servers[:, np.newaxis]).any(axis=1)
+        else:
+            scores = compute_all_pairs(client_traces, server_traces, setup_parameters.metrics, timings, setup_parameters.stream_chunk_rows,
+                setup_parameters.compute_dtype, client_statistics, server_statistics, setup_parameters.score_cache)
 
-        return relative_success_list
+        with timings.timed('ranking', len(client_traces)):
+            ranks = get_ranks(scores, correct_servers, [metric.direction for metric in setup_parameters.metrics])
+            counts = get_rank_counts(ranks, setup_parameters.top_k)
 
-    def get_list_element(self, index):
-        return self.results_container[index]
+        results = build_repetition_results(*counts)
+    else:
+        results = new_results(setup_parameters.num_metrics, setup_parameters.num_features)
 
-    def get_matrix_element(self, row, col):
-        return self.results_container[row][col]
+    timings.add('compute_repetition', time.time() - start_time)
+    return results, timings, scores, survivors
 
-class Result():
+@defer.inlineCallbacks
+def load_traces(context, setup_parameters, repetition):
     """
-    Keeps track of the number of correct and wrong guesses in a repetition.
-    The relative success can be computed from these.
+    Returns the dict node_id -> trace array of a repetition.
     """
-    def __init__(self):
-        self.num_corrects = 0
-        self.num_fails = 0
-
-    def increment_corrects(self):
-        self.num_corrects += 1
-
-    def increment_fails(self):
-        self.num_fails += 1
+    start_time = time.time()
+    try:
+        node_traces = yield context.source.load_repetition(setup_parameters, repetition)
+    except Exception as err:
+        print 'Problem querying repetition traces: ', err
+        node_traces = {}
+
+    num_rows = sum(len(trace) for trace in node_traces.itervalues())
+    context.profiler.add(setup_parameters.setup_index, 'load_traces', time.time() - start_time, 1, num_rows)
+    context.profiler.add_memory(setup_parameters.setup_index, repetition, get_num_bytes(node_traces), get_float64_bytes(node_traces))
+
+    defer.returnValue(node_traces)
+
+def get_metric_key(setup_parameters):
+    metric_key = ','.join(metric.get_key() for metric in setup_parameters.metrics)
+    if setup_parameters.stream_chunk_rows:
+        # streamed PCA projects all rows, the results differ from batch mode
+        metric_key += ';stream'
+    metric_key += get_dtype_key(setup_parameters.feature_dtypes, setup_parameters.compute_dtype)
+    if setup_parameters.cascade_size:
+        metric_key += ';cascade={}'.format(setup_parameters.cascade_size)
+    return metric_key + ';top_k={}'.format(setup_parameters.top_k)
+
+def merge_compute_timings(computed, profiler, setup_parameters):
+    results, timings, scores, survivors = computed
+    profiler.merge(setup_parameters.setup_index, timings)
+    return results
+
+def record_survivors(computed, profiler, setup_parameters, repetition):
+    survivors = computed[3]
+    if survivors is not None:
+        profiler.add_cascade(setup_parameters.setup_index, repetition, len(survivors), int(survivors.sum()))
+    return computed
+
+def store_scores(computed, score_store, setup_parameters, repetition):
+    scores = computed[2]
+    if scores is not None:
+        score_store.put_repetition(setup_parameters.setup_index, repetition, scores)
+    return computed
+
+def store_checkpoint(results, checkpoint, setup_parameters, repetition):
+    checkpoint.put_repetition(setup_parameters.setup_index, repetition, get_metric_key(setup_parameters), *results.get_counts(0))
+    return results
+
+def print_compute_error(failure, setup_parameters, repetition):
+    print 'Problem computing setup {}, repetition {}: '.format(setup_parameters.setup_index, repetition), failure.getErrorMessage()
+    return None
+
+def release_prefetched(computed, prefetcher, num_bytes):
+    prefetcher.release(num_bytes)
+    return computed
+
+def has_planned_clients(repetition_plan, setup_parameters):
+    """
+    False if the work plan shows that no client of the repetition can be
+    compared, because the first client or a server has no trace. Such a
+    repetition counts with zero guesses without loading its traces.
+    """
+    if repetition_plan.get_num_clients(setup_parameters.num_clients) == 0:
+        print 'Skipped Client ', 1
+        return False
 
-    def get_num_corrects(self):
-        return self.num_corrects
+    missing_server = repetition_plan.get_missing_server(setup_parameters.num_servers)
+    if missing_server is not None:
+        print 'Skipped Server ', missing_server
+        print 'Skipped clients because server was corrupt'
+        return False
 
-    def get_num_fails(self):
-        return self.num_fails
+    return True
 
-def verify_guesses(client_container, comparison_container, setup_parameters, client_index):
+@defer.inlineCallbacks
+def analyze_repetition(context, setup_parameters, repetition):
+    """
+    Loads the traces of a repetition through the prefetcher and computes the
+    ResultsArray of the repetition, None if the computation failed. The
+    prefetched bytes are released once the computation is done.
     """
-    Verify the metrics results for
+    node_traces, num_bytes = yield context.prefetcher.load(load_traces, context, setup_parameters, repetition)
+    node_statistics = yield context.source.load_statistics(setup_parameters, repetition)
+
+    yield context.executor.reserve()
+    computed = context.executor.submit(compute_repetition, node_traces, setup_parameters, node_statistics)
+    del node_traces
+    computed.addBoth(release_prefetched, context.prefetcher, num_bytes)
+
+    if context.score_store is not None:
+        computed.addCallback(store_scores, context.score_store, setup_parameters, repetition)
+    computed.addCallback(record_survivors, context.profiler, setup_parameters, repetition)
+    computed.addCallback(merge_compute_timings, context.profiler, setup_parameters)
+    if context.checkpoint is not None:
+        computed.addCallback(store_checkpoint, context.checkpoint, setup_parameters, repetition)
+    computed.addErrback(print_compute_error, setup_parameters, repetition)
+
+    results = yield computed
+    defer.returnValue(results)
+
+def analyze_planned_repetition(context, setup_parameters, repetition, planned):
     """
+    Deferred ResultsArray of a repetition of the work plan: zero guesses if
+    its clients cannot be compared (planned is False), the checkpointed
+    counts if there are any, otherwise computed by analyze_repetition.
+    """
+    if not planned:
+        return defer.succeed(new_results(setup_parameters.num_metrics, setup_parameters.num_features))
 
-    # node indexes start at 1, result arrays start at 0, decrement node indexes for comparison
-    if setup_parameters.setup == 'directed':
-        correct_target = client_index - 1
-    else:
-        if client_index < setup_parameters.num_servers:
-            correct_target = 0
-        else:
-            correct_target = 1
-
-    for metric in xrange(0,setup_parameters.num_metrics):
-        for feature in xrange(0,setup_parameters.num_features):
-
-            metric_feature_attempts = []
-            for server in xrange(0, setup_parameters.num_servers):
-                guess_matrix = comparison_container.get_list_element(server)
-
-                try:
-                    metric_feature_attempts.append(guess_matrix[metric][feature])
-                except Exception as err:
-                    print 'Problem appending attempts ', err
-
-                try:
-                    tmp_guess = client_container.get_matrix_element(metric, feature)
-                except Exception as err:
-                    print 'Problem getting tmp_guess thingy', err
-
-            if metric == 0 or metric == 3:
-                # scalar (0)
-                # rmse (3)
-                try:
-                    min_index = min(enumerate(metric_feature_attempts),key=lambda x: x[1])[0]
-                except Exception as err:
-                    print 'Problem getting min index for scalar or rmse ', err
-
-                if min_index == correct_target:
-                    tmp_guess.increment_corrects()
-                else:
-                    tmp_guess.increment_fails()
-
-            elif metric == 1 or metric == 2 or metric == 4:
-                # pca + pearson (1)
-                # pearson (2)
-                # mutual info (4)
-                try:
-                    max_index = max(enumerate(metric_feature_attempts),key=lambda x: x[1])[0]
-                except Exception as err:
-                    print 'Problem getting max index for pcap, pearson, or mutual info ', err
-
-                if max_index == correct_target:
-                    tmp_guess.increment_corrects()
-                else:
-                    tmp_guess.increment_fails()
-            else:
-                # not covered right now
-                print 'Not covered, what happened?'
+    if context.checkpoint is not None:
+        counts = context.checkpoint.get_repetition(setup_parameters.setup_index, repetition, get_metric_key(setup_parameters))
+        if counts is not None:
+            print 'Repetition {} restored from checkpoint'.format(repetition)
+            return defer.succeed(build_repetition_results(*counts))
+
+    return analyze_repetition(context, setup_parameters, repetition)
 
 @defer.inlineCallbacks
-def analyze_repetitions(reactor, dbpool, setup_parameters, db_name):
+def analyze_repetitions(reactor, context, setup_parameters, setup_plan):
     """
-    List of results for each repetition. Entries are matrices of the following format:
-
-    Rows:
-        Metrics
-    Columns:
-        Features (see setup_parameters.features)
+    Computes every repetition of a setup, stacks the ResultsArrays of the
+    repetitions (repetitions x metrics x features) and writes the results.
+
+    The SetupPlan tells which repetitions have traces and which clients and
+    servers are missing, without a query per repetition. The traces of the
+    following repetitions are loaded concurrently while earlier ones are
+    computed, bounded by the prefetch depth and memory budget of the
+    context's TracePrefetcher.
+
+    If the computation of a repetition fails, the setup is not written, so
+    it is not complete for --resume and is analyzed again. The repetitions
+    that were computed come from the checkpoint then, if there is one.
     """
 
     print 'Analyze Repetitions'
-    repetitions_container = ResultsContainer('repetition results')
 
+    if context.score_store is not None:
+        context.score_store.put_setup(setup_parameters.setup_index, setup_parameters.setup, setup_parameters.num_clients,
+            [metric.name for metric in setup_parameters.metrics], [metric.direction for metric in setup_parameters.metrics])
+
+    repetitions = []
+    pending_repetitions = []
     for repetition in xrange(1, setup_parameters.num_repetitions + 1):
         print 'Repetition {}/{}'.format(repetition, setup_parameters.num_repetitions)
-        """
-        Matrix of Result objects to save the results of the identification attack.
-        Entries are Result objects and get incremented after each client iteration,
-        organized as follows:
-
-        Rows:
-            Metrics
-        Columns:
-            Features
-        """
-        try:
-            repetition_ok = yield dbpool.runQuery('SELECT EXISTS(SELECT * FROM {}.traces_submission WHERE setup_id={} AND repetition={});'.format(
-                db_name,
-                setup_parameters.setup_index,
-                repetition
-            ))
-        except Exception as err:
-            print err
-
-        if repetition_ok[0][0] == 1:
-
-            client_container = ResultsContainer('client results')
-            for metric in xrange(0,setup_parameters.num_metrics):
-                tmp_list = []
-                for feature in xrange(0,setup_parameters.num_features):
-                    result = Result()
-                    tmp_list.append(result)
-                client_container.append_item(tmp_list)
-
-            for client_index in xrange(1,setup_parameters.num_clients + 1):
-                print 'Client {}/{}'.format(client_index, setup_parameters.num_clients)
-                """
-                Matrix of floats from the comparison of one client with all servers.
-                Entries are the results of applied metrics. Rows and Columns like before.
-                """
-                try:
-                    client_trace = yield dbpool.runQuery('SELECT {features} FROM {database}.traces_submission WHERE repetition={rep} AND setup_id={setup_id} AND node_id={node_index};'.format(
-                            features = setup_parameters.features,
-                            database = db_name.
-                            rep = repetition,
-                            setup_id = setup_parameters.setup_index,
-                            node_index = client_index
-                        ))
-                except Exception as err:
-                    print 'Problem querying client trace: ', err
-
-                if len(client_trace) == 0:
-                    print 'Skipped Client ', client_index
-                    break
-
-                comparison_container = ResultsContainer('server comparisons')
-
-                server_id_string = '('
-                for server_index in  xrange(31,setup_parameters.num_servers + 31):
-                    server_id_string += 'node_id = ' + str(server_index)
-                    if server_index < setup_parameters.num_servers + 30:
-                        server_id_string += ' OR '
-
-                server_id_string += ')'
-
-                server_features = 'node_id, ' + setup_parameters.features
-
-                try:
-                    all_server_traces = yield dbpool.runQuery('SELECT {features} FROM {database}.traces_submission WHERE repetition={rep} AND setup_id={sid} AND {server_ids};'.format(
-                        features = server_features,
-                        database = db_name,
-                        rep = repetition,
-                        sid = setup_parameters.setup_index,
-                        server_ids = server_id_string
-                    ))
-                except Excetption as err:
-                    print 'Problem querying all servers: ', err
-
-                server_fail = 0
-                for server_index in  xrange(31,setup_parameters.num_servers + 31):
-
-                    server_trace = filter(lambda x: x[0]==server_index, all_server_traces)
-
-                    if len(server_trace) == 0:
-                        print 'Skipped Server ', server_index
-                        server_fail = 1
-                        break
-
-                    res_scalar_pc = apply_packet_count(client_trace, server_trace)
-                    res_dist_pcap = apply_pca_pearson(client_trace, server_trace)
-                    res_dist_p = apply_pearson(client_trace, server_trace)
-                    res_dist_rmse = apply_rmse(client_trace, server_trace)
-                    res_dist_mutinfo = apply_mutinfo(client_trace, server_trace)
-
-                    metric_feature_matrix = [res_scalar_pc, res_dist_pcap, res_dist_p, res_dist_rmse, res_dist_mutinfo]
-                    comparison_container.append_item(metric_feature_matrix)
-
-                if server_fail == 1:
-                    print 'Skipped client because server was corrupt'
-                    break
-
-                verify_guesses(client_container, comparison_container, setup_parameters, client_index)
-
-            repetitions_container.append_item(client_container)
-
-    yield write_ta_results(reactor, dbpool, repetitions_container, setup_parameters, db_name)
+
+        repetition_plan = setup_plan.get_repetition(repetition)
+        if repetition_plan is None:
+            continue
+
+        planned = has_planned_clients(repetition_plan, setup_parameters)
+        repetitions.append(repetition)
+        pending_repetitions.append(analyze_planned_repetition(context, setup_parameters, repetition, planned))
+
+    computed_results = yield defer.gatherResults(pending_repetitions)
+
+    if context.score_store is not None:
+        context.score_store.index['features'] = FEATURE_STRINGS
+        context.score_store.write_index()
+
+    failed_repetitions = [repetition for repetition, result in zip(repetitions, computed_results) if result is None]
+    if failed_repetitions:
+        print 'Setup {} not written, failed repetitions: {}'.format(setup_parameters.setup_index, ', '.join(str(repetition) for repetition in failed_repetitions))
+        return
+
+    results = concatenate_results(computed_results, setup_parameters.num_metrics, setup_parameters.num_features)
+    yield write_ta_results(reactor, context, results, setup_parameters)
 
 @defer.inlineCallbacks
-def write_ta_results(reactor, dbpool, results_container, setup_params, db_name):
+def write_ta_results(reactor, context, results, setup_params):
     """
-    Get the average and standard deviation for repetitions and write these
-    aggregated results to the database.
+    Get the average and standard deviation for repetitions and hand these
+    aggregated results to the result writer, which writes the rows of
+    several setups in one transaction.
+
+    Besides the ta_submission rows, one rank row per metric and feature with
+    the average top-1 and top-k accuracy and the mean reciprocal rank is
+    written to ta_rank_submission.
     """
 
-    print 'Write Results'
+    # shape (repetitions, metrics, features)
+    relative_corrects = results.get_relative_success()
+    top_k_accuracies = results.get_relative(results.top_k_hits)
+    reciprocal_ranks = results.get_relative(results.reciprocal_ranks)
+
+    # shape (metrics, features)
+    if results.get_num_repetitions() > 0:
+        avg_corrects = relative_corrects.mean(axis=0)
+        sd_corrects = relative_corrects.std(axis=0)
+        avg_top_k = top_k_accuracies.mean(axis=0)
+        avg_reciprocal_ranks = reciprocal_ranks.mean(axis=0)
+        sd_reciprocal_ranks = reciprocal_ranks.std(axis=0)
+    else:
+        avg_corrects = sd_corrects = avg_top_k = avg_reciprocal_ranks = sd_reciprocal_ranks = \
+            np.zeros((setup_params.num_metrics, setup_params.num_features), dtype=np.float64)
 
-    db_columns = '(setup_id, metric, feature, success_avg, success_sd, num_successes, num_fails)'
-    id_string = '"{}"'.format(setup_params.setup_index)
+    total_corrects = results.corrects.sum(axis=0)
+    total_fails = results.fails.sum(axis=0)
 
-    metric_strings = ['"scalar_counts"', '"distance_pca_pearson"', '"distance_pearson"', '"distance_rmse"', '"distance_mutinfo"']
-    feature_strings = ['"packet_counts"', '"inter_arrival_time"', '"packet_length"', '"time_to_live"', '"window_size"']
+    rows = []
+    rank_rows = []
 
     for metric in xrange(0, setup_params.num_metrics):
-        metric_string = metric_strings[metric]
+        metric_string = setup_params.metrics[metric].name
 
         for feature in xrange(0, setup_params.num_features):
-            feature_string = feature_strings[feature]
-
-            corrects = []
-            total_corrects = []
-            fails = []
-            total_fails = []
-
-            for repetition in xrange(0, results_container.get_length()):
-
-                client_results = results_container.get_list_element(repetition)
-                results_object = client_results.get_matrix_element(metric, feature)
-
-                num_corrects = results_object.get_num_corrects()
-                num_fails = results_object.get_num_fails()
-
-                total_guesses = num_corrects + num_fails
-
-                if total_guesses > 0:
-                    rel_correct = float(num_corrects) / float(total_guesses)
-                    rel_fail = float(num_fails) / float(total_guesses)
-                else:
-                    rel_correct = 0
-                    rel_fail = 0
-
-                total_corrects.append(num_corrects)
-                total_fails.append(num_fails)
-
-                corrects.append(rel_correct)
-                fails.append(rel_fail)
-
-            try:
-                avg_correct = sum(corrects) / len(corrects)
-                sd_correct = np.std(corrects)
-            except Exception as err:
-                print 'Problem getting avg corrects: ', err
-                avg_correct = 0
-                sd_correct = 0
-
-            total_correct = sum(total_corrects)
-            total_fail = sum(total_fails)
-
-            avg_correct_string = '"{}"'.format(avg_correct)
-            sd_correct_string = '"{}"'.format(sd_correct)
-            total_correct_string = '"{}"'.format(total_correct)
-            total_fail_string = '"{}"'.format(total_fail)
-
-            try:
-                yield dbpool.runQuery('INSERT INTO {}.ta_submission {} VALUES ({},{},{},{},{},{},{});'.format(
-                    db_name,
-                    db_columns,
-                    setup_params.setup_index,
-                    metric_string,
-                    feature_string,
-                    avg_correct_string,
-                    sd_correct_string,
-                    total_correct_string,
-                    total_fail_string
-                ))
-            except Exception as err:
-                print 'Problem writing Results to DB: ', err
+            feature_string = FEATURE_STRINGS[feature]
+            total_correct = int(total_corrects[metric, feature])
+            total_fail = int(total_fails[metric, feature])
+
+            rows.append((setup_params.setup_index, metric_string, feature_string, float(avg_corrects[metric, feature]),
+                float(sd_corrects[metric, feature]), total_correct, total_fail))
+
+            rank_rows.append((setup_params.setup_index, metric_string, feature_string, int(setup_params.top_k), float(avg_corrects[metric, feature]),
+                float(avg_top_k[metric, feature]), float(avg_reciprocal_ranks[metric, feature]), float(sd_reciprocal_ranks[metric, feature]),
+                total_correct + total_fail))
+
+    yield context.writer.add_setup(setup_params.setup_index, rows, rank_rows)
+
+def build_setup_parameters(setup_index, setup_data, metrics, stream_chunk_rows=None, top_k=DEFAULT_TOP_K, feature_dtypes=None, compute_dtype='float64',
+        cascade_size=None, score_cache=None):
+    """
+    SetupParameters from a (setup, num_clients, repetitions) row of the
+    setups table.
+    """
+    network_setup = setup_data[0]
+    num_clients = setup_data[1]
+    num_reps = setup_data[2]
+
+    return SetupParameters(num_reps, num_clients, network_setup, setup_index, FEATURES, NUM_FEATURES, metrics, stream_chunk_rows, top_k,
+        feature_dtypes, compute_dtype, cascade_size, score_cache)
 
 @defer.inlineCallbacks
-def analyze_setups(reactor, dbpool, select_setup, db_name):
+def get_work_plan(source, profiler):
+    """
+    Returns the WorkPlan of all setups, an empty one if the planning queries
+    fail.
+    """
+    start_time = time.time()
+    try:
+        work_plan = yield source.get_work_plan()
+    except Exception as err:
+        print 'Problem querying the work plan: ', err
+        work_plan = WorkPlan(OrderedDict())
+    profiler.add(None, 'plan_query', time.time() - start_time, 1, len(work_plan.get_setup_ids()))
+
+    defer.returnValue(work_plan)
+
+def select_planned_setups(work_plan, select_setup):
+    """
+    Returns the ids of the setups selected by --select-setup that are in the
+    work plan.
+    """
+    if select_setup == 'All' or select_setup == 'all':
+        return work_plan.get_setup_ids()
+
+    setup_plan = work_plan.get_setup(select_setup)
+    if setup_plan is None:
+        print 'Error querying setup_data: setup {} not found'.format(select_setup)
+        return []
+    return [setup_plan.setup_id]
+
+@defer.inlineCallbacks
+def analyze_setups(reactor, context, select_setup):
     """
     Iterate through all setups in the db_name.setups table and apply the
     set of metrics to it.
+
+    Up to one setup per worker plus the prefetch depth are analyzed at the
+    same time, so the traces of the next setups are loaded while the last
+    repetitions of the current ones are computed.
+
+    The setups and the repetitions with traces come from the work plan,
+    which is queried once before the analysis.
     """
-    if select_setup == 'All' or select_setup == 'all':
-        try:
-            start_time = int(round(time.time() * 1000))
-            num_setups = yield dbpool.runQuery('SELECT COUNT(*) FROM {}.setups_submission;'.format(db_name))
-            end_time = int(round(time.time() * 1000))
-            print 'Query Setup ', end_time - end_time
+    work_plan = yield get_work_plan(context.source, context.profiler)
+    setup_ids = select_planned_setups(work_plan, select_setup)
+
+    if context.resume:
+        metric_names = [metric.name for metric in context.metrics]
+        completed_setups = yield context.writer.get_completed_setups(metric_names, FEATURE_STRINGS)
+        setup_ids = [setup_id for setup_id in setup_ids if str(setup_id) not in completed_setups]
+        print 'Resume: {} setups left to analyze'.format(len(setup_ids))
+
+    pending_setups = []
+    for setup_number, current_setup in enumerate(setup_ids, 1):
+        print 'Setup {}/{}'.format(setup_number, len(setup_ids))
+
+        setup_plan = work_plan.get_setup(current_setup)
+        setup_params = build_setup_parameters(setup_plan.setup_id, setup_plan.setup_data, context.metrics, context.stream_chunk_rows, context.top_k,
+            context.feature_dtypes, context.compute_dtype, context.cascade_size, context.score_cache)
+
+        pending_setups.append(analyze_repetitions(reactor, context, setup_params, setup_plan))
+        if len(pending_setups) >= context.executor.num_workers + context.prefetcher.depth:
+            yield pending_setups.pop(0)
 
-        except Exception as err:
-            print 'Problem in select count: ', err
+    yield defer.gatherResults(pending_setups)
+    yield context.writer.flush()
 
-        num_setups = num_setups[0][0]
+@defer.inlineCallbacks
+def fill_work_queue(source, queue, select_setup, profiler, lease_seconds=DEFAULT_LEASE_SECONDS):
+    """
+    Splits the selected setups of the work plan into one shard per
+    repetition with traces and adds them to the WorkQueue, the largest
+    repetitions first.
+    """
+    work_plan = yield get_work_plan(source, profiler)
+    setup_ids = set(select_planned_setups(work_plan, select_setup))
+
+    setups = []
+    for setup_id in sorted(setup_ids):
+        network_setup, num_clients, num_reps = work_plan.get_setup(setup_id).setup_data
+        setups.append((setup_id, network_setup, num_clients, num_reps))
+
+    shards = []
+    for setup_id, repetition, num_rows in work_plan.get_work_items():
+        setup_plan = work_plan.get_setup(setup_id)
+        if setup_id not in setup_ids or not 1 <= repetition <= setup_plan.setup_data[2]:
+            continue
+
+        setup_parameters = build_setup_parameters(setup_id, setup_plan.setup_data, [])
+        shards.append((setup_id, repetition, has_planned_clients(setup_plan.get_repetition(repetition), setup_parameters)))
+
+    queue.put_work(setups, shards, lease_seconds)
+    print 'Queued {} shards of {} setups'.format(len(shards), len(setups))
+
+@defer.inlineCallbacks
+def analyze_shard(context, queue, shard):
+    """
+    Computes the repetition of a leased shard and stores its counts in the
+    queue, or marks the shard failed.
+    """
+    setup_id, repetition, planned = shard
+    print 'Setup {}, repetition {}'.format(setup_id, repetition)
+
+    setup_parameters = build_setup_parameters(setup_id, queue.get_setup(setup_id), context.metrics, context.stream_chunk_rows, context.top_k,
+        context.feature_dtypes, context.compute_dtype, context.cascade_size, context.score_cache)
+    results = yield analyze_planned_repetition(context, setup_parameters, repetition, planned)
+
+    if results is None:
+        queue.fail(setup_id, repetition)
     else:
-        num_setups = 1
-        current_setup = select_setup
+        queue.complete(setup_id, repetition, get_metric_key(setup_parameters), [metric.name for metric in setup_parameters.metrics],
+            setup_parameters.top_k, results.get_counts(0))
 
-    for setup_index in xrange(1, num_setups + 1):
-        if select_setup == 'All' or select_setup == 'all':
-            print 'Setup {}/{}'.format(setup_index, num_setups)
-            current_setup = setup_index
+@defer.inlineCallbacks
+def run_worker(reactor, context, queue, worker_id):
+    """
+    Leases and computes shards until no shard of the queue is pending or
+    leased. Like analyze_setups, up to one shard per worker process plus the
+    prefetch depth are in progress. The leases are renewed after every shard
+    and every third of the lease time, while the reactor is not blocked by a
+    computation. An idle worker waits for leases of other workers to expire.
+    """
+    heartbeat = task.LoopingCall(queue.renew, worker_id)
+    heartbeat.start(queue.get_lease_seconds() / 3, now=False)
+
+    pending_shards = []
+    while True:
+        shard = queue.lease(worker_id)
+        if shard is not None:
+            pending_shards.append(analyze_shard(context, queue, shard))
+            if len(pending_shards) >= context.executor.num_workers + context.prefetcher.depth:
+                yield pending_shards.pop(0)
+                queue.renew(worker_id)
+        elif pending_shards:
+            yield pending_shards.pop(0)
+            queue.renew(worker_id)
+        elif queue.is_finished():
+            break
         else:
-            print 'Setup ', current_setup
+            yield task.deferLater(reactor, DEFAULT_POLL_SECONDS, lambda: None)
+
+    heartbeat.stop()
+
+@defer.inlineCallbacks
+def reduce_work_queue(reactor, context, queue):
+    """
+    Stacks the repetition counts of every setup whose shards are all done
+    and writes them with write_ta_results, once per setup. Like analyze,
+    setups without computed repetitions get zero counts, and setups with
+    failed repetitions are not written. Setups whose repetitions were
+    computed with different settings are skipped.
+
+    The written setups are recorded in the queue. Unless the results are
+    replaced, a later reduce only writes the setups finished since.
+    """
+    finished_setups = queue.get_finished_setups()
+    if not context.writer.replace:
+        reduced_setups = queue.get_reduced_setups()
+        finished_setups = [setup_id for setup_id in finished_setups if setup_id not in reduced_setups]
 
-        try:
-            setup_data = yield dbpool.runQuery('SELECT setup, num_clients, repetitions FROM {}.setups_submission WHERE id = {};'.format(db_name, current_setup))
-        except Exception as err:
-            print 'Error querying setup_data: ', err
+    # setups without repetitions get the metrics of the others
+    default_settings = queue.get_result_settings() or ([metric.name for metric in get_metrics()], DEFAULT_TOP_K)
 
-        network_setup = setup_data[0][0]
-        num_clients = setup_data[0][1]
-        num_reps = setup_data[0][2]
+    written_setups = []
+    for setup_id in finished_setups:
+        failed_repetitions = queue.get_failed_repetitions(setup_id)
+        if failed_repetitions:
+            print 'Setup {} not written, failed repetitions: {}'.format(setup_id, ', '.join(str(repetition) for repetition in failed_repetitions))
+            continue
 
-        features = 'packet_count, inter_arrival_time, packet_length, time_to_live, window_size'
+        shard_results = queue.get_results(setup_id)
+        if len(set(metric_key for repetition, metric_key, metric_names, top_k, counts in shard_results)) > 1:
+            print 'Skipped setup {}, its repetitions were computed with different settings'.format(setup_id)
+            continue
 
-        num_features = 5
-        num_metrics = 5
+        metric_names, top_k = shard_results[0][2:4] if shard_results else default_settings
+        setup_parameters = build_setup_parameters(setup_id, queue.get_setup(setup_id), get_metrics(metric_names), top_k=top_k)
+        results = concatenate_results([build_repetition_results(*counts) for repetition, metric_key, metric_names, top_k, counts in shard_results],
+            setup_parameters.num_metrics, setup_parameters.num_features)
 
-        setup_params = SetupParameters(num_reps, num_clients, network_setup, current_setup, features, num_features, num_metrics)
+        yield write_ta_results(reactor, context, results, setup_parameters)
+        written_setups.append(setup_id)
 
-        yield analyze_repetitions(reactor, dbpool, setup_params, db_name)
+    yield context.writer.flush()
+    queue.mark_reduced(written_setups)
 
-@click.command()
-@click.option('--select-setup', default=None, type=str, help='Enter Setup ID if you want a specific setup, "All" otherwise')
-@click.option('--db-name', default=None, type=str, help='Name of DB')
-@click.option('--db-user', default=None, type=str, help='Username DB')
-@click.option('--db-passwd', default=None, type=str, help='Password DB')
-@click.option('--db-port', default=None, type=int, help='DB connection port')
-@click.option('--db-host', default=None, type=str, help='DB connection host')
-def main(select_setup, db_name, db_user, db_passwd, db_port, db_host):
+    state_counts = queue.get_state_counts()
+    print 'Reduced {} setups, shards: {}'.format(len(written_setups), ', '.join('{} {}'.format(count, state) for state, count in sorted(state_counts.iteritems())))
 
+def db_options(command):
+    """
+    Adds the DB connection options shared by all commands.
+    """
+    command = click.option('--db-host', default=None, type=str, help='DB connection host')(command)
+    command = click.option('--db-port', default=None, type=int, help='DB connection port')(command)
+    command = click.option('--db-passwd', default=None, type=str, help='Password DB')(command)
+    command = click.option('--db-user', default=None, type=str, help='Username DB')(command)
+    command = click.option('--db-name', default=None, type=str, help='Name of DB')(command)
+    command = click.option('--db-pool-max', default=DEFAULT_POOL_MAX, type=click.IntRange(1, None), help='Maximum number of DB connections in the pool')(command)
+    command = click.option('--db-pool-min', default=DEFAULT_POOL_MIN, type=click.IntRange(1, None), help='Number of DB connections opened at start')(command)
+    return command
+
+def connect_db(db_name, db_user, db_passwd, db_port, db_host, db_pool_min=DEFAULT_POOL_MIN, db_pool_max=DEFAULT_POOL_MAX):
+    """
+    Each pool connection runs one query at a time in its own thread, the pool
+    needs at least as many connections as there are concurrent loads to
+    overlap them.
+    """
     try:
-        dbpool = adbapi.ConnectionPool('MySQLdb', host=db_host, db=db_name, user=db_user, passwd=db_passwd, port=db_port)
+        # server side cursor, rows are streamed in batches instead of buffered by the client
+        from MySQLdb.cursors import SSCursor
+        return adbapi.ConnectionPool('MySQLdb', host=db_host, db=db_name, user=db_user, passwd=db_passwd, port=db_port, cursorclass=SSCursor,
+            cp_min=db_pool_min, cp_max=max(db_pool_min, db_pool_max))
     except Exception as err:
         print 'Failed to connect to DB:', err
 
+def parse_metrics(ctx, param, value):
+    """
+    Click callback turning the --metrics string into Metric objects, the
+    default metrics if the option is not given.
+    """
+    if value is None:
+        return get_metrics()
+
+    names = [name.strip() for name in value.split(',') if name.strip()]
+    try:
+        return get_metrics(names)
+    except KeyError as err:
+        raise click.BadParameter('unknown metric {}, choose from {}'.format(err.args[0], ', '.join(get_metric_names())))
+
+def parse_dtype_policy(ctx, param, value):
+    """
+    Click callback turning --feature-dtypes into a list of numpy dtypes, None
+    for float64 traces.
+    """
+    try:
+        return parse_feature_dtypes(value, NUM_FEATURES)
+    except ValueError as err:
+        raise click.BadParameter(str(err))
+
+def analysis_options(command):
+    """
+    Adds the options of the trace source, the computation and the metrics
+    shared by analyze and worker.
+    """
+    options = [
+        click.option('--fetch-batch-size', default=10000, type=int, help='Number of trace rows fetched per batch'),
+        click.option('--workers', default=1, type=click.IntRange(1, None), help='Number of worker processes for the metric computation'),
+        click.option('--source', default='db', type=click.Choice(['db', 'local']), help='Read traces from the DB or from a local trace store'),
+        click.option('--store', default=None, type=click.Path(), help='Directory of the local trace store (--source local)'),
+        click.option('--metrics', default=None, type=str, callback=parse_metrics, help='Comma separated metrics: ' + ', '.join(get_metric_names()) + '; default ' + ', '.join(get_default_metric_names())),
+        click.option('--profile', default=None, type=click.Path(), help='Write a per stage timing report to this JSON (or .csv) file'),
+        click.option('--cprofile', default=None, type=click.Path(), help='Run under cProfile and dump the stats to this file'),
+        click.option('--mi-bins', default=DEFAULT_BINS, type=click.IntRange(2, None), help='Number of bins per feature for the mutual information'),
+        click.option('--mi-binning', default=DEFAULT_BINNING, type=click.Choice(['uniform', 'quantile']), help='Bin edges for the mutual information'),
+        click.option('--xcorr-window', default=DEFAULT_WINDOW, type=click.FloatRange(0, None), help='Time window in seconds of distance_window_xcorr'),
+        click.option('--xcorr-step', default=None, type=click.FloatRange(0, None), help='Step between sliding windows in seconds, defaults to the window'),
+        click.option('--xcorr-max-lag', default=DEFAULT_MAX_LAG, type=click.IntRange(-1, None), help='Largest time shift in windows searched by distance_window_xcorr, -1 for all shifts'),
+        click.option('--top-k', default=DEFAULT_TOP_K, type=click.IntRange(1, None), help='k of the top-k accuracy in ta_rank_submission'),
+        click.option('--stream-chunk-rows', default=None, type=click.IntRange(1, None), help='Run the metrics in streaming mode, reading the traces in chunks of this many rows'),
+        click.option('--prefetch-depth', default=DEFAULT_PREFETCH_DEPTH, type=click.IntRange(1, None), help='Number of repetitions whose traces are loaded concurrently ahead of the computation'),
+        click.option('--prefetch-mb', default=DEFAULT_PREFETCH_MB, type=click.IntRange(1, None), help='Memory budget in MB for loaded traces waiting for the computation'),
+        click.option('--feature-dtypes', default='float64', type=str, callback=parse_dtype_policy,
+            help='Storage dtypes of the loaded trace columns: ' + ', '.join(sorted(DTYPE_POLICIES)) + ' or one comma separated numpy dtype per feature'),
+        click.option('--compute-dtype', default='float64', type=click.Choice(COMPUTE_DTYPES), help='dtype of the stacked traces the metrics run on'),
+        click.option('--cascade', default=None, type=click.IntRange(1, None), help='Run the expensive metrics only on this many servers per client, the best ones of the cheap metrics'),
+        click.option('--score-cache', default=None, type=click.Path(), help='SQLite file caching the scores of every pair, only pairs without cached scores are computed'),
+        click.option('--score-cache-mb', default=DEFAULT_SCORE_CACHE_MB, type=click.IntRange(1, None), help='Size limit of the score cache in MB, the least recently used scores are evicted')
+    ]
+    for option in reversed(options):
+        command = option(command)
+    return command
+
+def configure_metrics(metrics, stream_chunk_rows, cascade, mi_bins, mi_binning, xcorr_window, xcorr_step, xcorr_max_lag):
+    """
+    Checks the metric options against each other and returns the metrics
+    with their parameters. Raises click.BadParameter.
+    """
+    if stream_chunk_rows is not None and mi_binning != 'uniform' and any(metric.name == 'distance_mutinfo' for metric in metrics):
+        raise click.BadParameter('streaming mode supports only uniform binning', param_hint='--mi-binning')
+    if stream_chunk_rows is not None and cascade is not None:
+        raise click.BadParameter('cascade mode needs the batch metrics, it cannot be combined with --stream-chunk-rows', param_hint='--cascade')
+
+    metrics = set_metric_params(metrics, 'distance_mutinfo', bins=mi_bins, binning=mi_binning)
+    if xcorr_window <= 0 or (xcorr_step is not None and not 0 < xcorr_step <= xcorr_window):
+        raise click.BadParameter('the window must be positive and the step between 0 and the window', param_hint='--xcorr-window/--xcorr-step')
+    return set_metric_params(metrics, 'distance_window_xcorr', window=xcorr_window, step=xcorr_step, max_lag=None if xcorr_max_lag < 0 else xcorr_max_lag)
+
+def get_trace_source(source, store, dbpool, db_name, fetch_batch_size, profiler):
+    if source == 'local':
+        if store is None:
+            raise click.UsageError('--source local requires --store')
+        return LocalTraceSource(TraceStore(store))
+    return DatabaseTraceSource(dbpool, db_name, fetch_batch_size, profiler)
+
+def get_score_cache(path, max_mb):
+    return None if path is None else ScoreCache(path, max_mb * 1024 * 1024)
+
+def run_reactor(reactor, deferred, cprofile=None):
+    """
+    Runs the reactor until the deferred fired, under cProfile if a stats
+    file is given. With the local trace store the deferred may fire before
+    the reactor runs, the stop waits for it. A failure is printed to stderr
+    and the process exits with status 1.
+    """
+    failures = []
+
+    def print_failure(failure):
+        failures.append(failure)
+        failure.printTraceback(file=sys.stderr)
+
+    deferred.addErrback(print_failure)
+    deferred.addBoth(lambda ign: reactor.callWhenRunning(reactor.stop))
+
+    if cprofile is not None:
+        import cProfile
+        cProfile.runctx('reactor.run()', globals(), {'reactor': reactor}, cprofile)
+    else:
+        reactor.run()
+
+    if failures:
+        sys.exit(1)
+
+def print_cascade_survival(profiler):
+    num_clients, num_survivors = profiler.get_cascade_survival()
+    print 'Cascade: the server of {}/{} clients survived the pruning ({:.1%})'.format(num_survivors, num_clients,
+        float(num_survivors) / num_clients if num_clients > 0 else 0)
+
+@click.group()
+def cli():
+    """
+    Traffic analysis of the traces in the traces_submission table.
+    """
+    pass
+
+@cli.command('analyze')
+@click.option('--select-setup', default='all', type=str, help='Enter Setup ID if you want a specific setup, "All" otherwise')
+@db_options
+@analysis_options
+@click.option('--results-file', default=None, type=click.Path(), help='CSV file for the results if no DB host is given')
+@click.option('--write-mode', default='append', type=click.Choice(['append', 'replace']), help='Append results or replace the existing results of a setup')
+@click.option('--write-batch', default=10, type=click.IntRange(1, None), help='Number of setups whose results are written in one transaction')
+@click.option('--resume', is_flag=True, help='Skip setups that already have complete results, append the results of the others')
+@click.option('--checkpoint', default=None, type=click.Path(), help='File with per repetition results, reused by later runs')
+@click.option('--save-scores', default=None, type=click.Path(), help='Directory where the score tensor of every repetition is saved for the fuse command')
+def main(select_setup, db_name, db_user, db_passwd, db_port, db_host, db_pool_min, db_pool_max, fetch_batch_size, workers, source, store, results_file, write_mode, write_batch, resume, checkpoint, metrics, profile, cprofile, mi_bins, mi_binning, xcorr_window, xcorr_step, xcorr_max_lag, top_k, save_scores, stream_chunk_rows, prefetch_depth, prefetch_mb, feature_dtypes, compute_dtype, cascade, score_cache, score_cache_mb):
+    """
+    Applies the metrics to the selected setups and writes the results.
+    """
+    metrics = configure_metrics(metrics, stream_chunk_rows, cascade, mi_bins, mi_binning, xcorr_window, xcorr_step, xcorr_max_lag)
+
+    if db_host is not None or results_file is None:
+        dbpool = connect_db(db_name, db_user, db_passwd, db_port, db_host, db_pool_min, db_pool_max)
+    else:
+        dbpool = None
+
+    profiler = Profiler()
+    trace_source = get_trace_source(source, store, dbpool, db_name, fetch_batch_size, profiler)
+
+    from twisted.internet import reactor
+
+    executor = ComputeExecutor(reactor, workers)
+    writer = ResultWriter(dbpool, db_name, results_file, write_mode == 'replace', write_batch, profiler)
+
+    if checkpoint is not None:
+        checkpoint = Checkpoint(checkpoint)
+
+    context = AnalysisContext(trace_source, dbpool, db_name, writer, executor, resume, checkpoint, metrics, profiler, stream_chunk_rows, top_k,
+        None if save_scores is None else ScoreStore(save_scores), TracePrefetcher(prefetch_depth, prefetch_mb * 1024 * 1024),
+        feature_dtypes, compute_dtype, cascade, get_score_cache(score_cache, score_cache_mb))
+
+    run_reactor(reactor, analyze_setups(reactor, context, select_setup), cprofile)
+
+    if profile is not None:
+        profiler.write_report(profile)
+
+    if cascade is not None:
+        print_cascade_survival(profiler)
+
+    executor.close()
+    if checkpoint is not None:
+        checkpoint.close()
+
+@cli.command('coordinate')
+@click.option('--queue', required=True, type=click.Path(), help='SQLite file of the work queue, created if it does not exist')
+@click.option('--select-setup', default='all', type=str, help='Enter Setup ID if you want a specific setup, "All" otherwise')
+@db_options
+@click.option('--source', default='db', type=click.Choice(['db', 'local']), help='Read the work plan from the DB or from a local trace store')
+@click.option('--store', default=None, type=click.Path(), help='Directory of the local trace store (--source local)')
+@click.option('--lease-seconds', default=DEFAULT_LEASE_SECONDS, type=click.FloatRange(1, None), help='Time after which the shard of a worker that stopped renewing its lease is handed out again')
+def coordinate_command(queue, select_setup, db_name, db_user, db_passwd, db_port, db_host, db_pool_min, db_pool_max, source, store, lease_seconds):
+    """
+    Splits the selected setups into one shard per repetition and puts them
+    into a work queue for the worker command.
+    """
+    dbpool = connect_db(db_name, db_user, db_passwd, db_port, db_host, db_pool_min, db_pool_max) if source == 'db' else None
+    profiler = Profiler()
+    trace_source = get_trace_source(source, store, dbpool, db_name, None, profiler)
+    work_queue = WorkQueue(queue)
+
+    from twisted.internet import reactor
+
+    run_reactor(reactor, fill_work_queue(trace_source, work_queue, select_setup, profiler, lease_seconds))
+    work_queue.close()
+
+@cli.command('worker')
+@click.option('--queue', required=True, type=click.Path(exists=True), help='SQLite file of the work queue written by coordinate')
+@db_options
+@analysis_options
+def worker_command(queue, db_name, db_user, db_passwd, db_port, db_host, db_pool_min, db_pool_max, fetch_batch_size, workers, source, store, metrics, profile, cprofile, mi_bins, mi_binning, xcorr_window, xcorr_step, xcorr_max_lag, top_k, stream_chunk_rows, prefetch_depth, prefetch_mb, feature_dtypes, compute_dtype, cascade, score_cache, score_cache_mb):
+    """
+    Leases shards from the work queue and stores their result counts in it,
+    until every shard is done. Any number of workers can share a queue, all
+    of them have to use the same metric options.
+    """
+    metrics = configure_metrics(metrics, stream_chunk_rows, cascade, mi_bins, mi_binning, xcorr_window, xcorr_step, xcorr_max_lag)
+
+    dbpool = connect_db(db_name, db_user, db_passwd, db_port, db_host, db_pool_min, db_pool_max) if source == 'db' else None
+    profiler = Profiler()
+    trace_source = get_trace_source(source, store, dbpool, db_name, fetch_batch_size, profiler)
+    work_queue = WorkQueue(queue)
+    worker_id = get_worker_id()
+
+    from twisted.internet import reactor
+
+    executor = ComputeExecutor(reactor, workers)
+    context = AnalysisContext(trace_source, dbpool, db_name, None, executor, False, None, metrics, profiler,
+        stream_chunk_rows, top_k, None, TracePrefetcher(prefetch_depth, prefetch_mb * 1024 * 1024), feature_dtypes, compute_dtype, cascade,
+        get_score_cache(score_cache, score_cache_mb))
+
+    print 'Worker ', worker_id
+    run_reactor(reactor, run_worker(reactor, context, work_queue, worker_id), cprofile)
+
+    if profile is not None:
+        profiler.write_report(profile)
+
+    if cascade is not None:
+        print_cascade_survival(profiler)
+
+    executor.close()
+    work_queue.close()
+
+@cli.command('reduce')
+@click.option('--queue', required=True, type=click.Path(exists=True), help='SQLite file of the work queue')
+@db_options
+@click.option('--results-file', default=None, type=click.Path(), help='CSV file for the results if no DB host is given')
+@click.option('--write-mode', default='append', type=click.Choice(['append', 'replace']), help='Append results or replace the existing results of a setup')
+@click.option('--write-batch', default=10, type=click.IntRange(1, None), help='Number of setups whose results are written in one transaction')
+def reduce_command(queue, db_name, db_user, db_passwd, db_port, db_host, db_pool_min, db_pool_max, results_file, write_mode, write_batch):
+    """
+    Writes the results of every setup whose shards are finished, aggregated
+    over its repetitions like analyze does.
+    """
+    if db_host is not None or results_file is None:
+        dbpool = connect_db(db_name, db_user, db_passwd, db_port, db_host, db_pool_min, db_pool_max)
+    else:
+        dbpool = None
+
+    profiler = Profiler()
+    work_queue = WorkQueue(queue)
+    writer = ResultWriter(dbpool, db_name, results_file, write_mode == 'replace', write_batch, profiler)
+    context = AnalysisContext(None, dbpool, db_name, writer, None, False, None, [], profiler)
+
     from twisted.internet import reactor
 
-    deferred = analyze_setups(reactor, dbpool, select_setup, db_name)
-    deferred.addCallback(lambda ign: reactor.stop())
+    run_reactor(reactor, reduce_work_queue(reactor, context, work_queue))
+    work_queue.close()
+
+@cli.command('export-traces')
+@click.option('--select-setup', default='all', type=str, help='Enter Setup ID if you want a specific setup, "All" otherwise')
+@db_options
+@click.option('--store', required=True, type=click.Path(), help='Directory of the local trace store')
+@click.option('--fetch-batch-size', default=10000, type=int, help='Number of trace rows fetched per batch')
+def export_traces_command(select_setup, db_name, db_user, db_passwd, db_port, db_host, db_pool_min, db_pool_max, store, fetch_batch_size):
+    """
+    Dumps the traces of the selected setups into a local trace store.
+    """
+    dbpool = connect_db(db_name, db_user, db_passwd, db_port, db_host, db_pool_min, db_pool_max)
+    profiler = Profiler()
+    db_source = DatabaseTraceSource(dbpool, db_name, fetch_batch_size, profiler)
+    trace_store = TraceStore(store)
+
+    from twisted.internet import reactor
+
+    @defer.inlineCallbacks
+    def run_export():
+        work_plan = yield get_work_plan(db_source, profiler)
+        setup_parameters_list = [build_setup_parameters(setup_id, work_plan.get_setup(setup_id).setup_data, [])
+            for setup_id in select_planned_setups(work_plan, select_setup)]
+
+        yield export_traces(db_source, trace_store, setup_parameters_list, work_plan)
+
+    run_reactor(reactor, run_export())
+
+@cli.command('build-statistics')
+@click.option('--store', required=True, type=click.Path(exists=True), help='Directory of the local trace store')
+def build_statistics_command(store):
+    """
+    Computes the node statistics of the traces in a local trace store that
+    have none, e.g. traces exported before the statistics existed.
+    """
+    trace_store = TraceStore(store)
+    num_updated = trace_store.update_statistics()
+    print 'Updated the statistics of {} traces'.format(num_updated)
+
+@cli.command('fuse')
+@click.option('--scores', required=True, type=click.Path(exists=True), help='Directory written by analyze --save-scores')
+@click.option('--select-setup', default='all', type=str, help='Enter Setup ID if you want a specific setup, "All" otherwise')
+@click.option('--strategy', default='rank', type=click.Choice(FUSION_STRATEGIES), help='Weighted rank aggregation or a linear model on the standardized scores')
+@click.option('--top-k', default=DEFAULT_TOP_K, type=click.IntRange(1, None), help='k of the top-k accuracy')
+@click.option('--output', default=None, type=click.Path(), help='CSV file for the per setup results')
+def fuse_command(scores, select_setup, strategy, top_k, output):
+    """
+    Combines the saved scores of all metrics and features into one guess per
+    client and evaluates it with leave-one-repetition-out cross-validation.
+    No metric is computed again.
+    """
+    score_store = ScoreStore(scores)
+    if select_setup == 'All' or select_setup == 'all':
+        setup_ids = score_store.get_setup_ids()
+    else:
+        setup_ids = [select_setup]
+
+    samples, channels = load_samples(score_store, setup_ids)
+    if len(samples) == 0:
+        raise click.UsageError('no scores stored for the selected setups')
+
+    results, weights = cross_validate(samples, strategy, top_k)
+    rows = get_fusion_rows(results, strategy, top_k)
+
+    print 'Channel weights (mean over the folds)'
+    for channel, weight in sorted(zip(channels, weights), key=lambda item: -abs(item[1])):
+        print '{:<45} {:10.4f}'.format(channel, weight)
+
+    print '{:>8} {:>10} {:>10} {:>10}'.format('setup', 'top1', 'top{}'.format(top_k), 'mrr')
+    for row in rows:
+        print '{:>8} {:10.4f} {:10.4f} {:10.4f}'.format(row[0], row[3], row[4], row[5])
 
-    reactor.run()
+    if output is not None:
+        write_fusion_rows(output, rows)
 
 if __name__ == '__main__':
-    main()
+    cli()
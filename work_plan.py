@@ -0,0 +1,130 @@
+#!/usr/bin/env python
+
+from collections import OrderedDict
+
+class RepetitionPlan():
+    """
+    Row counts of the stored traces of one repetition.
+
+    Constructor Arguments:
+    repetition: number of the repetition
+    node_rows: dict node_id -> number of trace rows, nodes without traces are
+        not in the dict
+    """
+
+    def __init__(self, repetition, node_rows):
+        self.repetition = repetition
+        self.node_rows = node_rows
+
+    def get_num_rows(self):
+        return sum(self.node_rows.itervalues())
+
+    def get_num_clients(self, num_clients):
+        """
+        Number of clients that are analyzed, clients 1..n up to the first
+        client without a trace.
+        """
+        for client_index in xrange(1, num_clients + 1):
+            if self.node_rows.get(client_index, 0) == 0:
+                return client_index - 1
+        return num_clients
+
+    def get_missing_server(self, num_servers):
+        """
+        Node id of the first server without a trace, None if all servers
+        have one.
+        """
+        for server_index in xrange(31, num_servers + 31):
+            if self.node_rows.get(server_index, 0) == 0:
+                return server_index
+        return None
+
+class SetupPlan():
+    """
+    A setups_submission row and the repetitions that have traces.
+
+    Constructor Arguments:
+    setup_id: id of the setup
+    setup_data: (setup, num_clients, repetitions) like the setups_submission
+        table
+    repetitions: dict repetition -> RepetitionPlan
+    """
+
+    def __init__(self, setup_id, setup_data, repetitions):
+        self.setup_id = setup_id
+        self.setup_data = setup_data
+        self.repetitions = repetitions
+
+    def get_repetition(self, repetition):
+        """
+        RepetitionPlan of a repetition, None if it has no traces.
+        """
+        return self.repetitions.get(repetition)
+
+    def get_num_rows(self):
+        return sum(repetition_plan.get_num_rows() for repetition_plan in self.repetitions.itervalues())
+
+class WorkPlan():
+    """
+    Everything analyze needs to know before loading traces: the setups, and
+    per repetition which clients and servers have traces and how many rows.
+    Built from two queries instead of one query per setup and repetition.
+
+    Constructor Arguments:
+    setups: OrderedDict setup_id -> SetupPlan in setup id order
+    """
+
+    def __init__(self, setups):
+        self.setups = setups
+
+    def get_setup_ids(self):
+        return self.setups.keys()
+
+    def get_setup(self, setup_id):
+        """
+        SetupPlan of a setup, None if the setup does not exist. setup_id may
+        be given as string, e.g. from --select-setup.
+        """
+        try:
+            return self.setups.get(int(setup_id))
+        except (TypeError, ValueError):
+            return None
+
+    def get_work_items(self):
+        """
+        (setup_id, repetition, num_rows) of every repetition with traces,
+        largest first, to balance the repetitions over workers.
+        """
+        work_items = []
+        for setup_id, setup_plan in self.setups.iteritems():
+            for repetition, repetition_plan in setup_plan.repetitions.iteritems():
+                work_items.append((setup_id, repetition, repetition_plan.get_num_rows()))
+
+        work_items.sort(key=lambda work_item: (-work_item[2], work_item[0], work_item[1]))
+        return work_items
+
+def build_work_plan(setup_rows, trace_counts):
+    """
+    WorkPlan from the rows (id, setup, num_clients, repetitions) of
+    setups_submission and the rows (setup_id, repetition, node_id, rows) of
+    the grouped trace counts. Traces of setups that are not in
+    setups_submission are ignored.
+    """
+    setups = OrderedDict()
+    for setup_row in sorted(setup_rows, key=lambda setup_row: int(setup_row[0])):
+        setup_id = int(setup_row[0])
+        setups[setup_id] = SetupPlan(setup_id, tuple(setup_row[1:4]), {})
+
+    for setup_id, repetition, node_id, num_rows in trace_counts:
+        setup_plan = setups.get(int(setup_id))
+        if setup_plan is None or num_rows == 0:
+            continue
+
+        repetition_plan = setup_plan.repetitions.get(int(repetition))
+        if repetition_plan is None:
+            repetition_plan = RepetitionPlan(int(repetition), {})
+            setup_plan.repetitions[int(repetition)] = repetition_plan
+
+        repetition_plan.node_rows[int(node_id)] = int(num_rows)
+
+    return WorkPlan(setups)
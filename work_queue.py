@@ -0,0 +1,188 @@
+#!/usr/bin/env python
+
+import json
+import os
+import socket
+import sqlite3
+import time
+
+# a leased shard is handed out again if its worker did not renew the lease
+# for this long, e.g. because the worker crashed
+DEFAULT_LEASE_SECONDS = 600
+# seconds an idle worker waits before it asks again for expired leases
+DEFAULT_POLL_SECONDS = 5
+# seconds a connection waits for the lock of another process
+LOCK_TIMEOUT = 60
+
+PENDING = 'pending'
+LEASED = 'leased'
+DONE = 'done'
+FAILED = 'failed'
+
+QUEUE_SCHEMA = '''
+CREATE TABLE IF NOT EXISTS settings (name TEXT PRIMARY KEY, value TEXT);
+CREATE TABLE IF NOT EXISTS setups (setup_id INTEGER PRIMARY KEY, setup TEXT, num_clients INTEGER, repetitions INTEGER);
+CREATE TABLE IF NOT EXISTS shards (setup_id INTEGER, repetition INTEGER, priority INTEGER, planned INTEGER, state TEXT,
+    worker TEXT, lease_expires REAL, attempts INTEGER, PRIMARY KEY (setup_id, repetition));
+CREATE TABLE IF NOT EXISTS results (setup_id INTEGER, repetition INTEGER, metric_key TEXT, metrics TEXT, top_k INTEGER, counts TEXT,
+    PRIMARY KEY (setup_id, repetition));
+CREATE TABLE IF NOT EXISTS reduced (setup_id INTEGER PRIMARY KEY);
+'''
+
+def get_worker_id():
+    return '{}:{}'.format(socket.gethostname(), os.getpid())
+
+class WorkQueue():
+    """
+    Lease queue of (setup_id, repetition) shards in a SQLite file, shared by
+    the worker processes of a sharded analysis. The coordinator fills it
+    from the work plan, a worker leases a shard, computes it and stores the
+    ResultsArray counts of the repetition. Workers renew their leases while
+    they compute, a lease that is not renewed expires and the shard is
+    leased again. The reduce step reads the counts of every setup once all
+    its shards are done and records the setups it wrote.
+
+    Every state change is one SQLite transaction, so any number of worker
+    processes on the machines that share the file can use the queue.
+
+    Constructor Arguments:
+    path: SQLite file of the queue, created if it does not exist
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.connection = sqlite3.connect(path, timeout=LOCK_TIMEOUT, isolation_level=None)
+        self.connection.executescript(QUEUE_SCHEMA)
+
+    def close(self):
+        self.connection.close()
+
+    def get_lease_seconds(self):
+        row = self.connection.execute('SELECT value FROM settings WHERE name = ?', ('lease_seconds',)).fetchone()
+        return float(row[0]) if row is not None else DEFAULT_LEASE_SECONDS
+
+    def put_work(self, setups, shards, lease_seconds=DEFAULT_LEASE_SECONDS):
+        """
+        Adds setups, a list of (setup_id, setup, num_clients, repetitions),
+        and shards, a list of (setup_id, repetition, planned) in the order
+        they should be leased. planned is False for repetitions whose
+        clients cannot be compared, see has_planned_clients. Shards that are
+        already in the queue keep their state, so a coordinator can run again
+        to add setups, except failed shards, which are leased again.
+        """
+        with self.connection:
+            self.connection.execute('BEGIN IMMEDIATE')
+            self.connection.execute('INSERT OR REPLACE INTO settings VALUES (?, ?)', ('lease_seconds', str(lease_seconds)))
+            self.connection.executemany('INSERT OR REPLACE INTO setups VALUES (?, ?, ?, ?)', setups)
+            self.connection.executemany('INSERT OR IGNORE INTO shards VALUES (?, ?, ?, ?, ?, NULL, NULL, 0)',
+                [(setup_id, repetition, priority, int(planned), PENDING) for priority, (setup_id, repetition, planned) in enumerate(shards)])
+            self.connection.executemany('UPDATE shards SET state = ? WHERE setup_id = ? AND repetition = ? AND state = ?',
+                [(PENDING, setup_id, repetition, FAILED) for setup_id, repetition, planned in shards])
+
+    def get_setup(self, setup_id):
+        """
+        Returns (setup, num_clients, repetitions) like the setups_submission
+        table.
+        """
+        return self.connection.execute('SELECT setup, num_clients, repetitions FROM setups WHERE setup_id = ?', (setup_id,)).fetchone()
+
+    def lease(self, worker_id):
+        """
+        Leases the first pending shard, or a leased one whose lease expired.
+        Returns (setup_id, repetition, planned), None if no shard is free.
+        """
+        now = time.time()
+        with self.connection:
+            self.connection.execute('BEGIN IMMEDIATE')
+            shard = self.connection.execute('SELECT setup_id, repetition, planned FROM shards WHERE state = ? OR (state = ? AND lease_expires < ?) '
+                'ORDER BY priority LIMIT 1', (PENDING, LEASED, now)).fetchone()
+            if shard is None:
+                return None
+
+            self.connection.execute('UPDATE shards SET state = ?, worker = ?, lease_expires = ?, attempts = attempts + 1 WHERE setup_id = ? AND repetition = ?',
+                (LEASED, worker_id, now + self.get_lease_seconds(), shard[0], shard[1]))
+
+        return shard[0], shard[1], bool(shard[2])
+
+    def renew(self, worker_id):
+        """
+        Extends the leases of all shards the worker holds.
+        """
+        with self.connection:
+            self.connection.execute('UPDATE shards SET lease_expires = ? WHERE state = ? AND worker = ?',
+                (time.time() + self.get_lease_seconds(), LEASED, worker_id))
+
+    def complete(self, setup_id, repetition, metric_key, metric_names, top_k, counts):
+        """
+        Stores the (corrects, fails, top_k_hits, reciprocal_ranks) matrices
+        of a repetition and marks its shard done. metric_key identifies the
+        metrics and settings like in the checkpoint, shards computed with
+        other settings are not merged by the reduce step.
+        """
+        with self.connection:
+            self.connection.execute('BEGIN IMMEDIATE')
+            self.connection.execute('INSERT OR REPLACE INTO results VALUES (?, ?, ?, ?, ?, ?)',
+                (setup_id, repetition, metric_key, json.dumps(metric_names), top_k, json.dumps(counts)))
+            self.connection.execute('UPDATE shards SET state = ?, worker = NULL WHERE setup_id = ? AND repetition = ?', (DONE, setup_id, repetition))
+
+    def fail(self, setup_id, repetition):
+        """
+        Marks a shard whose computation failed. Like in analyze, the
+        repetition is left out of the results of its setup.
+        """
+        with self.connection:
+            self.connection.execute('UPDATE shards SET state = ?, worker = NULL WHERE setup_id = ? AND repetition = ? AND state != ?',
+                (FAILED, setup_id, repetition, DONE))
+
+    def get_state_counts(self):
+        """
+        Dict state -> number of shards.
+        """
+        return dict(self.connection.execute('SELECT state, COUNT(*) FROM shards GROUP BY state').fetchall())
+
+    def is_finished(self):
+        counts = self.get_state_counts()
+        return counts.get(PENDING, 0) == 0 and counts.get(LEASED, 0) == 0
+
+    def get_finished_setups(self):
+        """
+        Ids of the setups without pending or leased shards, including setups
+        without any shard.
+        """
+        rows = self.connection.execute('SELECT setups.setup_id FROM setups LEFT JOIN shards ON shards.setup_id = setups.setup_id '
+            'GROUP BY setups.setup_id HAVING COALESCE(SUM(state = ? OR state = ?), 0) = 0 ORDER BY setups.setup_id', (PENDING, LEASED)).fetchall()
+        return [row[0] for row in rows]
+
+    def get_failed_repetitions(self, setup_id):
+        rows = self.connection.execute('SELECT repetition FROM shards WHERE setup_id = ? AND state = ? ORDER BY repetition', (setup_id, FAILED)).fetchall()
+        return [row[0] for row in rows]
+
+    def get_result_settings(self):
+        """
+        (metric_names, top_k) of a completed repetition, for the setups
+        without any, None if no repetition is completed.
+        """
+        row = self.connection.execute('SELECT metrics, top_k FROM results LIMIT 1').fetchone()
+        if row is None:
+            return None
+        return json.loads(row[0]), row[1]
+
+    def mark_reduced(self, setup_ids):
+        with self.connection:
+            self.connection.execute('BEGIN IMMEDIATE')
+            self.connection.executemany('INSERT OR IGNORE INTO reduced VALUES (?)', [(setup_id,) for setup_id in setup_ids])
+
+    def get_reduced_setups(self):
+        """
+        Set of the ids of the setups whose results the reduce step wrote.
+        """
+        return set(row[0] for row in self.connection.execute('SELECT setup_id FROM reduced').fetchall())
+
+    def get_results(self, setup_id):
+        """
+        List of (repetition, metric_key, metric_names, top_k, counts) of the
+        completed repetitions of a setup, by repetition.
+        """
+        rows = self.connection.execute('SELECT repetition, metric_key, metrics, top_k, counts FROM results WHERE setup_id = ? ORDER BY repetition',
+            (setup_id,)).fetchall()
+        return [(repetition, metric_key, json.loads(metric_names), top_k, json.loads(counts)) for repetition, metric_key, metric_names, top_k, counts in rows]